@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Stands in for smart-phase when benchmarking phase-pipeline, phasing every
+adjacent pair in the unmarked (heterozygous) candidate blocks as cis.
+Takes smart-phase's -g (bed) and -o (output) options, others are ignored.
+"""
+import sys
+
+
+def main(argv):
+    args = dict(zip(argv[::2], argv[1::2]))
+    with open(args["-g"]) as bedin, open(args["-o"], "w") as out:
+        for line in bedin:
+            fields = line.rstrip().split("\t")
+            if len(fields) > 3:
+                continue
+            (contig, start, end) = (fields[0], int(fields[1]), int(fields[2]))
+            for pos in range(start + 1, end):
+                out.write(
+                    f"1-{start}-{end}\t{contig}-{pos}-N-N\t{contig}-{pos + 1}-N-N\t1\t0.9\n"
+                )
+        out.write("Denovo count: 0\n")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
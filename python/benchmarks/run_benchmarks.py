@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Benchmark the stages of generate-bed and merge-mnvs on synthetic data,
+recording throughput and peak memory and comparing against a stored
+baseline. Each benchmark runs in a fresh process so its peak RSS is its own.
+
+Run from the python directory:
+
+    python benchmarks/run_benchmarks.py --records 1000000
+"""
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from collections import Counter
+from functools import partial
+from typing import Dict
+
+import click
+import synthetic_data
+import vcfpy
+from casmsmartphase import phase_pipeline
+from casmsmartphase import sphase_bulk
+from casmsmartphase import vcf_to_bed
+from casmsmartphase.hom_blocks import load_hom_blocks
+from casmsmartphase.MNVMerge import MNVMerge
+from casmsmartphase.MNVMerge import parse_phased_lines
+from casmsmartphase.MNVMerge import parse_sphase_output
+from casmsmartphase.vcf_lines import split_chrom_pos
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+FAKE_SMART_PHASE = os.path.join(BENCHMARK_DIR, "fake_smart_phase.py")
+CUTOFF = 0.0
+EXCLUDE = 2
+# MNV lengths and the number of records merged by bench_merge_snv_to_mnv_length
+MNV_LENGTHS = (2, 8, 32, 64)
+MNV_LENGTH_RECORDS = 25600
+
+
+def bench_parse_vcf(data: Dict, workdir: str) -> int:
+    with open(os.path.join(workdir, "parse_vcf.bed"), "w") as out:
+        reader = vcfpy.Reader.from_path(data["vcf"])
+        vcf_to_bed.parse_vcf(reader, out, True)
+    return data["records"]
+
+
+def bench_generate_bed(data: Dict, workdir: str) -> int:
+    vcf_to_bed.run_parse(data["vcf"], os.path.join(workdir, "generate_bed.bed"), True)
+    return data["records"]
+
+
+def bench_generate_bed_columnar(data: Dict, workdir: str) -> int:
+    vcf_to_bed.run_parse(
+        data["vcf"], os.path.join(workdir, "columnar.bed"), True, columnar=True
+    )
+    return data["records"]
+
+
+def bench_generate_bed_all_samples(data: Dict, workdir: str) -> int:
+    vcf_to_bed.run_parse(
+        data["vcf"], os.path.join(workdir, "{sample}.bed"), True, sample=("all",)
+    )
+    return data["records"]
+
+
+def bench_parse_sphase_output(data: Dict, _workdir: str) -> int:
+    hom_blocks = load_hom_blocks(data["bed"])
+    parse_sphase_output(data["smart_phase_output"], CUTOFF, EXCLUDE, hom_blocks)
+    return sum(block[2] - block[1] - 1 for block in data["blocks"] if block[3])
+
+
+def bench_load_hom_blocks(data: Dict, _workdir: str) -> int:
+    load_hom_blocks(data["bed"])
+    return sum(1 for block in data["blocks"] if block[3])
+
+
+def bench_parse_phased_lines(data: Dict, _workdir: str) -> int:
+    counts = Counter()
+    with open(data["smart_phase_output"]) as lines:
+        for _pair in parse_phased_lines(lines, CUTOFF, EXCLUDE, counts):
+            pass
+    return sum(counts.values())
+
+
+def bench_parse_pair_file(data: Dict, _workdir: str) -> int:
+    counts = Counter()
+    sphase_bulk.parse_pair_file(
+        data["smart_phase_output"], CUTOFF, EXCLUDE, parse_phased_lines, counts
+    )
+    return sum(counts.values())
+
+
+def bench_merge_snv_to_mnv(data: Dict, workdir: str):
+    merger = MNVMerge(
+        data["vcf"],
+        os.path.join(workdir, "unused.vcf"),
+        data["smart_phase_output"],
+        CUTOFF,
+        EXCLUDE,
+        "run_benchmarks.py",
+        "",
+    )
+    # Only the merge of parsed records is timed
+    ends = {(contig, start + 1): end for (contig, start, end, *_) in data["blocks"]}
+    parser = merger.vcfin.parser
+    mnvs = []
+    run = []
+    for line in merger.vcfin_records:
+        (contig, pos) = split_chrom_pos(line)
+        if run:
+            run.append(parser.parse_line(line))
+            if pos == end:
+                mnvs.append(run)
+                run = []
+        elif (contig, pos) in ends:
+            end = ends[(contig, pos)]
+            run = [parser.parse_line(line)]
+    start = time.perf_counter()
+    for snvs in mnvs:
+        merger.merge_snv_to_mnv(snvs)
+    return sum(map(len, mnvs)), time.perf_counter() - start
+
+
+def bench_merge_snv_to_mnv_length(length: int, data: Dict, workdir: str):
+    """
+    Merge groups of length records as MNVs, the records per second should be
+    the same at each length as merging is linear in MNV length
+    """
+    merger = MNVMerge(
+        data["vcf"],
+        os.path.join(workdir, "unused.vcf"),
+        data["smart_phase_output"],
+        CUTOFF,
+        EXCLUDE,
+        "run_benchmarks.py",
+        "",
+    )
+    parser = merger.vcfin.parser
+    snvs = [
+        parser.parse_line(line)
+        for (_i, line) in zip(range(MNV_LENGTH_RECORDS), merger.vcfin_records)
+    ]
+    mnvs = [snvs[i : i + length] for i in range(0, len(snvs) - length + 1, length)]
+    start = time.perf_counter()
+    for mnv in mnvs:
+        merger.merge_snv_to_mnv(mnv)
+    return sum(map(len, mnvs)), time.perf_counter() - start
+
+
+def bench_perform_mnv_merge_to_vcf(data: Dict, workdir: str) -> int:
+    MNVMerge(
+        data["vcf"],
+        os.path.join(workdir, "merged.vcf"),
+        data["smart_phase_output"],
+        CUTOFF,
+        EXCLUDE,
+        "run_benchmarks.py",
+        "",
+        data["bed"],
+    ).perform_mnv_merge_to_vcf()
+    return data["records"]
+
+
+def bench_perform_mnv_merge_to_vcf_pipelined(data: Dict, workdir: str) -> int:
+    MNVMerge(
+        data["vcf"],
+        os.path.join(workdir, "merged_pipelined.vcf"),
+        data["smart_phase_output"],
+        CUTOFF,
+        EXCLUDE,
+        "run_benchmarks.py",
+        "",
+        data["bed"],
+        pipelined=True,
+    ).perform_mnv_merge_to_vcf()
+    return data["records"]
+
+
+def bench_phase_pipeline(data: Dict, workdir: str) -> int:
+    phase_pipeline.run(
+        data["vcf"],
+        os.path.join(workdir, "pipeline.vcf"),
+        f"{sys.executable} {FAKE_SMART_PHASE} -a {{vcf}} -g {{bed}} -o {{output}}",
+        CUTOFF,
+        EXCLUDE,
+        True,
+        "",
+    )
+    return data["records"]
+
+
+BENCHMARKS = {
+    "parse_vcf": bench_parse_vcf,
+    "generate_bed": bench_generate_bed,
+    "generate_bed_columnar": bench_generate_bed_columnar,
+    "generate_bed_all_samples": bench_generate_bed_all_samples,
+    "parse_sphase_output": bench_parse_sphase_output,
+    "load_hom_blocks": bench_load_hom_blocks,
+    "parse_phased_lines": bench_parse_phased_lines,
+    "parse_pair_file": bench_parse_pair_file,
+    "merge_snv_to_mnv": bench_merge_snv_to_mnv,
+    **{
+        f"merge_snv_to_mnv_length_{length}": partial(
+            bench_merge_snv_to_mnv_length, length
+        )
+        for length in MNV_LENGTHS
+    },
+    "perform_mnv_merge_to_vcf": bench_perform_mnv_merge_to_vcf,
+    "perform_mnv_merge_to_vcf_pipelined": bench_perform_mnv_merge_to_vcf_pipelined,
+    "phase_pipeline": bench_phase_pipeline,
+}
+
+
+def run_benchmark(name: str, data: Dict, workdir: str) -> Dict:
+    """
+    Run a single benchmark, called in its own process. Benchmarks return
+    the records processed, or the records and the seconds of the timed part
+    where setup is excluded.
+    """
+    start = time.perf_counter()
+    result = BENCHMARKS[name](data, workdir)
+    seconds = time.perf_counter() - start
+    if isinstance(result, tuple):
+        (records, seconds) = result
+    else:
+        records = result
+    return {
+        "records": records,
+        "seconds": round(seconds, 4),
+        "records_per_second": round(records / seconds, 1) if seconds else None,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> Dict[str, str]:
+    """
+    Regressions against the baseline, slower throughput or larger peak
+    memory by more than tolerance
+    """
+    regressions = {}
+    for (name, result) in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["records_per_second"] < base["records_per_second"] * (1 - tolerance):
+            regressions[name] = (
+                f"{result['records_per_second']:.0f} records/s vs baseline "
+                f"{base['records_per_second']:.0f}"
+            )
+        elif result["peak_rss_kb"] > base["peak_rss_kb"] * (1 + tolerance):
+            regressions[name] = (
+                f"peak RSS {result['peak_rss_kb']} KB vs baseline "
+                f"{base['peak_rss_kb']} KB"
+            )
+    return regressions
+
+
+@click.command()
+@click.option("-n", "--records", default=200000, show_default=True, type=int)
+@click.option("--seed", default=0, show_default=True, type=int)
+@click.option("--adjacent-fraction", default=0.2, show_default=True, type=float)
+@click.option("--hom-fraction", default=0.1, show_default=True, type=float)
+@click.option(
+    "-b",
+    "--benchmark",
+    "benchmarks",
+    multiple=True,
+    type=click.Choice(list(BENCHMARKS)),
+    help="Benchmarks to run [default: all]",
+)
+@click.option(
+    "--baseline",
+    default=DEFAULT_BASELINE,
+    show_default=True,
+    type=click.Path(dir_okay=False),
+)
+@click.option("--save-baseline", is_flag=True, help="Store the results as baseline")
+@click.option(
+    "--tolerance",
+    default=0.3,
+    show_default=True,
+    type=float,
+    help="Fraction of the baseline a result may be worse by before failing",
+)
+@click.option("-o", "--output", type=click.Path(dir_okay=False), help="Results JSON")
+@click.option(
+    "-w",
+    "--workdir",
+    type=click.Path(file_okay=False),
+    help="Keep the synthetic data and outputs in this directory",
+)
+def main(
+    records,
+    seed,
+    adjacent_fraction,
+    hom_fraction,
+    benchmarks,
+    baseline,
+    save_baseline,
+    tolerance,
+    output,
+    workdir,
+):
+    """
+    Benchmark generate-bed and merge-mnvs stages on synthetic data
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = workdir or tmpdir
+        os.makedirs(workdir, exist_ok=True)
+        data = synthetic_data.generate_dataset(
+            workdir,
+            records,
+            seed=seed,
+            adjacent_fraction=adjacent_fraction,
+            hom_fraction=hom_fraction,
+        )
+        results = {}
+        context = multiprocessing.get_context("spawn")
+        for name in benchmarks or BENCHMARKS:
+            with context.Pool(1) as pool:
+                results[name] = pool.apply(run_benchmark, (name, data, workdir))
+            click.echo(
+                f"{name:<26}{results[name]['records']:>10} records "
+                f"{results[name]['seconds']:>9.3f}s "
+                f"{results[name]['records_per_second']:>11.0f}/s "
+                f"{results[name]['peak_rss_kb']:>9} KB"
+            )
+    run = {
+        "records": records,
+        "seed": seed,
+        "adjacent_fraction": adjacent_fraction,
+        "hom_fraction": hom_fraction,
+        "benchmarks": results,
+    }
+    if output:
+        with open(output, "w") as out:
+            json.dump(run, out, indent=2)
+            out.write("\n")
+    if save_baseline:
+        with open(baseline, "w") as out:
+            json.dump(run, out, indent=2)
+            out.write("\n")
+        return
+    if not os.path.exists(baseline):
+        return
+    with open(baseline) as basein:
+        stored = json.load(basein)
+    params = ("records", "seed", "adjacent_fraction", "hom_fraction")
+    if any(stored[param] != run[param] for param in params):
+        click.echo("Baseline was run with different data parameters, not compared")
+        return
+    regressions = compare(results, stored["benchmarks"], tolerance)
+    for (name, message) in regressions.items():
+        click.echo(f"REGRESSION {name}: {message}", err=True)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
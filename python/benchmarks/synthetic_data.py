@@ -0,0 +1,191 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Deterministic generators of CaVEMan style tumour/normal VCFs, with
+matching smart-phase output and candidate bed files, for benchmarking
+"""
+import os
+import random
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import pysam
+
+# Relative frequency of each length of run of adjacent SNVs
+DEFAULT_MNV_LENGTHS = {2: 85, 3: 10, 4: 4, 5: 1}
+DEFAULT_CONTIGS = {"chr1": 248956422, "chr2": 242193529, "chrX": 156040895}
+VCF_NAME = "synthetic.vcf"
+SPHASE_NAME = "synthetic.phased.output"
+BED_NAME = "synthetic.bed"
+HEADER = """##fileformat=VCFv4.1
+##vcfProcessLog=<InputVCF=<.>,InputVCFSource=<CaVEMan>,InputVCFParam=<SNP_CUTOFF=0.95>>
+##cavemanVersion=1.15.1
+##INFO=<ID=DP,Number=1,Type=Integer,Description="Total Depth">
+##INFO=<ID=MP,Number=1,Type=Float,Description="Sum of CaVEMan somatic genotype probabilities">
+##INFO=<ID=GP,Number=1,Type=Float,Description="Sum of CaVEMan germline genotype probabilities">
+##INFO=<ID=TG,Number=1,Type=String,Description="Most probable genotype as called by CaVEMan">
+##INFO=<ID=TP,Number=1,Type=Float,Description="Probability of most probable genotype as called by CaVEMan">
+##INFO=<ID=SG,Number=1,Type=String,Description="2nd most probable genotype as called by CaVEMan">
+##INFO=<ID=SP,Number=1,Type=Float,Description="Probability of 2nd most probable genotype as called by CaVEMan">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##FORMAT=<ID=FAZ,Number=1,Type=Integer,Description="Reads presenting a A for this position, forward strand">
+##FORMAT=<ID=FCZ,Number=1,Type=Integer,Description="Reads presenting a C for this position, forward strand">
+##FORMAT=<ID=FGZ,Number=1,Type=Integer,Description="Reads presenting a G for this position, forward strand">
+##FORMAT=<ID=FTZ,Number=1,Type=Integer,Description="Reads presenting a T for this position, forward strand">
+##FORMAT=<ID=RAZ,Number=1,Type=Integer,Description="Reads presenting a A for this position, reverse strand">
+##FORMAT=<ID=RCZ,Number=1,Type=Integer,Description="Reads presenting a C for this position, reverse strand">
+##FORMAT=<ID=RGZ,Number=1,Type=Integer,Description="Reads presenting a G for this position, reverse strand">
+##FORMAT=<ID=RTZ,Number=1,Type=Integer,Description="Reads presenting a T for this position, reverse strand">
+##FORMAT=<ID=PM,Number=1,Type=Float,Description="Proportion of mut allele">
+##SAMPLE=<ID=NORMAL,Description="Normal",Accession=.,Platform=ILLUMINA,Protocol=WGS,SampleName=NORMAL,Source=.>
+##SAMPLE=<ID=TUMOUR,Description="Tumour",Accession=.,Platform=ILLUMINA,Protocol=WGS,SampleName=TUMOUR,Source=.>
+"""
+COLUMNS = "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNORMAL\tTUMOUR\n"
+INFO = "DP=105;MP=1.0e+00;GP=2.6e-18;TG=GG/AGGGG;TP=9.9e-01;SG=GG/AAGGG;SP=7.1e-03"
+FORMAT = "GT:FAZ:FCZ:FGZ:FTZ:RAZ:RCZ:RGZ:RTZ:PM"
+NORMAL = "0|0:0:0:32:0:0:0:32:0:0.0e+00"
+TUMOUR_HET = "0|1:3:0:23:0:3:0:12:0:1.5e-01"
+TUMOUR_HOM = "1|1:15:0:0:0:13:0:0:0:1.0e+00"
+BASES = "ACGT"
+
+# A block of adjacent SNVs (contig, bed start, end, is_het, is_trans)
+Block = Tuple[str, int, int, bool, bool]
+
+
+def sphase_lines(block: Block) -> List[str]:
+    """
+    smart-phase output lines phasing each adjacent pair of a block, as cis
+    or as trans
+    """
+    (contig, start, end, _is_het, is_trans) = block
+    flag = 2 if is_trans else 1
+    return [
+        f"1-{start}-{end}\t{contig}-{pos}-N-N\t{contig}-{pos + 1}-N-N\t{flag}\t0.9\n"
+        for pos in range(start + 1, end)
+    ]
+
+
+def bed_line(block: Block) -> str:
+    """
+    Candidate bed line of a block, homozygous blocks marked as with
+    generate-bed --markhz
+    """
+    (contig, start, end, is_het, _is_trans) = block
+    return f"{contig}\t{start}\t{end}{'' if is_het else chr(9) * 2 + 'hom'}\n"
+
+
+def generate_dataset(
+    outdir: str,
+    n_records: int,
+    seed: int = 0,
+    adjacent_fraction: float = 0.2,
+    hom_fraction: float = 0.1,
+    trans_fraction: float = 0.05,
+    mnv_lengths: Optional[Dict[int, int]] = None,
+    contigs: Optional[Dict[str, int]] = None,
+) -> Dict[str, object]:
+    """
+    Write a CaVEMan style VCF (plain and bgzipped with a tabix index) of
+    about n_records SNVs spread over contigs, a smart-phase output phasing
+    the heterozygous blocks of adjacent SNVs and the candidate bed with
+    homozygous blocks marked. adjacent_fraction of the records are in
+    blocks, with lengths drawn from mnv_lengths. The same arguments always
+    give the same files.
+    Returns the paths written, the blocks and the number of records.
+    """
+    rng = random.Random(seed)
+    mnv_lengths = mnv_lengths or DEFAULT_MNV_LENGTHS
+    contigs = contigs or DEFAULT_CONTIGS
+    lengths = list(mnv_lengths)
+    weights = [mnv_lengths[length] for length in lengths]
+    mean_length = sum(ln * w for (ln, w) in zip(lengths, weights)) / sum(weights)
+    # Chance an event is a block, giving adjacent_fraction of records in blocks
+    block_chance = adjacent_fraction / (
+        adjacent_fraction + (1 - adjacent_fraction) * mean_length
+    )
+    genome = sum(contigs.values())
+    vcf = os.path.join(outdir, VCF_NAME)
+    blocks = []
+    n_written = 0
+    with open(vcf, "w") as out:
+        out.write(HEADER)
+        for (contig, length) in contigs.items():
+            out.write(f"##contig=<ID={contig},length={length}>\n")
+        out.write(COLUMNS)
+        for (contig, contig_length) in contigs.items():
+            contig_records = round(n_records * contig_length / genome)
+            max_gap = max(3, 2 * contig_length // max(1, contig_records) - 2)
+            pos = 0
+            written = 0
+            while written < contig_records:
+                pos += rng.randint(2, max_gap)
+                length = 1
+                is_het = True
+                if rng.random() < block_chance:
+                    length = rng.choices(lengths, weights)[0]
+                    is_het = rng.random() >= hom_fraction
+                if pos + length > contig_length:
+                    break
+                tumour = TUMOUR_HET if is_het else TUMOUR_HOM
+                for snv_pos in range(pos, pos + length):
+                    ref = rng.choice(BASES)
+                    alt = BASES[(BASES.index(ref) + rng.randint(1, 3)) % 4]
+                    n_written += 1
+                    out.write(
+                        f"{contig}\t{snv_pos}\tsnv{n_written}\t{ref}\t{alt}\t.\t.\t"
+                        f"{INFO}\t{FORMAT}\t{NORMAL}\t{tumour}\n"
+                    )
+                if length > 1:
+                    is_trans = is_het and rng.random() < trans_fraction
+                    blocks.append((contig, pos - 1, pos + length - 1, is_het, is_trans))
+                pos += length - 1
+                written += length
+    pysam.tabix_compress(vcf, vcf + ".gz", force=True)
+    pysam.tabix_index(vcf + ".gz", preset="vcf", force=True)
+    sphase = os.path.join(outdir, SPHASE_NAME)
+    with open(sphase, "w") as out:
+        for block in blocks:
+            if block[3]:
+                out.writelines(sphase_lines(block))
+        out.write("Denovo count: 0\n")
+    bed = os.path.join(outdir, BED_NAME)
+    with open(bed, "w") as out:
+        out.writelines(bed_line(block) for block in blocks)
+    return {
+        "vcf": vcf,
+        "vcf_gz": vcf + ".gz",
+        "smart_phase_output": sphase,
+        "bed": bed,
+        "blocks": blocks,
+        "records": n_written,
+    }
@@ -33,39 +33,120 @@ Python module for methods reading/parsing and merging MNVs in an
 unflagged (not post processed) CaVEMan generated VCF
 """
 import datetime
+import io
 import logging
 import os
 import re
+from collections import Counter
 from itertools import groupby
+from operator import itemgetter
+from typing import Any
 from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
+from typing import Sequence
 from typing import Tuple
+from typing import Union
 
 LOGGER = logging.getLogger(__name__)
 
 import vcfpy
+from casmsmartphase import bgzf
+from casmsmartphase import checkpoint as merge_checkpoint
+from casmsmartphase import incremental
+from casmsmartphase import mnv_cache
+from casmsmartphase import parallel
+from casmsmartphase import regions as region_utils
+from casmsmartphase import sphase_bulk
+from casmsmartphase import sphase_index
+from casmsmartphase import stdio
+from casmsmartphase import threaded
+from casmsmartphase.checkpoint import MergeCheckpoint
+from casmsmartphase.hom_blocks import as_hom_blocks
+from casmsmartphase.hom_blocks import iter_blocks
+from casmsmartphase.hom_blocks import load_hom_blocks
+from casmsmartphase.mnv_chains import ContigMNVs
+from casmsmartphase.mnv_chains import MNVChainBuilder
+from casmsmartphase.regions import Region
+from casmsmartphase.stats import iter_tracked
+from casmsmartphase.stats import Progress
+from casmsmartphase.stats import RunStats
+from casmsmartphase.streaming import ContigOrder
+from casmsmartphase.streaming import merge_sorted
+from casmsmartphase.streaming import sorted_mnvs
+from casmsmartphase.streaming import SortedMNVStream
+from casmsmartphase.vcf_lines import open_vcf_records
+from casmsmartphase.vcf_lines import split_chrom_pos
 
 # Setup base variables for the VCF process line
 BASE_VCF_PROCESS_KEY = "vcfProcessLog"
 BASE_VCF_PROCESS_LOG = "<InputVCF=<{}>,InputVCFSource=<{}>,InputVCFParam=<{}>>"
+# Encodings of the per base values of merged MNVs. incremental adds KEY_1 to
+# KEY_n fields for each base, compact lists the values of each base under the
+# original keys
+MNV_ENCODINGS = ("incremental", "compact")
 
 
-def parse_homs_bed_to_dict(bed_file: str) -> Dict:
-    bed_entries_by_contig = dict()
-    with open(bed_file, "r") as read_bed:
+def group_mnv_runs(
+    entries: Iterable[Tuple[str, int, Any]], mnvs: Dict
+) -> Iterator[Tuple[Any, bool]]:
+    """
+    Iterate through (contig, position, entry) tuples, yielding (entry, False)
+    for each entry not part of an MNV in mnvs and (list of entries, True) for
+    each MNV to merge.
+    Entries of an MNV that is not completed in the input are yielded
+    unmerged.
+    """
+    run = []
+    run_contig = None
+    mnv_end = 0
+    for (contig, pos, entry) in entries:
+        if run and (contig != run_contig or pos > mnv_end):
+            for unmerged in run:
+                yield unmerged, False
+            run = []
+        contig_mnvs = mnvs.get(contig)
+        # Start position in an mnv
+        if contig_mnvs is not None and pos in contig_mnvs:
+            mnv_end = contig_mnvs[pos]
+            run_contig = contig
+            run.append(entry)
+        # In an MNV and waiting for finish
+        elif run:
+            run.append(entry)
+            if pos == mnv_end:
+                yield run, True
+                run = []
+        else:
+            yield entry, False
+    for unmerged in run:
+        yield unmerged, False
+
+
+def iter_hom_blocks(bed_file: str) -> Iterator[Tuple[str, int, int]]:
+    """
+    Iterate through the blocks of adjacent SNVs marked homozygous in a bed
+    file, yielding (contig, 1-based start, end) of each in file order
+    """
+    with stdio.open_input(bed_file) as read_bed:
         line = read_bed.readline()
         while line:
             line = line.rstrip()
             split_line = line.split("\t")
-            print(split_line)
             hom = False if len(split_line) == 3 else True
             if hom:
-                bed_entry = (int(split_line[1]) + 1, int(split_line[2]), hom)
-                if split_line[0] not in bed_entries_by_contig:
-                    bed_entries_by_contig[split_line[0]] = []
-                bed_entries_by_contig[split_line[0]].append(bed_entry)
+                yield (split_line[0], int(split_line[1]) + 1, int(split_line[2]))
             line = read_bed.readline()
+
+
+def parse_homs_bed_to_dict(bed_file: str) -> Dict:
+    bed_entries_by_contig = dict()
+    for (contig, start, end) in iter_hom_blocks(bed_file):
+        if contig not in bed_entries_by_contig:
+            bed_entries_by_contig[contig] = []
+        bed_entries_by_contig[contig].append((start, end, True))
     return bed_entries_by_contig
 
 
@@ -103,80 +184,324 @@ def all_equal(iterable):
     return next(g, True) and not next(g, False)
 
 
+def parse_phased_lines(
+    lines: Iterable[str],
+    cutoff: float,
+    exclude_flags: int,
+    counts: Optional[Counter] = None,
+) -> Iterator[Tuple[str, int, int]]:
+    """
+    Parse lines of smart-phase output, yielding (contig, start, end) of each
+    phased pair of adjacent SNVs passing the cutoff and exclude flags, in
+    order. Pairs accepted, filtered and skipped are added to counts.
+    """
+    (accepted, filtered, skipped) = (0, 0, 0)
+    for line in lines:
+        if line.startswith("Denovo count"):
+            break
+        line = line.rstrip()
+        try:
+            (mnv_id, pair1, pair2, flag, confidence) = re.split(r"\s+", line, 5)
+            (_id_contig, _id_start_region, _id_stop) = mnv_id.split("-")
+            if float(confidence) < cutoff or int(flag) & exclude_flags:
+                filtered += 1
+                continue
+            (contig, startpos, _tmp) = pair1.split("-", maxsplit=2)
+            (contig, endpos, _tmp) = pair2.split("-", maxsplit=2)
+            startpos = int(startpos)
+            endpos = int(endpos)
+            if startpos + 1 != endpos:
+                # Skip as non-adjacent pair test
+                skipped += 1
+                continue
+
+        # Possibly a non phased entry, check for length 2 when split before erroring
+        except ValueError as err:  # Possibly a non phased entry, check for length 2 when split before erroring
+            if len(re.split(r"\s+", line)) != 2:
+                raise ValueError(
+                    f"Error encountered parsing smart-phase output at line {line}.\nOriginal error {err}"
+                )
+            LOGGER.info(f"Skipping line of only 2 items, not a phased variant {line}")
+            skipped += 1
+            continue
+        accepted += 1
+        yield (contig, startpos, endpos)
+    if counts is not None:
+        counts["pairs_accepted"] += accepted
+        counts["pairs_filtered"] += filtered
+        counts["pairs_skipped"] += skipped
+
+
+def iter_phased_pairs(
+    sphaseout: str,
+    cutoff: float,
+    exclude_flags: int,
+    counts: Optional[Counter] = None,
+    regions: Optional[List[Region]] = None,
+) -> Iterator[Tuple[str, int, int]]:
+    """
+    Iterate through smart-phase output, yielding (contig, start, end) of each
+    phased pair of adjacent SNVs passing the cutoff and exclude flags, in
+    file order. sphaseout may be - for stdin or a named pipe. Given regions,
+    only the segments of a regular file with pairs in the regions are read,
+    through its sidecar index.
+    """
+    if regions is not None and not stdio.is_stream(sphaseout):
+        lines = sphase_index.iter_region_lines(sphaseout, regions)
+        yield from parse_phased_lines(lines, cutoff, exclude_flags, counts)
+        return
+    if stdio.is_stdio(sphaseout):
+        readspout = stdio.open_stdin()
+    else:
+        readspout = open(sphaseout, "r")
+    with readspout:
+        yield from parse_phased_lines(readspout, cutoff, exclude_flags, counts)
+
+
 def parse_sphase_output(
-    sphaseout: str, cutoff: float, exclude_flags: int, hom_bed_parsed: Dict
-) -> Tuple[Dict, int]:
-    mnvs = {}
-    max_len = 1
-    with open(sphaseout, "r") as readspout:
-        while True:
-            line = readspout.readline()
-            if not line or line.startswith("Denovo count"):
-                break
-            line = line.rstrip()
-            try:
-                (mnv_id, pair1, pair2, flag, confidence) = re.split(r"\s+", line, 5)
-                (_id_contig, id_start_region, _id_stop) = mnv_id.split("-")
-                print(_id_contig, id_start_region, _id_stop)
-                if float(confidence) < cutoff or int(flag) & exclude_flags:
-                    continue
-                (contig, startpos, _tmp) = pair1.split("-", maxsplit=2)
-                (contig, endpos, _tmp) = pair2.split("-", maxsplit=2)
-                startpos = int(startpos)
-                endpos = int(endpos)
-                if startpos + 1 != endpos:
-                    # Skip as non-adjacent pair test
-                    continue
-                if not contig in mnvs:
-                    mnvs[contig] = {}
-                # Check for adjacent MNV
-                if startpos in mnvs[contig].values():
-                    # Check if startpos in mnv_id is already stored and see if these are adjacent to an already recorded MNV
-                    # Find key for mnv that adjoins this one
-                    key = None
-                    for k, v in mnvs[contig].items():
-                        if v == startpos:
-                            key = k
-                            break
-                    # Check if current end_pos is adjacent, if so, extend this MNV
-                    mnvs[contig][key] = endpos
-                    mnv_len = (endpos - key) + 1
-                    if max_len < mnv_len:
-                        max_len = mnv_len
-                else:
-                    # Otherwise this is a new MNV
-                    mnvs[contig][startpos] = endpos
-                    mnv_len = (endpos - startpos) + 1
-                    if max_len < mnv_len:
-                        max_len = mnv_len
-
-            # Possibly a non phased entry, check for length 2 when split before erroring
-            except ValueError as err:  # Possibly a non phased entry, check for length 2 when split before erroring
-                if len(re.split(r"\s+", line)) != 2:
-                    raise ValueError(
-                        f"Error encountered parsing smart-phase output at line {line}.\nOriginal error {err}"
-                    )
-                LOGGER.info(
-                    f"Skipping line of only 2 items, not a phased variant {line}"
+    sphaseout: Union[str, Sequence[str]],
+    cutoff: float,
+    exclude_flags: int,
+    hom_bed_parsed: Optional[Dict],
+    counts: Optional[Counter] = None,
+    regions: Optional[List[Region]] = None,
+    workers: int = 1,
+) -> Tuple[Dict[str, ContigMNVs], int]:
+    """
+    Build the MNVs of phased pairs of smart-phase output and the homozygous
+    blocks hom_bed_parsed, a HomBlocks or in the format of
+    parse_homs_bed_to_dict. sphaseout may be several files, e.g. the output
+    of each shard of a bed, whose pairs are merged as one phased set.
+    """
+    builder = MNVChainBuilder()
+    for path in stdio.as_paths(sphaseout):
+        if regions is None and not stdio.is_stream(path):
+            # A whole file is parsed in bulk, across workers processes
+            pairs = sphase_bulk.iter_pairs(
+                sphase_bulk.parse_pair_file(
+                    path, cutoff, exclude_flags, parse_phased_lines, counts, workers
                 )
-                continue
+            )
+        else:
+            pairs = iter_phased_pairs(path, cutoff, exclude_flags, counts, regions)
+        for (contig, startpos, endpos) in pairs:
+            builder.add_pair(contig, startpos, endpos)
     # Add the mnv's that are hom to the MNV list
-    if hom_bed_parsed:
-        for contig in hom_bed_parsed.keys():
-            if contig not in mnvs:
-                mnvs[contig] = {}
-            for store in hom_bed_parsed[contig]:
-                # (start, stop, hom)
-                (start, stop, _hom) = store
-                mnvs[contig][start] = stop
-                mnv_len = (stop - start) + 1
-                if max_len < mnv_len:
-                    max_len = mnv_len
-            mnvs[contig] = {
-                k: mnvs[contig][k] for k in sorted(mnvs[contig])
-            }  # Sort by position
-        mnvs = {k: mnvs[k] for k in sorted(mnvs)}  # Sort by contig
-    return mnvs, max_len
+    return builder.build(as_hom_blocks(hom_bed_parsed))
+
+
+def merge_fields_incremental(
+    snv_list: List[vcfpy.Record],
+) -> Tuple[Dict, List[str], List[vcfpy.Call]]:
+    """
+    INFO, FORMAT and calls of an MNV with the fields of each SNV n under
+    keys incremented to KEY_n
+    """
+    info = {}
+    format = []
+    # Call data of each sample, keys incremented by SNV
+    calls_data = {}
+    for n, var in enumerate(snv_list, start=1):
+        suffix = f"_{n}"
+        # Add incremental format strings
+        for f in var.FORMAT:
+            format.append(f + suffix)
+
+        # Add incremented info
+        for key, val in var.INFO.items():
+            info[key + suffix] = val
+
+        # Calls, should be a NORMAL and TUMOUR call and associated counts
+        for call in var.calls:
+            data = calls_data.get(call.sample)
+            if data is None:
+                data = calls_data[call.sample] = {}
+            for k, v in call.data.items():
+                data[k + suffix] = v
+    calls = [vcfpy.Call(sample, data) for (sample, data) in calls_data.items()]
+    return info, format, calls
+
+
+def compact_value(value: Any) -> Any:
+    """
+    Value of a single SNV in a compact MNV field, multiple values are
+    joined with |
+    """
+    if isinstance(value, list):
+        if not value:
+            return None
+        return "|".join("." if item is None else str(item) for item in value)
+    return value
+
+
+def merge_fields_compact(
+    snv_list: List[vcfpy.Record],
+) -> Tuple[Dict, List[str], List[vcfpy.Call]]:
+    """
+    INFO, FORMAT and calls of an MNV listing the value of each SNV under
+    the original keys. Flags are set if set for any SNV, GT is kept where
+    all SNVs share a genotype and missing otherwise.
+    """
+    n_snvs = len(snv_list)
+    info = {}
+    # Ordered set of FORMAT keys
+    format = {}
+    calls_data = {}
+    for n, var in enumerate(snv_list):
+        for key, val in var.INFO.items():
+            if val is True:
+                info[key] = True
+                continue
+            values = info.get(key)
+            if values is None:
+                values = info[key] = [None] * n_snvs
+            values[n] = compact_value(val)
+        format.update(dict.fromkeys(var.FORMAT))
+        for call in var.calls:
+            data = calls_data.get(call.sample)
+            if data is None:
+                data = calls_data[call.sample] = {}
+            for key, val in call.data.items():
+                values = data.get(key)
+                if values is None:
+                    values = data[key] = [None] * n_snvs
+                values[n] = compact_value(val)
+    for data in calls_data.values():
+        if "GT" in data:
+            genotypes = set(data["GT"])
+            data["GT"] = genotypes.pop() if len(genotypes) == 1 else None
+    calls = [vcfpy.Call(sample, data) for (sample, data) in calls_data.items()]
+    return info, list(format), calls
+
+
+def increment_header_line(
+    existing_line: vcfpy.header.HeaderLine, n: int
+) -> vcfpy.header.HeaderLine:
+    """
+    Taking a header line, and an int n, generates a copy of that header
+    line with the key and description updates to include said
+    incremental int
+    """
+    new_line = existing_line.copy()
+    new_line.mapping["ID"] = new_line.mapping["ID"] + f"_{n}"
+    new_line.mapping["Description"] = (
+        new_line.mapping["Description"] + f" (MNV allele {n} in series)"
+    )
+    return new_line
+
+
+def compact_header_line(
+    existing_line: vcfpy.header.HeaderLine,
+) -> vcfpy.header.HeaderLine:
+    """
+    Taking an INFO or FORMAT header line, generates a copy listing a value
+    per base of merged MNVs. Fields with more than one value per base are
+    listed as strings of the values joined with |. Flags and GT are
+    unchanged.
+    """
+    mapping = dict(existing_line.mapping)
+    if mapping["ID"] == "GT" or mapping.get("Type") == "Flag":
+        return existing_line
+    if mapping.get("Number") != 1:
+        mapping["Type"] = "String"
+    mapping["Number"] = "."
+    mapping["Description"] = mapping["Description"] + " (per base of MNVs)"
+    return existing_line.__class__.from_mapping(mapping)
+
+
+def add_mnv_header_lines(
+    writer_header: vcfpy.Header, max_len: int, mnv_encoding: str = "incremental"
+) -> vcfpy.Header:
+    """
+    Add the INFO and FORMAT lines of merged MNVs of up to max_len SNVs in
+    the given encoding to a VCF header
+    """
+    if mnv_encoding == "compact":
+        # A fixed size header, whatever the length of MNVs
+        lines = [
+            compact_header_line(line) if line.key in ("INFO", "FORMAT") else line
+            for line in writer_header.lines
+        ]
+        return vcfpy.Header(lines, writer_header.samples)
+    info_lines = writer_header.get_lines("INFO")
+    format_lines = writer_header.get_lines("FORMAT")
+    # Add a X1..X2..Xn info and format header lines for
+    lines_to_add = []
+    for inf_line in info_lines:
+        for i in range(1, max_len + 1):
+            lines_to_add.append(increment_header_line(inf_line, i))
+    for form_line in format_lines:
+        for i in range(1, max_len + 1):
+            lines_to_add.append(increment_header_line(form_line, i))
+
+    for new_head_line in lines_to_add:
+        writer_header.add_line(new_head_line)
+
+    return writer_header
+
+
+def merge_snvs(
+    snv_list: List[vcfpy.Record],
+    mnv_encoding: str = "incremental",
+    merge_warnings: Optional[Counter] = None,
+) -> vcfpy.Record:
+    """
+    Merge snvs from list into a single variant and output to VCF.
+    Each sample's call data is accumulated in a single pass. MNVs merged
+    from SNVs with QUAL or FILTER values are counted in merge_warnings.
+    """
+    do_qual = 0
+    qual = 0
+    if merge_warnings is None:
+        merge_warnings = Counter()
+    if snv_list[0].QUAL:
+        do_qual = 1
+        merge_warnings["qual"] += 1
+    else:
+        qual = snv_list[0].QUAL
+
+    do_filter = any(snv.FILTER for snv in snv_list)
+    if do_filter:
+        merge_warnings["filter"] += 1
+    filter = []
+
+    chrom = snv_list[0].CHROM
+    pos = snv_list[0].POS
+    id = []  # list of SNV IDs?
+    ref = []
+    alt = []
+
+    for var in snv_list:
+        ref.append(str(var.REF))
+        alt.append(str(var.ALT[0].value))
+
+        # If we want to append filters
+        if do_filter:
+            filter.extend(var.FILTER)
+
+        # If we want to append qualities to generate a mean
+        if do_qual:
+            qual += var.QUAL
+        id.append(var.ID[0])
+
+    alt = [vcfpy.Substitution(type_="MNV", value="".join(alt))]
+
+    # Make the quality a mean value for MNVs
+    if do_qual:
+        qual = qual / len(snv_list)
+
+    if "PASS" in filter and all_equal(filter):
+        # Check for entries being passes and mark as a single pass
+        filter = ["PASS"]
+
+    if mnv_encoding == "compact":
+        (info, format, calls) = merge_fields_compact(snv_list)
+    else:
+        (info, format, calls) = merge_fields_incremental(snv_list)
+    mnv = vcfpy.Record(
+        chrom, pos, id, "".join(ref), alt, qual, filter, info, format, calls
+    )
+    return mnv
 
 
 class MNVMerge:
@@ -188,23 +513,107 @@ class MNVMerge:
         self,
         vcfIn: str,
         vcfOut: str,
-        spout: str,
+        spout: Union[str, Sequence[str]],
         cutoff: float,
         exclude: int,
         run_script: str,
         arg_str: str,
         bed=None,
+        threads: int = 1,
+        streaming: bool = False,
+        hom_blocks: Optional[Dict] = None,
+        compress_level: int = bgzf.DEFAULT_COMPRESS_LEVEL,
+        compress_threads: int = 1,
+        index_format: str = "tbi",
+        progress: bool = False,
+        regions: Optional[List[Region]] = None,
+        mnv_encoding: str = "incremental",
+        cache_dir: Optional[str] = None,
+        cache_max_size: int = mnv_cache.DEFAULT_MAX_SIZE_MB << 20,
+        pipelined: bool = False,
+        checkpoint_interval: Optional[float] = None,
+        previous: Optional[str] = None,
     ):
+        self.vcfinpath = vcfIn
         self.vcfinname = os.path.basename(vcfIn)
-        self.vcfin = vcfpy.Reader.from_path(vcfIn)
+        (self.vcfin, self.vcfin_records) = open_vcf_records(vcfIn)
         self.vcfout = vcfOut
+        # Smart-phase output, one or several files merged as one phased set
         self.spout = spout
+        self.spouts = stdio.as_paths(spout)
+        # A pipe can only be read once
+        self.spout_is_stream = any(map(stdio.is_stream, self.spouts))
         self.cutoff = cutoff
         self.run_script = run_script
         self.exclude_flags = exclude
         self.arg_str = arg_str
         self.longest_MNV = 2
+        # Candidate bed files, several for the shards of a bed
         self.bed = bed
+        self.beds = stdio.as_paths(bed) if bed else []
+        self.threads = threads
+        self.streaming = streaming
+        # Homozygous blocks already parsed, a HomBlocks or as from
+        # parse_homs_bed_to_dict
+        self.hom_blocks = as_hom_blocks(hom_blocks)
+        # BGZF compression and indexing of .gz output
+        self.compress_level = compress_level
+        self.compress_threads = compress_threads
+        self.index_format = index_format
+        # Report progress to stderr, statistics of the run are kept in stats
+        self.progress = progress
+        self.stats = RunStats()
+        # MNVs merged from SNVs with QUAL or FILTER values, logged once at the end
+        self.merge_warnings = Counter()
+        # Genomic regions to restrict the merge to, as from regions.load_regions
+        if regions is not None and streaming:
+            raise ValueError("Regions can't be used when streaming")
+        # Streaming reads the smart-phase output twice
+        if streaming and self.spout_is_stream:
+            raise ValueError("Smart-phase output can't be a pipe when streaming")
+        self.regions = regions
+        if mnv_encoding not in MNV_ENCODINGS:
+            raise ValueError(f"Unknown MNV encoding {mnv_encoding}")
+        self.mnv_encoding = mnv_encoding
+        # On-disk cache of parsed MNVs, not used where None
+        self.cache = None
+        if cache_dir:
+            self.cache = mnv_cache.MNVCache(cache_dir, cache_max_size)
+        # Read and write on threads overlapping the merge, see threaded
+        self.pipelined = pipelined
+        # Seconds between checkpoints of the merge, not checkpointed where None
+        if checkpoint_interval is not None:
+            if streaming or regions is not None or pipelined:
+                raise ValueError(
+                    "Checkpoints can't be used when streaming, pipelined or with regions"
+                )
+            if stdio.is_stdio(vcfOut) or self.spout_is_stream:
+                raise ValueError(
+                    "Checkpoints need the output and smart-phase output to be files"
+                )
+        self.checkpoint_interval = checkpoint_interval
+        # Previous merged output, only the MNVs changed from it are merged
+        if previous is not None:
+            if streaming or regions is not None or pipelined:
+                raise ValueError(
+                    "Incremental merges can't be streaming, pipelined or with regions"
+                )
+            if checkpoint_interval is not None:
+                raise ValueError("Incremental merges can't be checkpointed")
+            if os.path.abspath(previous) == os.path.abspath(vcfOut):
+                raise ValueError("Output must differ from the previous output")
+        self.previous = previous
+
+    def __getstate__(self):
+        # The open input can't be pickled for worker processes, reopen it instead
+        state = self.__dict__.copy()
+        del state["vcfin"]
+        del state["vcfin_records"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        (self.vcfin, self.vcfin_records) = open_vcf_records(self.vcfinpath)
 
     def get_process_header_line(
         self, existing_head: vcfpy.Header
@@ -238,17 +647,17 @@ class MNVMerge:
         self, existing_line: vcfpy.header.HeaderLine, n: int
     ) -> vcfpy.header.HeaderLine:
         """
-        Taking a header line, and an int n, generates a copy of that header
-        line with the key and description updates to include said
-        incremental int
+        Copy of a header line for MNV allele n, see increment_header_line
         """
-        print(f"headerline {n}")
-        new_line = existing_line.copy()
-        new_line.mapping["ID"] = new_line.mapping["ID"] + f"_{n}"
-        new_line.mapping["Description"] = (
-            new_line.mapping["Description"] + f" (MNV allele {n} in series)"
-        )
-        return new_line
+        return increment_header_line(existing_line, n)
+
+    def generate_compact_header(
+        self, existing_line: vcfpy.header.HeaderLine
+    ) -> vcfpy.header.HeaderLine:
+        """
+        Copy of a header line for compact MNVs, see compact_header_line
+        """
+        return compact_header_line(existing_line)
 
     def parse_header_add_merge_and_process(
         self, writer_header: vcfpy.Header, max_len: int
@@ -260,159 +669,373 @@ class MNVMerge:
         # Add a headerline to say this was refiltered with this tool
         process_head_line = self.get_process_header_line(writer_header)
         writer_header.add_line(process_head_line)
-        info_lines = writer_header.get_lines("INFO")
-        format_lines = writer_header.get_lines("FORMAT")
-        # Add a X1..X2..Xn info and format header lines for
-        lines_to_add = []
-        for inf_line in info_lines:
-            for i in range(1, max_len + 1):
-                lines_to_add.append(self.generate_new_increment_header(inf_line, i))
-        for form_line in format_lines:
-            for i in range(1, max_len + 1):
-                lines_to_add.append(self.generate_new_increment_header(form_line, i))
-
-        for new_head_line in lines_to_add:
-            writer_header.add_line(new_head_line)
-
-        return writer_header
+        return add_mnv_header_lines(writer_header, max_len, self.mnv_encoding)
 
     def merge_snv_to_mnv(self, snv_list: List[vcfpy.Record]) -> vcfpy.Record:
         """
-        Merge snvs from list into a single variant and output to VCF
+        Merge snvs from list into a single variant, see merge_snvs
         """
-        do_qual = 0
-        do_filter = 0
-        qual = 0
-        filter = []
-        if snv_list[0].QUAL:
-            do_qual = 1
-            LOGGER.warning("Found a QUAL value, output will be a mean of all QUAL.")
-        else:
-            qual = snv_list[0].QUAL
-
-        do_filter = 0
-        filter = []
-        for snv in snv_list:
-            if snv.FILTER:
-                do_filter = 1
-                LOGGER.warning(
-                    "Found a FILTER value, output will be all FILTERs encountered at all bases."
+        return merge_snvs(snv_list, self.mnv_encoding, self.merge_warnings)
+
+    def log_merge_warnings(self):
+        """
+        Log a single summary of the MNVs merged from SNVs with QUAL or FILTER
+        values, adding the counts to stats
+        """
+        if self.merge_warnings["qual"]:
+            LOGGER.warning(
+                f"Found a QUAL value in {self.merge_warnings['qual']} MNVs, output will be a mean of all QUAL."
+            )
+        if self.merge_warnings["filter"]:
+            LOGGER.warning(
+                f"Found a FILTER value in {self.merge_warnings['filter']} MNVs, output will be all FILTERs encountered at all bases."
+            )
+        for (warning, count) in self.merge_warnings.items():
+            self.stats.counts[f"mnvs_merged_{warning}"] += count
+
+    def merge_lines(
+        self,
+        lines: Iterable[str],
+        mnvs: Dict,
+        writer: vcfpy.Writer,
+        progress: Optional[Progress] = None,
+        checkpoint: Optional[MergeCheckpoint] = None,
+    ) -> Counter:
+        """
+        Write VCF record lines to writer. Only the CHROM and POS of each line
+        are read, lines not part of an MNV in mnvs are copied verbatim.
+        The lines of each MNV are parsed and written as a single merged record.
+        Returns the count of records written by MNV length, with 1 for records
+        copied unmerged. checkpoint is updated between MNVs.
+        """
+        parser = self.vcfin.parser
+        stream = writer.stream
+        lengths = Counter()
+        copied = 0
+        entries = iter_tracked(
+            ((*split_chrom_pos(line), line) for line in lines),
+            itemgetter(0, 1),
+            progress=progress,
+        )
+        done = 0
+        for (entry, is_mnv) in group_mnv_runs(entries, mnvs):
+            if is_mnv:
+                snvs = [parser.parse_line(line) for line in entry]
+                writer.write_record(self.merge_snv_to_mnv(snvs))
+                lengths[len(entry)] += 1
+                done += len(entry)
+            else:
+                stream.write(entry)
+                copied += 1
+                done += 1
+            if checkpoint is not None and done >= checkpoint.next_check:
+                lengths[1] += copied
+                copied = 0
+                checkpoint.update(done, entry[-1] if is_mnv else entry, lengths)
+        lengths[1] += copied
+        return lengths
+
+    def region_mnvs(self, hom_bed_parsed: Optional[Dict]) -> Tuple[Dict, int]:
+        """
+        Parse the MNVs of the smart-phase output segments overlapping the
+        regions, widening the regions until no MNV is only partly covered
+        """
+        contigs = list(dict.fromkeys(contig for (contig, _s, _e) in self.regions))
+        # A pipe can only be read once, all of its MNVs are parsed up front
+        reparse = not self.spout_is_stream
+        # Blocks of an indexed bed file are fetched for the widened regions
+        fetch_blocks = bool(self.beds) and all(
+            map(parallel.can_fetch_windows, self.beds)
+        )
+        parsed = None
+        while True:
+            if parsed is None or reparse:
+                if parsed is not None and fetch_blocks:
+                    hom_bed_parsed = load_hom_blocks(self.beds, self.regions)
+                counts = Counter()
+                parsed = parse_sphase_output(
+                    self.spouts,
+                    self.cutoff,
+                    self.exclude_flags,
+                    hom_bed_parsed,
+                    counts,
+                    self.regions,
                 )
+            (mnvs, max_len) = parsed
+            expanded = region_utils.normalise_regions(
+                region_utils.expand_to_mnvs(self.regions, mnvs), contigs
+            )
+            if expanded == self.regions:
                 break
+            self.regions = expanded
+        self.stats.counts.update(counts)
+        return mnvs, max_len
 
-        chrom = snv_list[0].CHROM
-        pos = snv_list[0].POS
-        id = []  # list of SNV IDs?
-        ref = ""
-        alt_str = ""
-        info = {}
-        format = []
-        # Setup new call objects
-        calls_dict = {}
-
-        for n, var in enumerate(snv_list, start=1):
-            ref += str(var.REF)
-            alt_str += str(var.ALT[0].value)
-
-            # Add incremental format strings
-            for f in var.FORMAT:
-                format.append(f + f"_{n}")
-
-            # Add incremented info
-            for key, val in var.INFO.items():
-                info[key + f"_{n}"] = val
-
-            # Calls, should be a NORMAL and TUMOUR call and associated counts
-            for call in var.calls:
-                new_call = None
-
-                # Check for existing new_call object
-                data_to_add = dict()
-                sample_nom = call.sample
-
-                # Build new data from existing call data (add increment)
-                for k, v in call.data.items():
-                    k = k + f"_{n}"
-                    data_to_add[k] = v
-                if call.sample in calls_dict:
-                    existing_call = calls_dict[call.sample]
-                    exist_data = existing_call.data.copy()
-
-                    # Append new data to previously processed
-                    for k, v in data_to_add.items():
-                        exist_data[k] = v
-                    data_to_add = exist_data
-
-                new_call = vcfpy.Call(sample_nom, data_to_add)
-                calls_dict[call.sample] = new_call
-
-            # If we want to append filters
-            if do_filter:
-                # If we want to append qualities to generate a mean
-                for f in var.FILTER:
-                    filter.append(f)
-
-            if do_qual:
-                qual += var.QUAL
-            id.append(var.ID[0])
-
-        alt = [vcfpy.Substitution(type_="MNV", value=alt_str)]
-
-        # Make the quality a mean value for MNVs
-        if do_qual:
-            qual = qual / len(snv_list)
+    def stream_mnvs(self, header: vcfpy.Header) -> Tuple[SortedMNVStream, int]:
+        """
+        Stream MNVs from the smart-phase output and bed file, which must be
+        sorted in the contig order of the VCF header. The inputs are read once
+        to find the longest MNV, then streamed again as the VCF is merged.
+        """
+        order = ContigOrder([line.id for line in header.get_lines("contig")])
+
+        def iter_mnvs(counts=None):
+            pairs = merge_sorted(
+                [
+                    iter_phased_pairs(path, self.cutoff, self.exclude_flags, counts)
+                    for path in self.spouts
+                ],
+                order,
+            )
+            if self.beds:
+                blocks = merge_sorted(list(map(iter_hom_blocks, self.beds)), order)
+            else:
+                blocks = iter_blocks(self.hom_blocks)
+            return sorted_mnvs(pairs, blocks, order)
+
+        # Pairs are counted on the first pass only
+        max_len = max(
+            (end - start + 1 for (_c, start, end) in iter_mnvs(self.stats.counts)),
+            default=1,
+        )
+        return SortedMNVStream(iter_mnvs(), order), max_len
+
+    def parse_mnvs(self) -> Tuple[Dict, int]:
+        """
+        Parse the MNVs of the bed file and smart-phase output
+        """
+        stats = self.stats
+        hom_bed_parsed = self.hom_blocks
+        if self.beds:
+            with stats.stage("bed_parse") as stage:
+                # All blocks are loaded for piped smart-phase output, whose
+                # MNVs are only parsed once as the regions are widened
+                regions = None if self.spout_is_stream else self.regions
+                hom_bed_parsed = load_hom_blocks(self.beds, regions)
+                stage.records = sum(map(len, hom_bed_parsed.values()))
+
+        with stats.stage("phased_parse") as stage:
+            if self.regions is None:
+                (mnvs, max_len) = parse_sphase_output(
+                    self.spouts,
+                    self.cutoff,
+                    self.exclude_flags,
+                    hom_bed_parsed,
+                    stats.counts,
+                    workers=self.threads,
+                )
+            else:
+                (mnvs, max_len) = self.region_mnvs(hom_bed_parsed)
+            stage.records = sum(stats.counts.values())
+        return mnvs, max_len
+
+    def load_mnvs(self) -> Tuple[Dict, int]:
+        """
+        MNVs of the bed file and smart-phase output, read from the cache
+        where there is one and stored in it after parsing. Regions and piped
+        smart-phase output are always parsed.
+        """
+        stats = self.stats
+        if self.cache is None or self.regions is not None or self.spout_is_stream:
+            return self.parse_mnvs()
+        with stats.stage("cache_lookup") as stage:
+            key = mnv_cache.cache_key(
+                self.spouts, self.cutoff, self.exclude_flags, self.beds, self.hom_blocks
+            )
+            entry = self.cache.get(key)
+            if entry is not None:
+                stage.records = sum(map(len, entry[0].values()))
+        if entry is not None:
+            (mnvs, max_len, counts) = entry
+            stats.counts.update(counts)
+            stats.counts["cache_hits"] += 1
+            return mnvs, max_len
+        (mnvs, max_len) = self.parse_mnvs()
+        # Only the pairs parsed are counted so far
+        self.cache.put(key, mnvs, max_len, Counter(stats.counts))
+        stats.counts["cache_misses"] += 1
+        return mnvs, max_len
+
+    def merge_incremental(self, mnvs: Dict, max_len: int) -> bool:
+        """
+        Merge the spans of the MNVs changed from the previous output, copying
+        the rest of its records through. The header is built again, with the
+        process line of this run. Returns False, having written nothing,
+        where the previous output has another MNV encoding.
+        """
+        stats = self.stats
+        with stats.stage("previous_parse") as stage:
+            previous = incremental.PreviousOutput(self.previous)
+            stage.records = sum(map(len, previous.mnvs.values()))
+        # Records of both encodings can't be mixed in one output
+        if previous.mnv_encoding not in (None, self.mnv_encoding):
+            LOGGER.warning(
+                f"{self.previous} has the {previous.mnv_encoding} MNV encoding, not {self.mnv_encoding}, merging in full."
+            )
+            return False
+        spans = incremental.changed_spans(previous.mnvs, mnvs, previous.contigs)
+        with stats.stage("header") as stage:
+            writer_header = self.parse_header_add_merge_and_process(
+                self.vcfin.header.copy(), max_len
+            )
+            stage.records = len(writer_header.lines)
+        outstream = bgzf.open_output(
+            self.vcfout,
+            bgzf.TBX_VCF,
+            self.compress_level,
+            self.compress_threads,
+            self.index_format,
+        )
+        writer = vcfpy.Writer.from_stream(outstream, writer_header)
+
+        def copy_lines(lines: List[str]):
+            outstream.write("".join(lines))
+
+        lengths = Counter()
 
-        if "PASS" in filter and all_equal(filter):
-            # Check for entries being passes and mark as a single pass
-            filter = ["PASS"]
+        def merge_span(contig: str, idx: int):
+            lengths.update(self.merge_lines(span_lines.take(contig, idx), mnvs, writer))
 
-        mnv = vcfpy.Record(
-            chrom, pos, id, ref, alt, qual, filter, info, format, calls_dict.values()
+        with stats.stage("records") as stage:
+            lines = self.vcfin_records
+            if parallel.can_fetch_windows(self.vcfinpath):
+                # Only the spans are read from an indexed VCF
+                lines = region_utils.fetch_lines(
+                    self.vcfinpath, incremental.span_regions(spans)
+                )
+            span_lines = incremental.SpanLines(lines, spans)
+            (_reader, previous_lines) = open_vcf_records(self.previous)
+            with previous_lines:
+                reused = incremental.merge_previous(
+                    previous_lines, spans, copy_lines, merge_span
+                )
+            stage.records = reused + sum(length * n for (length, n) in lengths.items())
+        self.log_merge_warnings()
+        with stats.stage("write"):
+            writer.close()
+        self.vcfin_records.close()
+        stats.counts["spans_merged"] += sum(
+            len(starts) for (starts, _ends) in spans.values()
         )
-        return mnv
+        stats.counts["records_reused"] += reused
+        stats.counts["records_copied"] += lengths.pop(1, 0)
+        stats.counts["mnvs_merged"] += sum(lengths.values())
+        stats.mnv_lengths.update(lengths)
+        return True
+
+    def checkpoint_key(self) -> str:
+        """
+        Key of the inputs and arguments of the run, see checkpoint.run_key
+        """
+        fields = [self.vcfinpath, self.vcfout, self.arg_str, self.mnv_encoding]
+        if not stdio.is_stream(self.vcfinpath):
+            info = os.stat(self.vcfinpath)
+            fields += [str(info.st_size), str(info.st_mtime_ns)]
+        fields.append(
+            mnv_cache.cache_key(
+                self.spouts, self.cutoff, self.exclude_flags, self.beds, self.hom_blocks
+            )
+        )
+        return merge_checkpoint.run_key(fields)
 
     def perform_mnv_merge_to_vcf(self):
         """
         Iterate through VCF records. Outputting a new VCF with
         requested filters removed.
         """
-        hom_bed_parsed = None
-        if self.bed:
-            hom_bed_parsed = parse_homs_bed_to_dict(self.bed)
+        reader = self.vcfin
+        stats = self.stats
+        checkpoint = None
+        state = None
+        if self.checkpoint_interval is not None:
+            checkpoint = MergeCheckpoint(
+                self.vcfout, self.checkpoint_key(), self.checkpoint_interval
+            )
+            state = checkpoint.load()
+        if self.streaming:
+            with stats.stage("phased_parse") as stage:
+                (mnvs, max_len) = self.stream_mnvs(reader.header)
+                stage.records = sum(stats.counts.values())
+        elif state is not None:
+            LOGGER.info(
+                f"Resuming from {checkpoint.path} after {state['lines']} records."
+            )
+            # Counts are restored with the rest of the checkpoint
+            (mnvs, max_len, _counts) = checkpoint.load_mnvs()
+        else:
+            (mnvs, max_len) = self.load_mnvs()
+            if checkpoint is not None:
+                checkpoint.save_mnvs(mnvs, max_len, Counter())
+        if self.previous is not None and self.merge_incremental(mnvs, max_len):
+            return
+        with stats.stage("header") as stage:
+            # Make a copy of the header
+            writer_header = reader.header.copy()
+            writer_header = self.parse_header_add_merge_and_process(
+                writer_header, max_len
+            )
+            stage.records = len(writer_header.lines)
+        outstream = bgzf.open_output(
+            self.vcfout,
+            bgzf.TBX_VCF,
+            self.compress_level,
+            self.compress_threads,
+            self.index_format,
+            None if state is None else state["output"],
+        )
+        if state is None:
+            writer = vcfpy.Writer.from_stream(outstream, writer_header)
+        else:
+            # The header was written before the checkpoint
+            writer = vcfpy.Writer.from_stream(io.StringIO(), writer_header)
+            writer.stream = outstream
+        if checkpoint is not None:
+            checkpoint.start(outstream, stats, self.merge_warnings, state)
+        progress = None
+        if self.progress:
+            progress = Progress(parallel.get_contig_lengths(writer_header))
 
-        (mnvs, max_len) = parse_sphase_output(
-            self.spout, self.cutoff, self.exclude_flags, hom_bed_parsed
+        # Streaming MNVs can't be shared between worker processes
+        # Checkpoints follow the lines of a single merge
+        use_windows = (
+            self.threads > 1
+            and not self.streaming
+            and not self.regions
+            and checkpoint is None
         )
-        reader = self.vcfin
-        # Make a copy of the header
-        writer_header = reader.header.copy()
-        writer_header = self.parse_header_add_merge_and_process(writer_header, max_len)
-        writer = vcfpy.Writer.from_path(self.vcfout, writer_header)
-
-        snvs = []
-        start_pos_mnv = 0
-        start_contig_mnv = ""
-        in_mnv = False
-        for variant in reader:
-            if variant.CHROM in mnvs:
-                # Start position in an mnv
-                if int(variant.POS) in mnvs[variant.CHROM]:
-                    in_mnv = True
-                    start_pos_mnv = int(variant.POS)
-                    start_contig_mnv = variant.CHROM
-                    snvs.append(variant)
-                # In an MNV and waiting for finish
-                elif (
-                    in_mnv and int(variant.POS) <= mnvs[start_contig_mnv][start_pos_mnv]
-                ):
-                    snvs.append(variant)
-                    if int(variant.POS) == mnvs[start_contig_mnv][start_pos_mnv]:
-                        mnv_rec = self.merge_snv_to_mnv(snvs)
-                        writer.write_record(mnv_rec)
-                        snvs.clear()
-                        in_mnv = False
-                else:
-                    writer.write_record(variant)
+        if use_windows and not parallel.can_fetch_windows(self.vcfinpath):
+            LOGGER.warning(
+                f"{self.vcfinpath} is not a bgzipped, tabix indexed VCF, merging with a single thread."
+            )
+            use_windows = False
+        # Records are written as they are merged, so the record stage includes
+        # most of the writing, the write stage is the final flush and indexing
+        with stats.stage("records") as stage:
+            if use_windows:
+                lengths = parallel.merge_windows(self, mnvs, writer, progress)
             else:
-                writer.write_record(variant)
-        writer.close()
+                lines = self.vcfin_records
+                if state is not None:
+                    lines = merge_checkpoint.skip_lines(
+                        lines, state["lines"], state["last"]
+                    )
+                if self.regions is not None:
+                    lines = region_utils.fetch_lines(self.vcfinpath, self.regions)
+                if self.pipelined:
+                    lines = threaded.read_ahead(lines)
+                    writer = threaded.ThreadedWriter(writer)
+                lengths = self.merge_lines(lines, mnvs, writer, progress, checkpoint)
+                if checkpoint is not None:
+                    lengths.update(checkpoint.base_lengths)
+            stage.records = sum(length * n for (length, n) in lengths.items())
+        self.log_merge_warnings()
+        with stats.stage("write"):
+            writer.close()
+        if checkpoint is not None:
+            checkpoint.finish()
+        self.vcfin_records.close()
+        if progress is not None:
+            progress.finish()
+        stats.counts["records_copied"] += lengths.pop(1, 0)
+        stats.counts["mnvs_merged"] += sum(lengths.values())
+        stats.mnv_lengths.update(lengths)
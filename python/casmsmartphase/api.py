@@ -0,0 +1,196 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module for merging MNVs in memory, to embed the merge in a Python
+pipeline. Records are taken from any iterable of vcfpy Records, such as a
+vcfpy.Reader, and merged records are yielded as they are merged, with an
+async iterator variant for asyncio pipelines. Nothing is read from or
+written to disk.
+"""
+from bisect import bisect_right
+from collections import Counter
+from typing import AsyncIterable
+from typing import AsyncIterator
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+import vcfpy
+from casmsmartphase.hom_blocks import as_hom_blocks
+from casmsmartphase.mnv_chains import ContigMNVs
+from casmsmartphase.mnv_chains import MNVChainBuilder
+from casmsmartphase.MNVMerge import add_mnv_header_lines
+from casmsmartphase.MNVMerge import group_mnv_runs
+from casmsmartphase.MNVMerge import merge_snvs
+from casmsmartphase.MNVMerge import MNV_ENCODINGS
+
+# Records merged at a time by StreamingMerge.merge_async
+ASYNC_BATCH = 1000
+
+
+def build_mnvs(
+    pairs: Iterable[Tuple[str, int, int]], hom_blocks: Optional[Dict] = None
+) -> Tuple[Dict[str, ContigMNVs], int]:
+    """
+    MNVs of phased pairs of adjacent SNVs and homozygous blocks, with the
+    length of the longest MNV
+    """
+    builder = MNVChainBuilder()
+    for (contig, start, end) in pairs:
+        builder.add_pair(contig, start, end)
+    return builder.build(as_hom_blocks(hom_blocks))
+
+
+def as_compact(record: vcfpy.Record) -> vcfpy.Record:
+    """
+    Wrap the single INFO and FORMAT values of an unmerged record in lists,
+    in place, as the header of the compact encoding lists them
+    """
+    for (key, value) in record.INFO.items():
+        if not isinstance(value, (list, bool)) and value is not None:
+            record.INFO[key] = [value]
+    for call in record.calls:
+        for (key, value) in call.data.items():
+            if key != "GT" and not isinstance(value, list) and value is not None:
+                call.data[key] = [value]
+    return record
+
+
+async def _as_async(records: Iterable[vcfpy.Record]) -> AsyncIterator[vcfpy.Record]:
+    for record in records:
+        yield record
+
+
+class StreamingMerge:
+    """
+    Merge of MNVs into VCF records in memory. pairs are the (contig, start,
+    end) of phased pairs of adjacent SNVs, e.g. from parse_phased_lines of
+    smart-phase output lines, read when the merge is created. hom_blocks are
+    a HomBlocks, e.g. from load_hom_blocks, or in the format of
+    parse_homs_bed_to_dict.
+    """
+
+    def __init__(
+        self,
+        pairs: Iterable[Tuple[str, int, int]],
+        hom_blocks: Optional[Dict] = None,
+        mnv_encoding: str = "incremental",
+    ):
+        if mnv_encoding not in MNV_ENCODINGS:
+            raise ValueError(f"Unknown MNV encoding {mnv_encoding}")
+        self.mnv_encoding = mnv_encoding
+        (self.mnvs, self.max_len) = build_mnvs(pairs, hom_blocks)
+        # MNVs merged from SNVs with QUAL or FILTER values
+        self.merge_warnings = Counter()
+
+    def header(self, header: vcfpy.Header) -> vcfpy.Header:
+        """
+        Header of merged records, a copy of the header of the input records
+        with the INFO and FORMAT lines of MNVs
+        """
+        return add_mnv_header_lines(header.copy(), self.max_len, self.mnv_encoding)
+
+    def merge(self, records: Iterable[vcfpy.Record]) -> Iterator[vcfpy.Record]:
+        """
+        Iterate through records, in the order of a sorted VCF, merging the
+        SNVs of each MNV into a single record. With the compact encoding,
+        records not merged are changed by as_compact.
+        """
+        compact = self.mnv_encoding == "compact"
+        entries = ((record.CHROM, record.POS, record) for record in records)
+        for (entry, is_mnv) in group_mnv_runs(entries, self.mnvs):
+            if is_mnv:
+                yield merge_snvs(entry, self.mnv_encoding, self.merge_warnings)
+            elif compact:
+                yield as_compact(entry)
+            else:
+                yield entry
+
+    def _continues_mnv(self, record: vcfpy.Record) -> bool:
+        """
+        Whether an MNV continues after record
+        """
+        contig_mnvs = self.mnvs.get(record.CHROM)
+        if not contig_mnvs:
+            return False
+        idx = bisect_right(contig_mnvs.starts, record.POS) - 1
+        return idx >= 0 and record.POS < contig_mnvs.ends[idx]
+
+    async def merge_async(
+        self, records: Union[AsyncIterable[vcfpy.Record], Iterable[vcfpy.Record]]
+    ) -> AsyncIterator[vcfpy.Record]:
+        """
+        Async iterator of merge, records may be an async or a plain
+        iterable. Records are merged in batches of ASYNC_BATCH, each cut
+        before any MNV it would split.
+        """
+        if not hasattr(records, "__aiter__"):
+            records = _as_async(records)
+        batch = []
+        async for record in records:
+            batch.append(record)
+            if len(batch) >= ASYNC_BATCH:
+                cut = len(batch)
+                while cut and self._continues_mnv(batch[cut - 1]):
+                    cut -= 1
+                for merged in self.merge(batch[:cut]):
+                    yield merged
+                batch = batch[cut:]
+        for merged in self.merge(batch):
+            yield merged
+
+
+def merge_records(
+    records: Iterable[vcfpy.Record],
+    pairs: Iterable[Tuple[str, int, int]],
+    hom_blocks: Optional[Dict] = None,
+    mnv_encoding: str = "incremental",
+) -> Iterator[vcfpy.Record]:
+    """
+    Iterate through records merging the MNVs of pairs and hom_blocks, see
+    StreamingMerge
+    """
+    return StreamingMerge(pairs, hom_blocks, mnv_encoding).merge(records)
+
+
+def amerge_records(
+    records: Union[AsyncIterable[vcfpy.Record], Iterable[vcfpy.Record]],
+    pairs: Iterable[Tuple[str, int, int]],
+    hom_blocks: Optional[Dict] = None,
+    mnv_encoding: str = "incremental",
+) -> AsyncIterator[vcfpy.Record]:
+    """
+    Async iterator of merge_records
+    """
+    return StreamingMerge(pairs, hom_blocks, mnv_encoding).merge_async(records)
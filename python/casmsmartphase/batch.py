@@ -0,0 +1,325 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module running merge-mnvs or the phase pipeline for a cohort of
+samples listed in a manifest, in one long lived process. The Python stages
+of each sample run in a bounded pool of worker processes, overlapped with
+the external phasing commands of other samples run as asyncio subprocesses.
+"""
+import asyncio
+import csv
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from casmsmartphase import merge_mnv_to_vcf
+from casmsmartphase import phase_pipeline
+
+LOGGER = logging.getLogger(__name__)
+
+REQUIRED_FIELDS = ("sample", "vcfin", "output")
+# Optional manifest fields and their type
+FIELD_TYPES = {
+    "smart_phased_output": str,
+    "phase_cmd": str,
+    "bed": str,
+    "cutoff": float,
+    "exclude": int,
+    "markhz": bool,
+    "mnv_encoding": str,
+    "workdir": str,
+}
+# Parameters of each kind of job, in the order of the matching subcommand
+MERGE_PARAMS = ["vcfin", "output", "smart_phased_output", "cutoff", "exclude", "bed"]
+PIPELINE_PARAMS = ["vcfin", "output", "phase_cmd", "cutoff", "exclude", "markhz"]
+DEFAULTS = {
+    "cutoff": 0.0,
+    "exclude": 2,
+    "markhz": False,
+    "mnv_encoding": "incremental",
+    "workdir": None,
+    "bed": None,
+}
+TRUE_VALUES = ("1", "true", "yes", "y")
+REPORT_FIELDS = [
+    "sample",
+    "status",
+    "candidates_seconds",
+    "phasing_seconds",
+    "merge_seconds",
+    "total_seconds",
+    "error",
+]
+
+
+def convert_field(key: str, value: Any) -> Any:
+    """
+    Convert a manifest value to the type of its field, empty values are None
+    """
+    if value is None or value == "":
+        return None
+    field_type = FIELD_TYPES.get(key, str)
+    if field_type is bool and isinstance(value, str):
+        return value.lower() in TRUE_VALUES
+    return field_type(value)
+
+
+def read_manifest_rows(path: str) -> List[Dict]:
+    """
+    Rows of a JSON manifest, a list of objects, or a TSV manifest with a
+    header line of field names
+    """
+    with open(path) as manifest:
+        if path.endswith(".json"):
+            rows = json.load(manifest)
+            if not isinstance(rows, list):
+                raise ValueError(f"{path} must contain a list of samples")
+            return rows
+        lines = (line for line in manifest if not line.startswith("##"))
+        return list(csv.DictReader(lines, delimiter="\t"))
+
+
+def read_manifest(
+    path: str, phase_cmd: Optional[str] = None, workdir: Optional[str] = None
+) -> List[Dict]:
+    """
+    Read the jobs of a manifest, one per sample. Samples with a
+    smart_phased_output are merged, others are run through the phase
+    pipeline with their phase_cmd, or phase_cmd if they have none.
+    Pipeline samples without a workdir keep their files in a directory
+    named for the sample in workdir, where given.
+    Each job has the sample, its kind ("merge" or "pipeline") and the
+    parameters of the matching subcommand.
+    """
+    jobs = []
+    samples = set()
+    for (line, row) in enumerate(read_manifest_rows(path), start=1):
+        unknown = set(row) - set(REQUIRED_FIELDS) - set(FIELD_TYPES)
+        if unknown:
+            raise ValueError(
+                f"Unknown fields in {path} sample {line}: {', '.join(sorted(unknown))}"
+            )
+        values = dict(DEFAULTS)
+        values.update(
+            (key, value)
+            for (key, value) in ((k, convert_field(k, v)) for (k, v) in row.items())
+            if value is not None
+        )
+        missing = [field for field in REQUIRED_FIELDS if not values.get(field)]
+        if missing:
+            raise ValueError(f"Missing {', '.join(missing)} in {path} sample {line}")
+        if values["sample"] in samples:
+            raise ValueError(f"Sample {values['sample']} is repeated in {path}")
+        samples.add(values["sample"])
+        if values.get("smart_phased_output"):
+            (kind, names) = ("merge", MERGE_PARAMS)
+        elif values.get("phase_cmd") or phase_cmd:
+            values.setdefault("phase_cmd", phase_cmd)
+            (kind, names) = ("pipeline", PIPELINE_PARAMS)
+        else:
+            raise ValueError(
+                f"Sample {values['sample']} needs a smart_phased_output or phase_cmd"
+            )
+        params = {name: values[name] for name in names}
+        params["mnv_encoding"] = values["mnv_encoding"]
+        if kind == "pipeline":
+            params["workdir"] = values["workdir"]
+            if not params["workdir"] and workdir:
+                params["workdir"] = os.path.join(workdir, values["sample"])
+        jobs.append({"sample": values["sample"], "kind": kind, "params": params})
+    return jobs
+
+
+def _timed(func, *args, **kwargs):
+    """
+    Call func in a worker, returning its result and the seconds it took
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+async def _run_phasing(cmd: List[str]) -> float:
+    """
+    Run a phasing command as a subprocess, returning the seconds it took
+    """
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(*cmd)
+    returncode = await process.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    return time.perf_counter() - start
+
+
+async def _run_pipeline(
+    job: Dict, workdir: str, pool, phase_slots: asyncio.Semaphore, report: Dict
+):
+    """
+    Generate candidates and merge in the pool, phasing in between as a
+    subprocess once one of phase_slots is free. Stage timings are added
+    to report.
+    """
+    loop = asyncio.get_running_loop()
+    params = job["params"]
+    bed = os.path.join(workdir, phase_pipeline.BED_NAME)
+    phased = os.path.join(workdir, phase_pipeline.PHASED_NAME)
+    ((n_blocks, hom_blocks), report["candidates_seconds"]) = await loop.run_in_executor(
+        pool,
+        _timed,
+        phase_pipeline.write_candidates,
+        params["vcfin"],
+        bed,
+        params["markhz"],
+    )
+    if n_blocks:
+        cmd = phase_pipeline.phasing_command(
+            params["phase_cmd"], params["vcfin"], bed, phased, sample=job["sample"]
+        )
+        async with phase_slots:
+            report["phasing_seconds"] = await _run_phasing(cmd)
+    else:
+        # Nothing to phase
+        open(phased, "w").close()
+    (_result, report["merge_seconds"]) = await loop.run_in_executor(
+        pool,
+        _timed,
+        phase_pipeline.merge_phased,
+        params["vcfin"],
+        params["output"],
+        phased,
+        params["cutoff"],
+        params["exclude"],
+        params["arg_str"],
+        hom_blocks,
+        params["mnv_encoding"],
+    )
+
+
+async def run_job(
+    job: Dict, pool, job_slots: asyncio.Semaphore, phase_slots: asyncio.Semaphore
+) -> Dict:
+    """
+    Run a single job, returning its report. A failed job is reported with
+    its error rather than raised, so other samples continue.
+    """
+    async with job_slots:
+        return await _run_job(job, pool, phase_slots)
+
+
+async def _run_job(job: Dict, pool, phase_slots: asyncio.Semaphore) -> Dict:
+    loop = asyncio.get_running_loop()
+    report = {field: None for field in REPORT_FIELDS}
+    report.update(sample=job["sample"], status="ok", error="")
+    start = time.perf_counter()
+    try:
+        if job["kind"] == "merge":
+            (_result, report["merge_seconds"]) = await loop.run_in_executor(
+                pool, partial(_timed, merge_mnv_to_vcf.run, **job["params"])
+            )
+        else:
+            workdir = job["params"]["workdir"]
+            if workdir:
+                os.makedirs(workdir, exist_ok=True)
+                await _run_pipeline(job, workdir, pool, phase_slots, report)
+            else:
+                with tempfile.TemporaryDirectory() as tmpdir:
+                    await _run_pipeline(job, tmpdir, pool, phase_slots, report)
+    except Exception as err:
+        LOGGER.error(f"Sample {job['sample']} failed: {err}")
+        report.update(status="failed", error=str(err))
+    report["total_seconds"] = time.perf_counter() - start
+    return report
+
+
+async def run_jobs(jobs: List[Dict], workers: int, phase_jobs: int) -> List[Dict]:
+    """
+    Run jobs with workers worker processes and up to phase_jobs phasing
+    commands at a time, returning the report of each job in order. Only
+    enough jobs to keep both busy are in progress at once, bounding the
+    candidate and phased files kept.
+    """
+    job_slots = asyncio.Semaphore(workers + phase_jobs)
+    phase_slots = asyncio.Semaphore(phase_jobs)
+    with ProcessPoolExecutor(workers) as pool:
+        return await asyncio.gather(
+            *(run_job(job, pool, job_slots, phase_slots) for job in jobs)
+        )
+
+
+def write_report(reports: List[Dict], path: str):
+    """
+    Write the per sample reports as JSON where path ends .json, else TSV
+    """
+    rows = [
+        {
+            field: round(value, 3) if isinstance(value, float) else value
+            for (field, value) in report.items()
+        }
+        for report in reports
+    ]
+    with open(path, "w") as out:
+        if path.endswith(".json"):
+            json.dump(rows, out, indent=2)
+            out.write("\n")
+            return
+        writer = csv.DictWriter(
+            out, REPORT_FIELDS, delimiter="\t", lineterminator="\n", restval=""
+        )
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: "" if v is None else v for (k, v) in row.items()})
+
+
+def run(
+    jobs: List[Dict],
+    workers: int = 1,
+    phase_jobs: Optional[int] = None,
+    report: Optional[str] = None,
+) -> List[Dict]:
+    """
+    Run the jobs of a manifest, writing the per sample report to report.
+    Returns the reports.
+    """
+    reports = asyncio.run(run_jobs(jobs, workers, phase_jobs or workers))
+    if report:
+        write_report(reports, report)
+    failed = sum(result["status"] != "ok" for result in reports)
+    LOGGER.info(f"Batch complete: {len(reports) - failed} ok, {failed} failed")
+    return reports
@@ -0,0 +1,458 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module for writing BGZF compressed output, compressing blocks
+across threads and building a tabix or CSI index while the output is
+written, so no second pass over the output is needed
+"""
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from casmsmartphase import stdio
+
+# Uncompressed block size, as htslib, so a block of incompressible data
+# still fits the 64KB BGZF block limit
+BLOCK_SIZE = 0xFF00
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+DEFAULT_COMPRESS_LEVEL = 6
+INDEX_FORMATS = ("tbi", "csi")
+# Blocks being compressed per thread before waiting for the oldest
+QUEUED_BLOCKS_PER_THREAD = 4
+
+# Tabix header (format, col_seq, col_beg, col_end, meta char, skip lines)
+TBX_VCF = (2, 1, 2, 0, "#", 0)
+TBX_BED = (0x10000, 1, 2, 3, "#", 0)
+# Binning schemes, as tabix: TBI covers 2^29 positions, CSI 2^32
+MIN_SHIFT = 14
+INDEX_DEPTH = {"tbi": 5, "csi": 6}
+
+
+def compress_block(data: bytes, level: int) -> bytes:
+    """
+    Compress data into a single BGZF block
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = struct.pack(
+        "<4BI2BH2BHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(cdata) + 25
+    )
+    return header + cdata + struct.pack("<II", zlib.crc32(data), len(data))
+
+
+def write_bgzf_bytes(path: str, data: bytes, level: int = DEFAULT_COMPRESS_LEVEL):
+    """
+    Write data to path as a BGZF file
+    """
+    with open(path, "wb") as out:
+        for start in range(0, len(data), BLOCK_SIZE):
+            out.write(compress_block(data[start : start + BLOCK_SIZE], level))
+        out.write(EOF_BLOCK)
+
+
+def reg2bin(beg: int, end: int, min_shift: int, depth: int) -> int:
+    """
+    Bin of the 0-based half open interval beg-end, as hts_reg2bin
+    """
+    shift = min_shift
+    offset = ((1 << (depth * 3)) - 1) // 7
+    end -= 1
+    for level in range(depth, 0, -1):
+        if beg >> shift == end >> shift:
+            return offset + (beg >> shift)
+        shift += 3
+        offset -= 1 << (level * 3 - 3)
+    return 0
+
+
+def bin_first_pos(bin_num: int, min_shift: int, depth: int) -> int:
+    """
+    First position covered by a bin
+    """
+    level = 0
+    offset = 0
+    while bin_num >= offset + (1 << (level * 3)):
+        offset += 1 << (level * 3)
+        level += 1
+    return (bin_num - offset) << (min_shift + (depth - level) * 3)
+
+
+class _RefIndex:
+    """
+    Bins, chunks and linear index of a single reference sequence
+    """
+
+    def __init__(self):
+        self.bins: Dict[int, List[List[int]]] = {}
+        self.linear: List[int] = []
+        self.n_records = 0
+        self.first = None
+        self.last = None
+
+    def add(self, bin_num: int, beg: int, end: int, vstart: int, vend: int):
+        chunks = self.bins.setdefault(bin_num, [])
+        if chunks and chunks[-1][1] == vstart:
+            chunks[-1][1] = vend
+        else:
+            chunks.append([vstart, vend])
+        first_window = beg >> MIN_SHIFT
+        last_window = (end - 1) >> MIN_SHIFT
+        if len(self.linear) <= last_window:
+            self.linear.extend([-1] * (last_window + 1 - len(self.linear)))
+        for window in range(first_window, last_window + 1):
+            if self.linear[window] < 0:
+                self.linear[window] = vstart
+        self.n_records += 1
+        if self.first is None:
+            self.first = vstart
+        self.last = vend
+
+    def to_state(self) -> Dict:
+        return {
+            "bins": [[bin_num, chunks] for (bin_num, chunks) in self.bins.items()],
+            "linear": self.linear,
+            "n_records": self.n_records,
+            "first": self.first,
+            "last": self.last,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict) -> "_RefIndex":
+        ref = cls()
+        ref.bins = {bin_num: chunks for (bin_num, chunks) in state["bins"]}
+        ref.linear = state["linear"]
+        ref.n_records = state["n_records"]
+        ref.first = state["first"]
+        ref.last = state["last"]
+        return ref
+
+    def filled_linear(self) -> List[int]:
+        """
+        Linear index with empty windows taking the offset of the previous
+        window (or the first record for leading windows)
+        """
+        filled = []
+        prev = self.first
+        for offset in self.linear:
+            if offset >= 0:
+                prev = offset
+            filled.append(prev)
+        return filled
+
+
+class TabixIndexer:
+    """
+    Builds a tabix (.tbi) or CSI (.csi) index from the lines of a sorted
+    VCF or bed file and their offsets as they are written. Offsets are
+    given as (block number << 16 | offset in block) and are resolved to
+    virtual file offsets once the compressed block positions are known.
+    """
+
+    def __init__(self, conf: Tuple, index_format: str = "tbi"):
+        if index_format not in INDEX_FORMATS:
+            raise ValueError(f"Unknown index format {index_format}")
+        self.conf = conf
+        self.index_format = index_format
+        self.depth = INDEX_DEPTH[index_format]
+        self.max_pos = 1 << (MIN_SHIFT + self.depth * 3)
+        self.is_vcf = conf == TBX_VCF
+        self.refs: Dict[str, _RefIndex] = {}
+
+    def add_line(self, line: str, vstart: int, vend: int):
+        if not line.strip() or line[0] == self.conf[4]:
+            return
+        fields = line.split("\t", 4)
+        if self.is_vcf:
+            beg = int(fields[1]) - 1
+            end = beg + len(fields[3])
+        else:
+            beg = int(fields[1])
+            end = max(int(fields[2]), beg + 1)
+        if end > self.max_pos:
+            raise ValueError(
+                f"Position {fields[0]}:{end} is too large for a {self.index_format}"
+                " index"
+            )
+        ref = self.refs.get(fields[0])
+        if ref is None:
+            ref = self.refs[fields[0]] = _RefIndex()
+        ref.add(reg2bin(beg, end, MIN_SHIFT, self.depth), beg, end, vstart, vend)
+
+    def to_state(self) -> List:
+        """
+        The references indexed so far, JSON serialisable, see load_state
+        """
+        return [[name, ref.to_state()] for (name, ref) in self.refs.items()]
+
+    def load_state(self, state: List):
+        self.refs = {name: _RefIndex.from_state(ref) for (name, ref) in state}
+
+    def _header_bytes(self) -> bytes:
+        names = b"".join(name.encode() + b"\0" for name in self.refs)
+        (fmt, col_seq, col_beg, col_end, meta, skip) = self.conf
+        return (
+            struct.pack(
+                "<7i", fmt, col_seq, col_beg, col_end, ord(meta), skip, len(names)
+            )
+            + names
+        )
+
+    def index_bytes(self, resolve) -> bytes:
+        """
+        Uncompressed index, resolve maps block relative offsets to virtual
+        file offsets
+        """
+        is_tbi = self.index_format == "tbi"
+        if is_tbi:
+            out = [b"TBI\1", struct.pack("<i", len(self.refs)), self._header_bytes()]
+        else:
+            aux = self._header_bytes()
+            out = [b"CSI\1", struct.pack("<3i", MIN_SHIFT, self.depth, len(aux)), aux]
+            out.append(struct.pack("<i", len(self.refs)))
+        meta_bin = ((1 << (self.depth * 3 + 3)) - 1) // 7 + 1
+        for ref in self.refs.values():
+            linear = [resolve(offset) for offset in ref.filled_linear()]
+            out.append(struct.pack("<i", len(ref.bins) + 1))
+            for bin_num in sorted(ref.bins):
+                chunks = ref.bins[bin_num]
+                if is_tbi:
+                    out.append(struct.pack("<Ii", bin_num, len(chunks)))
+                else:
+                    window = bin_first_pos(bin_num, MIN_SHIFT, self.depth) >> MIN_SHIFT
+                    loffset = linear[min(window, len(linear) - 1)]
+                    out.append(struct.pack("<IQi", bin_num, loffset, len(chunks)))
+                for (vstart, vend) in chunks:
+                    out.append(struct.pack("<QQ", resolve(vstart), resolve(vend)))
+            # Pseudo bin holding the span and record counts of the reference
+            if is_tbi:
+                out.append(struct.pack("<Ii", meta_bin, 2))
+            else:
+                out.append(struct.pack("<IQi", meta_bin, 0, 2))
+            out.append(
+                struct.pack(
+                    "<4Q", resolve(ref.first), resolve(ref.last), ref.n_records, 0
+                )
+            )
+            if is_tbi:
+                out.append(struct.pack("<i", len(linear)))
+                out.append(struct.pack(f"<{len(linear)}Q", *linear))
+        out.append(struct.pack("<Q", 0))
+        return b"".join(out)
+
+
+class BgzfWriter:
+    """
+    Text file-like writer of BGZF compressed output. Blocks are compressed
+    by a pool of threads (zlib releases the GIL) and written in order. If an
+    indexer is given every complete line is passed to it with its offsets and
+    the index is written alongside the output on close.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        level: int = DEFAULT_COMPRESS_LEVEL,
+        threads: int = 1,
+        indexer: Optional[TabixIndexer] = None,
+        state: Optional[Dict] = None,
+    ):
+        self.path = path
+        self.level = level
+        self.indexer = indexer
+        if state is None:
+            self._raw = open(path, "wb")
+        else:
+            # Continue after the blocks written at a checkpoint
+            os.truncate(path, state["coffset"])
+            self._raw = open(path, "ab")
+        self._pool = ThreadPoolExecutor(threads) if threads > 1 else None
+        self._max_queued = threads * QUEUED_BLOCKS_PER_THREAD
+        self._queued = deque()
+        self._block = bytearray()
+        self._n_blocks = 0
+        # Compressed offset of each block, to resolve index offsets
+        self._block_offsets = []
+        self._coffset = 0
+        self._partial = []
+        self.closed = False
+        if state is not None:
+            self._n_blocks = state["n_blocks"]
+            self._block_offsets = state["block_offsets"]
+            self._coffset = state["coffset"]
+            if indexer is not None:
+                indexer.load_state(state["index"])
+
+    def _tell(self) -> int:
+        return (self._n_blocks << 16) | len(self._block)
+
+    def _write_compressed(self, cdata: bytes):
+        self._block_offsets.append(self._coffset)
+        self._raw.write(cdata)
+        self._coffset += len(cdata)
+
+    def _submit_block(self, data: bytes):
+        self._n_blocks += 1
+        if self._pool is None:
+            self._write_compressed(compress_block(data, self.level))
+            return
+        self._queued.append(self._pool.submit(compress_block, data, self.level))
+        while len(self._queued) > self._max_queued:
+            self._write_compressed(self._queued.popleft().result())
+
+    def _write_bytes(self, data: bytes):
+        self._block += data
+        while len(self._block) >= BLOCK_SIZE:
+            self._submit_block(bytes(self._block[:BLOCK_SIZE]))
+            del self._block[:BLOCK_SIZE]
+
+    def _write_lines(self, text: str):
+        if self.indexer is None:
+            self._write_bytes(text.encode())
+            return
+        for line in text.splitlines(keepends=True):
+            vstart = self._tell()
+            self._write_bytes(line.encode())
+            self.indexer.add_line(line, vstart, self._tell())
+
+    def write(self, text: str) -> int:
+        # Only complete lines are written, so each can be indexed
+        self._partial.append(text)
+        if "\n" in text:
+            pending = "".join(self._partial)
+            cut = pending.rfind("\n") + 1
+            self._partial = [pending[cut:]]
+            self._write_lines(pending[:cut])
+        return len(text)
+
+    def flush(self):
+        # Data is only flushed as complete blocks, so the file stays valid BGZF
+        pass
+
+    def checkpoint(self) -> Dict:
+        """
+        End the current block and write every block to disk, returning the
+        state to continue the output after them, the state argument of a
+        new writer. Only called between lines.
+        """
+        if "".join(self._partial):
+            raise ValueError(
+                "BGZF output can only be checkpointed at the end of a line"
+            )
+        if self._block:
+            self._submit_block(bytes(self._block))
+            self._block = bytearray()
+        while self._queued:
+            self._write_compressed(self._queued.popleft().result())
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        return {
+            "coffset": self._coffset,
+            "n_blocks": self._n_blocks,
+            "block_offsets": self._block_offsets,
+            "index": None if self.indexer is None else self.indexer.to_state(),
+        }
+
+    def _resolve(self, offset: int) -> int:
+        return (self._block_offsets[offset >> 16] << 16) | (offset & 0xFFFF)
+
+    def close(self):
+        if self.closed:
+            return
+        self._write_lines("".join(self._partial))
+        if self._block:
+            self._submit_block(bytes(self._block))
+            self._block = bytearray()
+        while self._queued:
+            self._write_compressed(self._queued.popleft().result())
+        if self._pool is not None:
+            self._pool.shutdown()
+        # Offsets at the very end of the data resolve to the EOF block
+        self._block_offsets.append(self._coffset)
+        self._raw.write(EOF_BLOCK)
+        self._raw.close()
+        # Output without records gets an index without references
+        if self.indexer is not None:
+            write_bgzf_bytes(
+                f"{self.path}.{self.indexer.index_format}",
+                self.indexer.index_bytes(self._resolve),
+                self.level,
+            )
+        self.closed = True
+
+    def __enter__(self) -> "BgzfWriter":
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
+
+
+def open_output(
+    path: str,
+    conf: Tuple,
+    level: int = DEFAULT_COMPRESS_LEVEL,
+    threads: int = 1,
+    index_format: str = "tbi",
+    state: Optional[Dict] = None,
+):
+    """
+    Open an output file for writing text. Paths ending .gz are BGZF
+    compressed and indexed (conf gives the tabix columns), others are plain
+    text. A path of - writes plain text to stdout. Given the state of
+    checkpoint_output, the output is continued from the checkpoint.
+    """
+    if stdio.is_stdio(path):
+        return stdio.StdoutWriter()
+    if not path.endswith(".gz"):
+        if state is None:
+            return open(path, "w")
+        os.truncate(path, state["offset"])
+        return open(path, "a")
+    return BgzfWriter(path, level, threads, TabixIndexer(conf, index_format), state)
+
+
+def checkpoint_output(stream) -> Dict:
+    """
+    Write output of open_output to disk, returning the state open_output
+    takes to continue it after what has been written
+    """
+    if isinstance(stream, BgzfWriter):
+        return stream.checkpoint()
+    if isinstance(stream, stdio.StdoutWriter):
+        raise ValueError("Output to stdout can't be checkpointed")
+    stream.flush()
+    os.fsync(stream.fileno())
+    return {"offset": stream.tell()}
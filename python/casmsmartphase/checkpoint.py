@@ -0,0 +1,203 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module for checkpoints of a long merge, so a run stopped part way
+resumes where it left off. A checkpoint records the number of VCF record
+lines merged, the output written for them and the counts of the run, the
+MNVs parsed are kept beside it so they are not parsed again.
+Checkpoints are only taken between MNVs, no MNV is ever part written.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import Counter
+from itertools import islice
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+from casmsmartphase import bgzf
+from casmsmartphase import mnv_cache
+from casmsmartphase.stats import RunStats
+from casmsmartphase.vcf_lines import split_chrom_pos
+
+LOGGER = logging.getLogger(__name__)
+
+CHECKPOINT_EXTENSION = ".checkpoint"
+MNVS_EXTENSION = ".checkpoint.mnvs"
+# Changed whenever the checkpoint format changes, invalidating checkpoints
+CHECKPOINT_VERSION = 1
+DEFAULT_INTERVAL = 300
+# Lines merged between checks of the time since the last checkpoint
+CHECK_EVERY = 10000
+
+
+def run_key(fields: List[str]) -> str:
+    """
+    Key of the run a checkpoint belongs to, a checkpoint is only resumed by
+    a run with the same inputs and arguments
+    """
+    return hashlib.sha256("\t".join(fields).encode()).hexdigest()
+
+
+def skip_lines(
+    lines: Iterator[str], n_lines: int, last: Optional[List]
+) -> Iterator[str]:
+    """
+    Skip the lines merged before a checkpoint, checking the last of them is
+    at the CHROM and POS recorded
+    """
+    line = None
+    for line in islice(lines, n_lines):
+        pass
+    if last is not None and (line is None or list(split_chrom_pos(line)) != last):
+        raise ValueError("Input VCF differs from the input of the checkpoint")
+    return lines
+
+
+class MergeCheckpoint:
+    """
+    Checkpoints of a merge to output, saved at most every interval seconds
+    """
+
+    def __init__(self, output: str, key: str, interval: float = DEFAULT_INTERVAL):
+        self.path = output + CHECKPOINT_EXTENSION
+        self.mnvs_path = output + MNVS_EXTENSION
+        self.key = key
+        self.interval = interval
+        # Lines merged in this run when the time is next checked
+        self.next_check = CHECK_EVERY
+        self.saved_at = time.monotonic()
+        self.outstream = None
+        self.stats = None
+        self.merge_warnings = None
+        # Lines merged and records written by MNV length before a resume
+        self.base_lines = 0
+        self.base_lengths = Counter()
+
+    def load(self) -> Optional[Dict]:
+        """
+        The last checkpoint of this run, None where there is none
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as data:
+            state = json.load(data)
+        if state.get("version") != CHECKPOINT_VERSION or state.get("key") != self.key:
+            LOGGER.warning(
+                f"Ignoring {self.path}, a checkpoint of a different run or version."
+            )
+            return None
+        if not os.path.exists(self.mnvs_path):
+            LOGGER.warning(f"Ignoring {self.path}, {self.mnvs_path} is missing.")
+            return None
+        return state
+
+    def save_mnvs(self, mnvs: Dict, max_len: int, counts: Counter):
+        mnv_cache.write_entry(self.mnvs_path, mnvs, max_len, counts)
+
+    def load_mnvs(self) -> mnv_cache.CacheEntry:
+        return mnv_cache.read_entry(self.mnvs_path)
+
+    def start(
+        self,
+        outstream,
+        stats: RunStats,
+        merge_warnings: Counter,
+        state: Optional[Dict] = None,
+    ):
+        """
+        Start checkpointing the merge to outstream, continuing from state
+        where resumed. The counts of state are restored to stats and
+        merge_warnings, a first checkpoint is saved otherwise.
+        """
+        self.outstream = outstream
+        self.stats = stats
+        self.merge_warnings = merge_warnings
+        if state is None:
+            self.save(0, None, Counter())
+            return
+        self.base_lines = state["lines"]
+        self.base_lengths = Counter(
+            {int(length): n for (length, n) in state["lengths"].items()}
+        )
+        stats.counts.update(state["counts"])
+        merge_warnings.update(state["merge_warnings"])
+
+    def update(self, done: int, line: str, lengths: Counter):
+        """
+        Called by the merge once done lines are merged, line the last of
+        them, saving a checkpoint if the interval has passed
+        """
+        self.next_check = done + CHECK_EVERY
+        if time.monotonic() - self.saved_at >= self.interval:
+            self.save(done, line, lengths)
+
+    def save(self, done: int, line: Optional[str], lengths: Counter):
+        """
+        Write the output so far to disk and save a checkpoint after the
+        done lines merged in this run, written under a temporary name and
+        moved into place so a partial checkpoint is never read
+        """
+        state = {
+            "version": CHECKPOINT_VERSION,
+            "key": self.key,
+            "lines": self.base_lines + done,
+            "last": None if line is None else list(split_chrom_pos(line)),
+            "output": bgzf.checkpoint_output(self.outstream),
+            "lengths": dict(self.base_lengths + lengths),
+            "counts": dict(self.stats.counts),
+            "merge_warnings": dict(self.merge_warnings),
+        }
+        (fd, tmp_path) = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.path)), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as out:
+                json.dump(state, out)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.stats.counts["checkpoints"] += 1
+        self.saved_at = time.monotonic()
+
+    def finish(self):
+        """
+        Remove the checkpoint once the output is complete
+        """
+        for path in (self.path, self.mnvs_path):
+            if os.path.exists(path):
+                os.remove(path)
@@ -33,33 +33,156 @@ from functools import wraps
 
 import click
 import pkg_resources  # part of setuptools
+from casmsmartphase import batch
+from casmsmartphase import bgzf
 from casmsmartphase import merge_mnv_to_vcf
+from casmsmartphase import phase_pipeline
+from casmsmartphase import profiling
+from casmsmartphase import stdio
 from casmsmartphase import vcf_to_bed
+from casmsmartphase.mnv_cache import DEFAULT_MAX_SIZE_MB
+from casmsmartphase.MNVMerge import MNV_ENCODINGS
+from casmsmartphase.parallel import can_fetch_windows
+from casmsmartphase.shards import SHARD_BY
 
 CUTOFF_DEFAULT = 0.0
-HELP_VCF_IN = "Path to input VCF file"
+HELP_VCF_IN = "Path to input VCF file, - for stdin"
+HELP_PIPELINE_VCF_IN = "Path to input VCF file, also read by the phasing command"
 HELP_EXCLUDE = "Exclude phased MNV if it matches any of the exclude flag bits"
 HELP_CUTOFF = (
     f"Exclude any MNVs with a phased score < cutoff [default: {CUTOFF_DEFAULT}]"
 )
-HELP_OUTPUT_BED = "Path to write output bed file"
+HELP_OUTPUT_BED = """Path to write output bed file, bgzipped and indexed if ending
+                  .gz, - for stdout. {sample} is replaced by the sample name
+                  and {shard} by the shard number, required to write a bed
+                  for each of several samples or shards"""
 HELP_OUTPUT_HZ_BED = (
     "Mark homozygous adjacent SNVs in the bed file output (default - don't mark)"
 )
-HELP_OUTPUT_VCF = "Path to write output vcf file"
-HELP_SPHASE_OUT = "The phased output file from Smart-Phase"
+HELP_OUTPUT_VCF = """Path to write output vcf file, bgzipped and indexed if ending
+                  .gz, - for stdout"""
+HELP_SPHASE_OUT = """The phased output file from Smart-Phase, - for stdin or a
+                  named pipe (read once, so can't be used with --streaming).
+                  May be repeated, e.g. for the output of each shard of
+                  generate-bed --shards, merged as one phased set"""
 HELP_BED_REGIONS = """.bed file of regions used to run smartphase.
-                    If homozygous adjacent SNVs are marked in the file they will be output in the merged VCF as an MNV."""
-FILEPATH_INPUTS = ["vcfin", "output", "smart_phased_output"]
+                    If homozygous adjacent SNVs are marked in the file they will be output in the merged VCF as an MNV.
+                    May be repeated, e.g. for the beds of each shard"""
+HELP_THREADS = """Number of worker processes merging genomic windows in parallel.
+                Requires a bgzipped, tabix indexed input VCF [default: 1]"""
+HELP_STREAMING = """Merge join the smart-phase output and bed file against the VCF,
+                holding only nearby MNVs in memory. Both must be sorted in the
+                contig order of the VCF header. Can't be used with --threads"""
+HELP_PHASE_CMD = """Phasing command to run, e.g. a smart-phase command line.
+                 {vcf}, {bed} and {output} are replaced by the input VCF, the
+                 candidate bed file and the phased output file to write"""
+HELP_WORKDIR = """Directory to keep the candidate bed and phased output in
+               [default: temporary directory, removed on completion]"""
+HELP_COMPRESS_LEVEL = """zlib compression level of bgzipped output, used
+                      where the output path ends .gz"""
+HELP_COMPRESS_THREADS = "Number of threads compressing bgzipped output"
+HELP_INDEX_FORMAT = """Index written alongside bgzipped output, tbi or csi
+                    (required for contigs longer than 2^29)"""
+HELP_STATS_JSON = """Write per stage timings, throughput, peak memory and counts
+                  of the run to this JSON file"""
+HELP_PROGRESS = "Report progress and estimated time remaining to stderr"
+HELP_COLUMNAR = """Find blocks of adjacent SNVs with NumPy array operations over
+                large chunks of records"""
+HELP_SHARDS = """Split the blocks of adjacent SNVs into this many beds, each of
+              a contiguous run of blocks, to run smart-phase on each
+              separately"""
+HELP_SHARD_BY = """Balance the shards by the number of blocks or their total
+                span in bases"""
+HELP_SAMPLE = """Sample to find blocks of adjacent SNVs for. May be repeated, all
+              for every sample of the VCF. Several samples are scanned in one
+              pass over the VCF"""
+HELP_REGION = """Restrict the run to a region, chr, chr:start or chr:start-end (1-based,
+              inclusive). May be repeated. Requires a bgzipped, tabix or CSI
+              indexed input VCF"""
+HELP_REGIONS_FILE = """Restrict the run to the regions of a bed file. Requires a
+                    bgzipped, tabix or CSI indexed input VCF"""
+HELP_MNV_ENCODING = """Encoding of the per base values of merged MNVs. incremental
+                   adds KEY_1..KEY_n INFO and FORMAT fields, with header lines
+                   for the longest MNV. compact lists the values under the
+                   original keys, with a fixed size header"""
+HELP_MANIFEST = """TSV (with a header line) or JSON manifest of samples, fields
+                sample, vcfin and output and optionally smart_phased_output,
+                phase_cmd, bed, cutoff, exclude, markhz, mnv_encoding and
+                workdir. Samples with a smart_phased_output are merged as
+                merge-mnvs, others are run as phase-pipeline"""
+HELP_BATCH_PHASE_CMD = """Phasing command for samples without a smart_phased_output
+                       or phase_cmd, as phase-pipeline --phase-cmd. {sample} is
+                       replaced by the sample name"""
+HELP_WORKERS = "Number of worker processes running the Python stages of samples"
+HELP_PHASE_JOBS = """Number of phasing commands run at a time, overlapped with
+                  the Python stages [default: --workers]"""
+HELP_BATCH_WORKDIR = """Directory to keep the candidate bed and phased output of
+                     each sample in, in a directory per sample [default:
+                     temporary directories, removed on completion]"""
+HELP_REPORT = """Path to write the status and stage timings of each sample, JSON
+              if ending .json, else TSV"""
+HELP_CACHE_DIR = """Directory caching the MNVs parsed from smart-phase output,
+                 keyed by the content of the phased output and bed file and
+                 the cutoff and exclude flags, so repeat runs skip parsing"""
+HELP_CACHE_SIZE = """Size limit of the cache directory in MB, least recently
+                  used entries are removed beyond it"""
+HELP_PIPELINED = """Read and decompress the input VCF and serialise and compress
+                 the output on their own threads, overlapping the merge.
+                 Applies to merges in a single process"""
+HELP_CHECKPOINT = """Save a checkpoint of the merge every SECONDS beside the
+                  output (output.checkpoint), a rerun of the same command
+                  resumes from it, truncating the output to the checkpoint.
+                  Records are merged in a single process, the output and
+                  smart-phase output must be files"""
+HELP_INCREMENTAL = """Previous merge-mnvs output of the input VCF. Only the
+                    MNVs changed from it are merged again, the rest of its
+                    records are copied through, e.g. after smart-phase is
+                    rerun for some regions"""
+HELP_PROFILE = """Directory to write a profile of the command to, cProfile
+               statistics (.pstats) of the main process by default"""
+HELP_PROFILE_SAMPLE = """With --profile, sample the stacks of every thread each
+                      SECONDS instead of using cProfile, at much lower cost,
+                      writing them in the folded format of flame graph tools
+                      (.folded)"""
+HELP_PROFILE_MEMORY = """With --profile, trace memory allocations, writing a
+                      tracemalloc snapshot at the end of each stage"""
+FILEPATH_INPUTS = [
+    "vcfin",
+    "output",
+    "smart_phased_output",
+    "regions_file",
+    "incremental",
+]
+# Arguments only recorded in the VCF header when given
+OPTIONAL_INPUTS = ["region", "regions_file", "incremental"]
+# Arguments only recorded in the VCF header when not their default
+DEFAULT_INPUTS = {"mnv_encoding": MNV_ENCODINGS[0]}
+# Arguments that don't change the output, so aren't recorded in the VCF header
+RUNTIME_ONLY_INPUTS = [
+    "threads",
+    "streaming",
+    "workdir",
+    "compress_level",
+    "compress_threads",
+    "index_format",
+    "stats_json",
+    "progress",
+    "columnar",
+    "cache_dir",
+    "cache_size_mb",
+    "pipelined",
+    "checkpoint_interval",
+]
 
 
-def _file_exists():
+def _file_exists(allow_dash=False):
     return click.Path(
         exists=True,
         file_okay=True,
         dir_okay=False,
         readable=True,
         resolve_path=True,
+        allow_dash=allow_dash,
     )
 
 
@@ -67,8 +190,19 @@ def generate_arg_string(*args, **kwargs):
     ag_str = ""
     idx = 0
     for key, item in kwargs.items():
+        if (
+            key in RUNTIME_ONLY_INPUTS
+            or (key in OPTIONAL_INPUTS and not item)
+            or (key in DEFAULT_INPUTS and item == DEFAULT_INPUTS[key])
+        ):
+            continue
         if key in FILEPATH_INPUTS:
-            item = os.path.basename(item)
+            if isinstance(item, tuple):
+                item = tuple(map(os.path.basename, item))
+            else:
+                item = os.path.basename(item)
+        if isinstance(item, tuple):
+            item = ";".join(item)
         if idx > 0:
             ag_str += ","
         ag_str += f"{key}={item}"
@@ -76,6 +210,18 @@ def generate_arg_string(*args, **kwargs):
     return ag_str
 
 
+def check_region_input(vcfin, region, regions_file):
+    """
+    Regions are read through the index of the input VCF, so it must be a
+    bgzipped and indexed file
+    """
+    if (region or regions_file) and not can_fetch_windows(vcfin):
+        raise click.BadParameter(
+            "--region/--regions-file need a bgzipped, tabix or CSI indexed VCF, not stdin or an unindexed file",
+            param_hint="--vcfin",
+        )
+
+
 def common_params(f):
     @click.version_option(pkg_resources.require(__name__.split(".")[0])[0].version)
     @click.option(
@@ -83,7 +229,7 @@ def common_params(f):
         "--vcfin",
         required=True,
         default=None,
-        type=_file_exists(),
+        type=_file_exists(allow_dash=True),
         help=HELP_VCF_IN,
     )
     @wraps(f)
@@ -93,10 +239,125 @@ def common_params(f):
     return wrapper
 
 
+def compression_params(f):
+    @click.option(
+        "--compress-level",
+        default=bgzf.DEFAULT_COMPRESS_LEVEL,
+        show_default=True,
+        type=click.IntRange(0, 9),
+        help=HELP_COMPRESS_LEVEL,
+    )
+    @click.option(
+        "--compress-threads",
+        default=1,
+        show_default=True,
+        type=click.IntRange(min=1),
+        help=HELP_COMPRESS_THREADS,
+    )
+    @click.option(
+        "--index-format",
+        default="tbi",
+        show_default=True,
+        type=click.Choice(bgzf.INDEX_FORMATS),
+        help=HELP_INDEX_FORMAT,
+    )
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        return f(*args, **kwargs)
+
+    return wrapper
+
+
+def reporting_params(f):
+    @click.option(
+        "--stats-json",
+        required=False,
+        default=None,
+        type=click.Path(file_okay=True, dir_okay=False, writable=True),
+        help=HELP_STATS_JSON,
+    )
+    @click.option("--progress/--no-progress", help=HELP_PROGRESS, default=False)
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        return f(*args, **kwargs)
+
+    return wrapper
+
+
+def mnv_encoding_params(f):
+    @click.option(
+        "--mnv-encoding",
+        default="incremental",
+        show_default=True,
+        type=click.Choice(MNV_ENCODINGS),
+        help=HELP_MNV_ENCODING,
+    )
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        return f(*args, **kwargs)
+
+    return wrapper
+
+
+def region_params(f):
+    @click.option(
+        "-r",
+        "--region",
+        multiple=True,
+        metavar="chr:start-end",
+        help=HELP_REGION,
+    )
+    @click.option(
+        "-R",
+        "--regions-file",
+        required=False,
+        default=None,
+        type=_file_exists(),
+        help=HELP_REGIONS_FILE,
+    )
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        return f(*args, **kwargs)
+
+    return wrapper
+
+
 @click.group()
 @click.version_option(pkg_resources.require(__name__.split(".")[0])[0].version)
-def cli():
-    pass
+@click.option(
+    "--profile",
+    "profile_dir",
+    default=None,
+    envvar="CASMSMARTPHASE_PROFILE",
+    show_envvar=True,
+    type=click.Path(file_okay=False, dir_okay=True, writable=True),
+    help=HELP_PROFILE,
+)
+@click.option(
+    "--profile-sample",
+    default=None,
+    envvar="CASMSMARTPHASE_PROFILE_SAMPLE",
+    show_envvar=True,
+    type=click.FloatRange(min=0, min_open=True),
+    metavar="SECONDS",
+    help=HELP_PROFILE_SAMPLE,
+)
+@click.option(
+    "--profile-memory/--no-profile-memory",
+    default=False,
+    envvar="CASMSMARTPHASE_PROFILE_MEMORY",
+    show_envvar=True,
+    help=HELP_PROFILE_MEMORY,
+)
+@click.pass_context
+def cli(ctx, profile_dir, profile_sample, profile_memory):
+    if profile_dir:
+        profiler = profiling.Profiler(
+            profile_dir, ctx.invoked_subcommand, profile_memory, profile_sample
+        )
+        profiler.start()
+        # Written when the command ends, including when it fails
+        ctx.call_on_close(profiler.stop)
 
 
 @cli.command()
@@ -109,10 +370,37 @@ def cli():
     required=False,
 )
 @click.option("--markhz/--nomarkhz", help=HELP_OUTPUT_HZ_BED, default=False)
+@compression_params
+@click.option("--columnar/--no-columnar", help=HELP_COLUMNAR, default=False)
+@click.option(
+    "-s",
+    "--sample",
+    multiple=True,
+    default=[vcf_to_bed.TUMOUR_SAMPLE],
+    show_default=True,
+    help=HELP_SAMPLE,
+)
+@click.option(
+    "--shards",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help=HELP_SHARDS,
+)
+@click.option(
+    "--shard-by",
+    default="count",
+    show_default=True,
+    type=click.Choice(SHARD_BY),
+    help=HELP_SHARD_BY,
+)
+@region_params
+@reporting_params
 def generate_bed(*args, **kwargs):
     """
     Generate a bed file of adjacent SNVs in a VCF for smartphase analysis
     """
+    check_region_input(kwargs["vcfin"], kwargs["region"], kwargs["regions_file"])
     vcf_to_bed.run_parse(*args, **kwargs)
 
 
@@ -131,7 +419,9 @@ def generate_bed(*args, **kwargs):
     "--smart-phased-output",
     help=HELP_SPHASE_OUT,
     required=True,
+    multiple=True,
     metavar="sample.phased.output",
+    type=click.Path(exists=True, dir_okay=False, allow_dash=True),
 )
 @click.option(
     "-c",
@@ -153,14 +443,233 @@ def generate_bed(*args, **kwargs):
     "-b",
     "--bed",
     required=False,
-    default=None,
+    multiple=True,
     type=_file_exists(),
     help=HELP_BED_REGIONS,
 )
+@click.option(
+    "-t",
+    "--threads",
+    "--workers",
+    "threads",
+    default=1,
+    type=click.IntRange(min=1),
+    help=HELP_THREADS,
+    required=False,
+)
+@click.option("--streaming/--no-streaming", help=HELP_STREAMING, default=False)
+@click.option("--pipelined/--no-pipelined", help=HELP_PIPELINED, default=False)
+@click.option(
+    "--checkpoint-interval",
+    metavar="SECONDS",
+    required=False,
+    default=None,
+    type=click.FloatRange(min=0),
+    help=HELP_CHECKPOINT,
+)
+@click.option(
+    "--incremental",
+    metavar="previous.vcf",
+    required=False,
+    default=None,
+    type=_file_exists(),
+    help=HELP_INCREMENTAL,
+)
+@mnv_encoding_params
+@click.option(
+    "--cache-dir",
+    required=False,
+    default=None,
+    envvar="CASMSMARTPHASE_CACHE_DIR",
+    show_envvar=True,
+    type=click.Path(file_okay=False, dir_okay=True, writable=True),
+    help=HELP_CACHE_DIR,
+)
+@click.option(
+    "--cache-size-mb",
+    default=DEFAULT_MAX_SIZE_MB,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help=HELP_CACHE_SIZE,
+)
+@compression_params
+@region_params
+@reporting_params
 def merge_mnvs(*args, **kwargs):
     """
     Merge MNVs parsed by smartphase into a CaVEMan SNV and MNV vcf file
     """
+    if kwargs["streaming"] and kwargs["threads"] > 1:
+        raise click.BadOptionUsage(
+            "streaming", "--streaming can't be combined with --threads"
+        )
+    stdin_inputs = [kwargs["vcfin"], *kwargs["smart_phased_output"]]
+    if sum(map(stdio.is_stdio, stdin_inputs)) > 1:
+        raise click.BadParameter(
+            "Only one of --vcfin and --smart-phased-output can be read from stdin",
+            param_hint="--smart-phased-output",
+        )
+    if kwargs["streaming"] and any(map(stdio.is_stream, kwargs["smart_phased_output"])):
+        raise click.BadOptionUsage(
+            "streaming",
+            "--streaming reads the smart-phase output twice, it can't be stdin or a pipe",
+        )
+    check_region_input(kwargs["vcfin"], kwargs["region"], kwargs["regions_file"])
+    if (kwargs["region"] or kwargs["regions_file"]) and (
+        kwargs["streaming"] or kwargs["threads"] > 1
+    ):
+        raise click.BadOptionUsage(
+            "region",
+            "--region/--regions-file can't be combined with --streaming or --threads",
+        )
+    if kwargs["checkpoint_interval"] is not None:
+        if kwargs["streaming"] or kwargs["pipelined"]:
+            raise click.BadOptionUsage(
+                "checkpoint_interval",
+                "--checkpoint-interval can't be combined with --streaming or --pipelined",
+            )
+        if kwargs["region"] or kwargs["regions_file"]:
+            raise click.BadOptionUsage(
+                "checkpoint_interval",
+                "--checkpoint-interval can't be combined with --region/--regions-file",
+            )
+        if stdio.is_stdio(kwargs["output"]) or any(
+            map(stdio.is_stream, kwargs["smart_phased_output"])
+        ):
+            raise click.BadOptionUsage(
+                "checkpoint_interval",
+                "--checkpoint-interval needs --output and --smart-phased-output to be files",
+            )
+    if kwargs["incremental"] is not None and (
+        kwargs["streaming"]
+        or kwargs["pipelined"]
+        or kwargs["checkpoint_interval"] is not None
+        or kwargs["region"]
+        or kwargs["regions_file"]
+    ):
+        raise click.BadOptionUsage(
+            "incremental",
+            "--incremental can't be combined with --streaming, --pipelined, --checkpoint-interval or regions",
+        )
+    # Recorded as bed=None in the VCF header when not given
+    kwargs["bed"] = kwargs["bed"] or None
     arg_str = generate_arg_string(*args, **kwargs)
     kwargs["arg_str"] = arg_str
     merge_mnv_to_vcf.run(*args, **kwargs)
+
+
+@cli.command("phase-pipeline")
+@click.version_option(pkg_resources.require(__name__.split(".")[0])[0].version)
+@click.option(
+    "-f",
+    "--vcfin",
+    required=True,
+    default=None,
+    type=_file_exists(),
+    help=HELP_PIPELINE_VCF_IN,
+)
+@click.option(
+    "-o",
+    "--output",
+    metavar="output.vcf",
+    help=HELP_OUTPUT_VCF,
+    required=False,
+    default="output.MNV.vcf",
+)
+@click.option(
+    "--phase-cmd",
+    required=True,
+    help=HELP_PHASE_CMD,
+)
+@click.option(
+    "-c",
+    "--cutoff",
+    default=CUTOFF_DEFAULT,
+    type=float,
+    help=HELP_CUTOFF,
+    required=False,
+)
+@click.option(
+    "-x",
+    "--exclude",
+    default=2,  # Default to exclude 'trans' phased MNVs
+    type=int,
+    help=HELP_EXCLUDE,
+    required=False,
+)
+@click.option("--markhz/--nomarkhz", help=HELP_OUTPUT_HZ_BED, default=False)
+@click.option(
+    "-w",
+    "--workdir",
+    required=False,
+    default=None,
+    type=click.Path(file_okay=False, dir_okay=True, writable=True),
+    help=HELP_WORKDIR,
+)
+@mnv_encoding_params
+def phase_pipeline_cmd(*args, **kwargs):
+    """
+    Generate candidates, phase and merge MNVs in a single run
+    """
+    arg_str = generate_arg_string(*args, **kwargs)
+    kwargs["arg_str"] = arg_str
+    phase_pipeline.run(*args, **kwargs)
+
+
+@cli.command("batch")
+@click.version_option(pkg_resources.require(__name__.split(".")[0])[0].version)
+@click.option(
+    "-m",
+    "--manifest",
+    required=True,
+    type=_file_exists(),
+    help=HELP_MANIFEST,
+)
+@click.option("--phase-cmd", required=False, default=None, help=HELP_BATCH_PHASE_CMD)
+@click.option(
+    "-t",
+    "--workers",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help=HELP_WORKERS,
+)
+@click.option(
+    "--phase-jobs",
+    required=False,
+    default=None,
+    type=click.IntRange(min=1),
+    help=HELP_PHASE_JOBS,
+)
+@click.option(
+    "-w",
+    "--workdir",
+    required=False,
+    default=None,
+    type=click.Path(file_okay=False, dir_okay=True, writable=True),
+    help=HELP_BATCH_WORKDIR,
+)
+@click.option(
+    "--report",
+    default="batch_report.tsv",
+    show_default=True,
+    type=click.Path(file_okay=True, dir_okay=False, writable=True),
+    help=HELP_REPORT,
+)
+def batch_cmd(manifest, phase_cmd, workers, phase_jobs, workdir, report):
+    """
+    Merge or phase and merge MNVs for every sample of a manifest in a
+    single process
+    """
+    try:
+        jobs = batch.read_manifest(manifest, phase_cmd, workdir)
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint="--manifest")
+    for job in jobs:
+        job["params"]["arg_str"] = generate_arg_string(**job["params"])
+    reports = batch.run(jobs, workers, phase_jobs, report)
+    failed = [result["sample"] for result in reports if result["status"] != "ok"]
+    if failed:
+        raise click.ClickException(
+            f"{len(failed)} of {len(reports)} samples failed, see {report}"
+        )
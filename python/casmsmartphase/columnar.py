@@ -0,0 +1,302 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module finding candidate blocks of adjacent SNVs with NumPy,
+loading the positions and zygosity of records into arrays in large chunks
+and detecting runs with array operations rather than per record comparisons.
+Chunks of regular records are tokenised as a whole, as a single byte array,
+any other chunk is read line by line.
+"""
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+from casmsmartphase.stats import RunStats
+from casmsmartphase.vcf_lines import gt_is_het
+from casmsmartphase.vcf_lines import ZygosityReader
+
+# Size of the chunks of record lines loaded into arrays at a time, bounding
+# the memory used by the per byte arrays of each chunk
+CHUNK_BYTES = 2 << 20
+(NEWLINE, TAB, COLON) = (ord("\n"), ord("\t"), ord(":"))
+# FORMAT of a regular record starts with GT
+GT_FORMAT = (ord("G"), ord("T"))
+# Longest POS and GT value of a regular record, read into 64-bit integers
+POS_DIGITS = 18
+GT_BYTES = 8
+
+# Arrays of the contig, position and is_het of a chunk of records
+Columns = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def iter_text_chunks(lines: Iterable[str], chunk_bytes: int) -> Iterator[str]:
+    """
+    Iterate through chunks of whole VCF record lines of about chunk_bytes.
+    A text stream is read in blocks, rather than line by line.
+    """
+    read = getattr(lines, "read", None)
+    if read is not None:
+        for text in iter(lambda: read(chunk_bytes), ""):
+            yield text if text.endswith("\n") else text + lines.readline()
+        return
+    lines = iter(lines)
+    while True:
+        (chunk, size) = ([], 0)
+        for line in lines:
+            chunk.append(line)
+            size += len(line)
+            if size >= chunk_bytes:
+                break
+        if not chunk:
+            return
+        yield "".join(chunk)
+
+
+def iter_columns(
+    lines: Iterable[str], sample: int, chunk_bytes: int = CHUNK_BYTES
+) -> Iterator[Columns]:
+    """
+    Iterate through chunks of VCF record lines, yielding arrays of the
+    contig, position and is_het of the sample at index sample
+    """
+    zygosity = ZygosityReader(sample)
+    for text in iter_text_chunks(lines, chunk_bytes):
+        columns = parse_record_bytes(text.encode(), zygosity)
+        if columns is None:
+            columns = parse_record_lines(text.rstrip("\n").split("\n"), zygosity)
+        yield columns
+
+
+def parse_record_lines(lines: List[str], zygosity: ZygosityReader) -> Columns:
+    """
+    Columns of VCF record lines, split on tabs line by line
+    """
+    (contigs, positions, hets) = ([], [], [])
+    for line in lines:
+        fields = line.split("\t")
+        contigs.append(fields[0])
+        positions.append(int(fields[1]))
+        hets.append(zygosity.is_het(fields))
+    return (
+        np.array(contigs, dtype=object),
+        np.array(positions, dtype=np.int64),
+        np.array(hets, dtype=bool),
+    )
+
+
+def parse_record_bytes(data: bytes, zygosity: ZygosityReader) -> Optional[Columns]:
+    """
+    Columns of regular VCF record lines, tokenised as a single byte array:
+    every line has the sample's column, GT first in FORMAT, a POS of only
+    digits and a GT of up to GT_BYTES. Returns None where the lines are not
+    regular.
+    """
+    if not data.endswith(b"\n"):
+        data += b"\n"
+    text = np.frombuffer(data, dtype=np.uint8)
+    line_ends = np.flatnonzero(text == NEWLINE)
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+    tabs = np.flatnonzero(text == TAB)
+    first_tab = np.searchsorted(tabs, line_starts)
+    column = zygosity.column
+    if np.any(np.searchsorted(tabs, line_ends) - first_tab < column):
+        return None
+
+    def tab(field: int) -> np.ndarray:
+        # Offset of the tab ending field of each line
+        return tabs[first_tab + field]
+
+    gt_format = tab(7) + 1
+    if (
+        np.any(text[gt_format] != GT_FORMAT[0])
+        or np.any(text[gt_format + 1] != GT_FORMAT[1])
+        or not np.all(np.isin(text[gt_format + 2], (COLON, TAB)))
+    ):
+        return None
+    positions = parse_digits(text, tab(0) + 1, tab(1))
+    # The sample's column ends at a tab, or the end of the line
+    sample_start = tab(column - 1) + 1
+    sample_end = np.minimum(np.append(tabs, len(text))[first_tab + column], line_ends)
+    sample_end -= (text[sample_end - 1] == ord("\r")) & (sample_end == line_ends)
+    gts = pack_gts(text, sample_start, sample_end)
+    if positions is None or gts is None:
+        return None
+    return (
+        contig_column(data, text, line_starts, tab(0)),
+        positions,
+        gt_hets(gts, zygosity.het_gts),
+    )
+
+
+def parse_digits(
+    text: np.ndarray, starts: np.ndarray, ends: np.ndarray
+) -> Optional[np.ndarray]:
+    """
+    Integers of the fields of text from starts to ends, None unless every
+    field is 1 to POS_DIGITS digits
+    """
+    lengths = ends - starts
+    if np.any(lengths < 1) or np.any(lengths > POS_DIGITS):
+        return None
+    values = np.zeros(len(starts), dtype=np.int64)
+    for offset in range(int(lengths.max(initial=0))):
+        inside = offset < lengths
+        digits = text[np.where(inside, starts + offset, starts)].astype(np.int64) - 48
+        if np.any(inside & ((digits < 0) | (digits > 9))):
+            return None
+        values = np.where(inside, values * 10 + digits, values)
+    return values
+
+
+def pack_gts(
+    text: np.ndarray, starts: np.ndarray, ends: np.ndarray
+) -> Optional[np.ndarray]:
+    """
+    GT values, the first subfield of the sample fields of text from starts
+    to ends, packed into the bytes of 64-bit integers. None unless every GT
+    is up to GT_BYTES.
+    """
+    lengths = ends - starts
+    packed = np.zeros(len(starts), dtype=np.uint64)
+    done = np.zeros(len(starts), dtype=bool)
+    for offset in range(GT_BYTES + 1):
+        inside = offset < lengths
+        byte = text[np.where(inside, starts + offset, starts)]
+        done |= ~inside | (byte == COLON)
+        if offset == GT_BYTES:
+            break
+        packed |= np.where(done, 0, byte).astype(np.uint64) << np.uint64(8 * offset)
+    return packed if np.all(done) else None
+
+
+def gt_hets(gts: np.ndarray, het_gts: Dict[str, bool]) -> np.ndarray:
+    """
+    is_het of packed GT values, each distinct value looked up once in
+    het_gts, as ZygosityReader
+    """
+    (values, inverse) = np.unique(gts, return_inverse=True)
+    is_het = []
+    for value in values.tolist():
+        gt = value.to_bytes(GT_BYTES, "little").rstrip(b"\0").decode()
+        if gt not in het_gts:
+            het_gts[gt] = gt_is_het(gt)
+        is_het.append(het_gts[gt])
+    return np.array(is_het, dtype=bool)[inverse.reshape(-1)]
+
+
+def contig_column(
+    data: bytes, text: np.ndarray, starts: np.ndarray, ends: np.ndarray
+) -> np.ndarray:
+    """
+    Contig names of the CHROM fields of text from starts to ends. Records
+    are in runs by contig, only the first of each run is decoded.
+    """
+    lengths = ends - starts
+    same = np.zeros(len(starts), dtype=bool)
+    same[1:] = lengths[1:] == lengths[:-1]
+    for offset in range(int(lengths.max(initial=0))):
+        inside = offset < lengths[1:]
+        same[1:] &= ~inside | (
+            text[np.where(inside, starts[1:] + offset, 0)]
+            == text[np.where(inside, starts[:-1] + offset, 0)]
+        )
+    runs = np.flatnonzero(~same)
+    names = np.empty(len(runs), dtype=object)
+    names[:] = [
+        data[start:end].decode()
+        for (start, end) in zip(starts[runs].tolist(), ends[runs].tolist())
+    ]
+    return np.repeat(names, np.diff(np.append(runs, len(starts))))
+
+
+def find_runs(columns: Columns) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Start index and length of each run of adjacent records with the same
+    contig and zygosity
+    """
+    (contigs, positions, hets) = columns
+    breaks = np.empty(len(positions), dtype=bool)
+    breaks[:1] = True
+    np.not_equal(contigs[1:], contigs[:-1], out=breaks[1:])
+    breaks[1:] |= positions[1:] > positions[:-1] + 1
+    breaks[1:] |= hets[1:] != hets[:-1]
+    starts = np.flatnonzero(breaks)
+    return starts, np.diff(starts, append=len(positions))
+
+
+def iter_blocks_columnar(
+    chunks: Iterable[Columns], stats: Optional[RunStats] = None
+) -> Iterator[Tuple[str, int, int, bool]]:
+    """
+    Iterate through chunks of columns, yielding (contig, bed start, bed end,
+    is_het) for each block of two or more adjacent SNVs with the same
+    zygosity, as vcf_to_bed.iter_blocks. Block lengths and het/hom counts
+    are added to stats from the arrays.
+    """
+    # Records of the last run of the previous chunk, which may continue
+    carry = None
+    for chunk in chunks:
+        if carry is not None:
+            chunk = tuple(np.concatenate(pair) for pair in zip(carry, chunk))
+        (starts, lengths) = find_runs(chunk)
+        last = starts[-1]
+        carry = tuple(column[last:] for column in chunk)
+        yield from _blocks(chunk, starts[:-1], lengths[:-1], stats)
+    if carry is not None:
+        yield from _blocks(carry, np.zeros(1, np.int64), [len(carry[1])], stats)
+
+
+def _blocks(
+    columns: Columns, starts: np.ndarray, lengths, stats: Optional[RunStats]
+) -> Iterator[Tuple[str, int, int, bool]]:
+    (contigs, positions, hets) = columns
+    lengths = np.asarray(lengths, dtype=np.int64)
+    blocks = lengths > 1
+    (starts, lengths) = (starts[blocks], lengths[blocks])
+    block_hets = hets[starts]
+    bed_starts = positions[starts] - 1
+    bed_ends = positions[starts + lengths - 1]
+    if stats is not None:
+        n_het = int(block_hets.sum())
+        stats.counts["het_blocks"] += n_het
+        stats.counts["hom_blocks"] += len(starts) - n_het
+        (uniq, counts) = np.unique(bed_ends - bed_starts, return_counts=True)
+        stats.mnv_lengths.update(dict(zip(uniq.tolist(), counts.tolist())))
+    return zip(
+        contigs[starts].tolist(),
+        bed_starts.tolist(),
+        bed_ends.tolist(),
+        block_hets.tolist(),
+    )
@@ -0,0 +1,256 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module loading the blocks of adjacent SNVs marked homozygous in a
+candidate bed file into sorted per contig arrays of start and end positions,
+looked up by binary search
+"""
+from array import array
+from operator import itemgetter
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+import pysam
+from casmsmartphase import stdio
+from casmsmartphase.mnv_chains import ContigMNVs
+from casmsmartphase.parallel import can_fetch_windows
+from casmsmartphase.regions import Region
+from casmsmartphase.sphase_bulk import split_ranges
+
+# Fields of a bed line not marked homozygous: contig, start and end
+UNMARKED_FIELDS = 3
+# Bed lines are parsed in ranges of about this many bytes, the token lists
+# of larger ranges cost more memory than they save in per range overhead
+CHUNK_BYTES = 1 << 20
+IS_WHITESPACE = np.zeros(256, dtype=bool)
+IS_WHITESPACE[list(b" \t\n\r\x0b\x0c")] = True
+NEWLINE = ord("\n")
+
+# Homozygous blocks by contig, as 1-based start and end positions
+HomBlocks = Dict[str, ContigMNVs]
+
+
+def to_contig_mnvs(starts: np.ndarray, ends: np.ndarray) -> ContigMNVs:
+    """
+    Store of sorted NumPy start and end positions
+    """
+    return ContigMNVs(
+        array("q", starts.astype(np.int64).tobytes()),
+        array("q", ends.astype(np.int64).tobytes()),
+    )
+
+
+def check_blocks(contig: str, starts: np.ndarray, ends: np.ndarray):
+    """
+    Check sorted blocks each span at least two adjacent SNVs and don't
+    overlap
+    """
+    short = np.flatnonzero(ends <= starts)
+    if len(short):
+        raise ValueError(
+            f"Homozygous block {contig}:{starts[short[0]]}-{ends[short[0]]} is not of adjacent SNVs"
+        )
+    overlaps = np.flatnonzero(starts[1:] <= ends[:-1])
+    if len(overlaps):
+        (first, second) = (overlaps[0], overlaps[0] + 1)
+        raise ValueError(
+            f"Homozygous blocks {contig}:{starts[first]}-{ends[first]} and "
+            f"{contig}:{starts[second]}-{ends[second]} overlap"
+        )
+
+
+def blocks_from_columns(
+    contigs: np.ndarray, starts: np.ndarray, ends: np.ndarray
+) -> HomBlocks:
+    """
+    Sort, deduplicate and check the blocks of each contig. Contigs are kept
+    in order of first appearance.
+    """
+    run_starts = np.ones(len(contigs), dtype=bool)
+    run_starts[1:] = contigs[1:] != contigs[:-1]
+    bounds = np.append(np.flatnonzero(run_starts), len(contigs))
+    # Runs of blocks on the same contig, there is usually one per contig
+    runs = {}
+    for (run_start, run_end) in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        runs.setdefault(contigs[run_start], []).append(slice(run_start, run_end))
+    blocks = {}
+    for (name, slices) in runs.items():
+        if isinstance(name, bytes):
+            name = name.decode()
+        contig_starts = np.concatenate([starts[run] for run in slices])
+        contig_ends = np.concatenate([ends[run] for run in slices])
+        if np.any(contig_starts[1:] < contig_starts[:-1]):
+            order = np.lexsort((contig_ends, contig_starts))
+            (contig_starts, contig_ends) = (contig_starts[order], contig_ends[order])
+        # Repeated blocks are only kept once
+        unique = np.ones(len(contig_starts), dtype=bool)
+        unique[1:] = (contig_starts[1:] != contig_starts[:-1]) | (
+            contig_ends[1:] != contig_ends[:-1]
+        )
+        (contig_starts, contig_ends) = (contig_starts[unique], contig_ends[unique])
+        check_blocks(name, contig_starts, contig_ends)
+        blocks[name] = to_contig_mnvs(contig_starts, contig_ends)
+    return blocks
+
+
+def parse_hom_columns(data: bytes) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Parse lines of a candidate bed file, returning the contigs and 1-based
+    start and end positions of lines with more than three fields, those
+    marked homozygous. Blank lines are ignored, lines of fewer than three
+    fields are an error.
+    """
+    if data and not data.endswith(b"\n"):
+        data += b"\n"
+    chars = np.frombuffer(data, dtype=np.uint8)
+    space = IS_WHITESPACE[chars]
+    first_char = ~space
+    first_char[1:] &= space[:-1]
+    line_ends = np.flatnonzero(chars == NEWLINE)
+    fields_per_line = np.bincount(
+        np.searchsorted(line_ends, np.flatnonzero(first_char)),
+        minlength=len(line_ends),
+    )
+    invalid = np.flatnonzero(
+        (fields_per_line > 0) & (fields_per_line < UNMARKED_FIELDS)
+    )
+    if len(invalid):
+        line_start = 0 if invalid[0] == 0 else line_ends[invalid[0] - 1] + 1
+        line = data[line_start : line_ends[invalid[0]]].decode(errors="replace")
+        raise ValueError(f"Invalid bed line {line!r}")
+    hom_fields = (np.cumsum(fields_per_line) - fields_per_line)[
+        fields_per_line > UNMARKED_FIELDS
+    ]
+    if not len(hom_fields):
+        return (np.empty(0, dtype=bytes), *(np.empty(0, dtype=np.int64),) * 2)
+    fields = data.split()
+    columns = []
+    for offset in range(UNMARKED_FIELDS):
+        values = itemgetter(*(hom_fields + offset).tolist())(fields)
+        # itemgetter of a single index returns the item rather than a tuple
+        columns.append(
+            np.array((values,) if len(hom_fields) == 1 else values, dtype=bytes)
+        )
+    # bed starts are 0-based
+    return (
+        columns[0],
+        columns[1].astype(np.int64) + 1,
+        columns[2].astype(np.int64),
+    )
+
+
+def parse_hom_bytes(data: bytes) -> HomBlocks:
+    """
+    Parse the homozygous blocks of a candidate bed file, in ranges of lines
+    of up to about CHUNK_BYTES
+    """
+    ranges = split_ranges(data, len(data), -(-len(data) // CHUNK_BYTES))
+    columns = [parse_hom_columns(data[start:end]) for (start, end) in ranges]
+    if not columns:
+        return {}
+    return blocks_from_columns(*(np.concatenate(column) for column in zip(*columns)))
+
+
+def fetch_bed_bytes(bed_file: str, regions: List[Region]) -> bytes:
+    """
+    The lines of an indexed bed file overlapping each region
+    """
+    lines = []
+    with pysam.TabixFile(bed_file) as tabix:
+        contigs = set(tabix.contigs)
+        for (contig, start, end) in regions:
+            if contig in contigs:
+                lines.extend(tabix.fetch(contig, start, end))
+    return "".join(line + "\n" for line in lines).encode()
+
+
+def read_bed_bytes(bed_file: str, regions: Optional[List[Region]] = None) -> bytes:
+    """
+    The lines of a bed file, optionally bgzipped, or given regions only
+    those overlapping them where the bed file is indexed
+    """
+    if regions is not None and can_fetch_windows(bed_file):
+        return fetch_bed_bytes(bed_file, regions)
+    with stdio.open_input(bed_file) as bed:
+        data = bed.buffer.read() if hasattr(bed, "buffer") else bed.read().encode()
+    if data and not data.endswith(b"\n"):
+        data += b"\n"
+    return data
+
+
+def load_hom_blocks(
+    bed_files: Union[str, Sequence[str]], regions: Optional[List[Region]] = None
+) -> HomBlocks:
+    """
+    Load the homozygous blocks of one or several bed files (e.g. the shards
+    of a bed), optionally bgzipped. Given regions, only the blocks
+    overlapping them are read from tabix or CSI indexed bed files.
+    """
+    return parse_hom_bytes(
+        b"".join(read_bed_bytes(path, regions) for path in stdio.as_paths(bed_files))
+    )
+
+
+def as_hom_blocks(blocks: Optional[Dict]) -> HomBlocks:
+    """
+    Homozygous blocks given as a HomBlocks or in the format of
+    parse_homs_bed_to_dict, {contig: [(start, end, True), ...]}
+    """
+    if not blocks:
+        return {}
+    if all(isinstance(entries, ContigMNVs) for entries in blocks.values()):
+        return blocks
+    columns: Tuple[List, List, List] = ([], [], [])
+    for (contig, entries) in blocks.items():
+        for (start, end, _hom) in entries:
+            columns[0].append(contig)
+            columns[1].append(start)
+            columns[2].append(end)
+    return blocks_from_columns(
+        np.array(columns[0], dtype=object),
+        np.array(columns[1], dtype=np.int64),
+        np.array(columns[2], dtype=np.int64),
+    )
+
+
+def iter_blocks(blocks: HomBlocks) -> Iterable[Tuple[str, int, int]]:
+    """
+    Iterate (contig, start, end) of each block
+    """
+    for (contig, contig_blocks) in blocks.items():
+        for (start, end) in contig_blocks.items():
+            yield (contig, start, end)
@@ -0,0 +1,238 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module for re-merging MNVs incrementally, when the smart-phase
+output has changed for part of a VCF already merged. The MNVs of the
+previous merged output are compared with those of the new smart-phase
+output, only the spans of the MNVs that changed are merged again from the
+input VCF, the rest of the previous output is copied through.
+"""
+import io
+import re
+from array import array
+from bisect import bisect_right
+from itertools import groupby
+from itertools import islice
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import vcfpy
+from casmsmartphase.mnv_chains import ContigMNVs
+from casmsmartphase.regions import Region
+from casmsmartphase.stdio import open_input
+from casmsmartphase.vcf_lines import split_chrom_pos
+
+# Description suffix of the INFO and FORMAT lines of the incremental encoding
+ALLELE_DESCRIPTION = re.compile(r" \(MNV allele \d+ in series\)$")
+# Description suffix of the INFO and FORMAT lines of the compact encoding
+COMPACT_DESCRIPTION = " (per base of MNVs)"
+# MNVs are compared as keys of the start position above the length
+KEY_SHIFT = 32
+# Lines of the previous output copied at a time
+COPY_BATCH = 10000
+
+# Start and end positions of the changed spans of each contig, 1-based inclusive
+Spans = Dict[str, Tuple[List[int], List[int]]]
+
+
+class PreviousOutput:
+    """
+    Header, MNV encoding, contigs and MNVs of a merged VCF, read in a
+    single pass. Any record with a REF of more than one base is taken for
+    an MNV.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        header_lines = []
+        positions = {}
+        with open_input(path) as stream:
+            for line in stream:
+                header_lines.append(line)
+                if line.startswith("#CHROM"):
+                    break
+            for line in stream:
+                (contig, pos, _id, ref, _rest) = line.split("\t", 4)
+                if contig not in positions:
+                    positions[contig] = (array("q"), array("q"))
+                if len(ref) > 1:
+                    (starts, ends) = positions[contig]
+                    starts.append(int(pos))
+                    ends.append(int(pos) + len(ref) - 1)
+        self.header = vcfpy.Reader.from_stream(
+            io.StringIO("".join(header_lines))
+        ).header
+        self.mnv_encoding = header_encoding(self.header)
+        # Contigs in the order of the records
+        self.contigs = list(positions)
+        self.mnvs = {
+            contig: ContigMNVs(starts, ends)
+            for (contig, (starts, ends)) in positions.items()
+        }
+
+
+def header_encoding(header: vcfpy.Header) -> Optional[str]:
+    """
+    MNV encoding of a merged VCF, from the descriptions of its INFO and
+    FORMAT lines, None if neither encoding's lines are found
+    """
+    for line in header.lines:
+        if line.key in ("INFO", "FORMAT"):
+            description = line.mapping.get("Description", "")
+            if ALLELE_DESCRIPTION.search(description):
+                return "incremental"
+            if description.endswith(COMPACT_DESCRIPTION):
+                return "compact"
+    return None
+
+
+def mnv_keys(mnvs: ContigMNVs) -> np.ndarray:
+    starts = np.frombuffer(mnvs.starts, dtype=np.int64)
+    ends = np.frombuffer(mnvs.ends, dtype=np.int64)
+    return (starts << KEY_SHIFT) | (ends - starts)
+
+
+def changed_spans(old: Dict, new: Dict, contigs: Iterable[str]) -> Spans:
+    """
+    Spans of the contigs covering every MNV in only one of old and new,
+    overlapping MNVs in a single span. MNVs of either never overlap an MNV
+    common to both, so no span splits one.
+    """
+    empty = ContigMNVs(array("q"), array("q"))
+    spans = {}
+    for contig in contigs:
+        keys = np.setxor1d(
+            mnv_keys(old.get(contig, empty)), mnv_keys(new.get(contig, empty))
+        )
+        if not len(keys):
+            continue
+        (starts, ends) = ([], [])
+        for key in keys.tolist():
+            start = key >> KEY_SHIFT
+            end = start + (key & ((1 << KEY_SHIFT) - 1))
+            if ends and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        spans[contig] = (starts, ends)
+    return spans
+
+
+def span_regions(spans: Spans) -> List[Region]:
+    """
+    Regions of the spans, to fetch the record lines of an indexed VCF in them
+    """
+    return [
+        (contig, start - 1, end)
+        for (contig, (starts, ends)) in spans.items()
+        for (start, end) in zip(starts, ends)
+    ]
+
+
+def iter_span_lines(lines: Iterable[str], spans: Spans) -> Iterator[Tuple]:
+    """
+    Iterate through (contig, span index, line) of the record lines in spans
+    """
+    for line in lines:
+        (contig, pos) = split_chrom_pos(line)
+        contig_spans = spans.get(contig)
+        if contig_spans is None:
+            continue
+        (starts, ends) = contig_spans
+        idx = bisect_right(starts, pos) - 1
+        if idx >= 0 and pos <= ends[idx]:
+            yield contig, idx, line
+
+
+class SpanLines:
+    """
+    Record lines of the input VCF in spans, taken span by span in the order
+    of the input
+    """
+
+    def __init__(self, lines: Iterable[str], spans: Spans):
+        self._lines = iter_span_lines(lines, spans)
+        self._head = next(self._lines, None)
+
+    def take(self, contig: str, idx: int) -> Iterator[str]:
+        while self._head is not None and self._head[:2] == (contig, idx):
+            yield self._head[2]
+            self._head = next(self._lines, None)
+
+
+def merge_previous(
+    lines: Iterable[str],
+    spans: Spans,
+    write: Callable[[List[str]], None],
+    merge_span: Callable[[str, int], None],
+) -> int:
+    """
+    Copy the record lines of the previous output to write in batches, except
+    those in spans, calling merge_span with the contig and index of each
+    span in their place. Lines of contigs without spans are only split at
+    CHROM. Returns the number of lines copied.
+    """
+    copied = 0
+    for (contig, contig_lines) in groupby(lines, lambda line: line[: line.index("\t")]):
+        if contig not in spans:
+            for batch in iter(lambda: list(islice(contig_lines, COPY_BATCH)), []):
+                write(batch)
+                copied += len(batch)
+            continue
+        (starts, ends) = spans[contig]
+        idx = 0
+        kept = []
+        for line in contig_lines:
+            pos = split_chrom_pos(line)[1]
+            # Spans starting at or before the line are merged in its place
+            while idx < len(starts) and starts[idx] <= pos:
+                write(kept)
+                kept = []
+                merge_span(contig, idx)
+                idx += 1
+            if idx and pos <= ends[idx - 1]:
+                continue
+            kept.append(line)
+            copied += 1
+            if len(kept) == COPY_BATCH:
+                write(kept)
+                kept = []
+        write(kept)
+        for idx in range(idx, len(starts)):
+            merge_span(contig, idx)
+    return copied
@@ -34,10 +34,36 @@ new VCF containing SNVs and MNVs
 """
 import os
 
+from casmsmartphase import bgzf
+from casmsmartphase.mnv_cache import DEFAULT_MAX_SIZE_MB
 from casmsmartphase.MNVMerge import MNVMerge
+from casmsmartphase.regions import load_regions
 
 
-def run(vcfin, output, smart_phased_output, cutoff, exclude, arg_str, bed=None):
+def run(
+    vcfin,
+    output,
+    smart_phased_output,
+    cutoff,
+    exclude,
+    arg_str,
+    bed=None,
+    threads=1,
+    streaming=False,
+    compress_level=bgzf.DEFAULT_COMPRESS_LEVEL,
+    compress_threads=1,
+    index_format="tbi",
+    stats_json=None,
+    progress=False,
+    region=(),
+    regions_file=None,
+    mnv_encoding="incremental",
+    cache_dir=None,
+    cache_size_mb=DEFAULT_MAX_SIZE_MB,
+    pipelined=False,
+    checkpoint_interval=None,
+    incremental=None,
+):
     # Generate a merged VCF with possible MNVs
     # Open vcf reading module
     mnvmerge = MNVMerge(
@@ -49,5 +75,20 @@ def run(vcfin, output, smart_phased_output, cutoff, exclude, arg_str, bed=None):
         os.path.basename(__file__),
         arg_str,
         bed,
+        threads,
+        streaming,
+        compress_level=compress_level,
+        compress_threads=compress_threads,
+        index_format=index_format,
+        progress=progress,
+        regions=load_regions(vcfin, region, regions_file),
+        mnv_encoding=mnv_encoding,
+        cache_dir=cache_dir,
+        cache_max_size=cache_size_mb << 20,
+        pipelined=pipelined,
+        checkpoint_interval=checkpoint_interval,
+        previous=incremental,
     )
     mnvmerge.perform_mnv_merge_to_vcf()
+    if stats_json:
+        mnvmerge.stats.write_json(stats_json)
@@ -0,0 +1,223 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module for an on-disk cache of the MNVs parsed from smart-phase
+output, keyed by the content of the phased output and homozygous blocks
+and the filtering parameters. Entries are stored as raw arrays of MNV
+start and end positions, least recently used entries are evicted once
+the cache exceeds its size limit.
+"""
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+from array import array
+from collections import Counter
+from typing import Dict
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+from casmsmartphase import stdio
+from casmsmartphase.hom_blocks import as_hom_blocks
+from casmsmartphase.mnv_chains import ContigMNVs
+
+LOGGER = logging.getLogger(__name__)
+
+CACHE_EXTENSION = ".mnvcache"
+# Changed whenever parsing or the entry format changes, invalidating entries
+CACHE_MAGIC = b"casmsmartphase_mnv_cache\t1\n"
+DEFAULT_MAX_SIZE_MB = 1024
+HASH_CHUNK_SIZE = 1 << 20
+
+# (MNVs by contig, length of the longest MNV, counts of pairs parsed)
+CacheEntry = Tuple[Dict[str, ContigMNVs], int, Counter]
+
+
+def file_digest(path: str) -> str:
+    """
+    SHA-256 of the content of a file
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as data:
+        for chunk in iter(lambda: data.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hom_blocks_digest(hom_blocks: Dict) -> str:
+    """
+    SHA-256 of homozygous blocks, a HomBlocks or in the format of
+    parse_homs_bed_to_dict
+    """
+    digest = hashlib.sha256()
+    for (contig, blocks) in sorted(as_hom_blocks(hom_blocks).items()):
+        digest.update(f"{contig}\t{len(blocks)}\n".encode())
+        digest.update(blocks.starts.tobytes())
+        digest.update(blocks.ends.tobytes())
+    return digest.hexdigest()
+
+
+def cache_key(
+    sphaseout: Union[str, Sequence[str]],
+    cutoff: float,
+    exclude_flags: int,
+    bed: Optional[Union[str, Sequence[str]]] = None,
+    hom_blocks: Optional[Dict] = None,
+) -> str:
+    """
+    Key of the MNVs parsed from smart-phase output, one or several files in
+    any order, with the cutoff and exclude flags, and the homozygous blocks
+    of the bed files or hom_blocks
+    """
+    if bed:
+        homs = ",".join(sorted(map(file_digest, stdio.as_paths(bed))))
+    elif hom_blocks:
+        homs = hom_blocks_digest(hom_blocks)
+    else:
+        homs = ""
+    digests = sorted(map(file_digest, stdio.as_paths(sphaseout)))
+    fields = [*digests, repr(float(cutoff)), str(exclude_flags), homs]
+    return hashlib.sha256("\t".join(fields).encode()).hexdigest()
+
+
+def write_entry(path: str, mnvs: Dict[str, ContigMNVs], max_len: int, counts: Counter):
+    """
+    Write an entry, a header line and a JSON line of the contigs and counts
+    followed by the start and end positions of each contig as 64 bit ints.
+    The file is written under a temporary name and moved into place, so a
+    partial entry is never read.
+    """
+    meta = {
+        "max_len": max_len,
+        "counts": dict(counts),
+        "byteorder": sys.byteorder,
+        "contigs": [[contig, len(store)] for (contig, store) in mnvs.items()],
+    }
+    (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(CACHE_MAGIC)
+            out.write(json.dumps(meta).encode() + b"\n")
+            for store in mnvs.values():
+                out.write(store.starts.tobytes())
+                out.write(store.ends.tobytes())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def read_entry(path: str) -> CacheEntry:
+    """
+    Read an entry written by write_entry, raising ValueError if it is not a
+    valid entry of this version
+    """
+    with open(path, "rb") as data:
+        if data.readline() != CACHE_MAGIC:
+            raise ValueError(f"{path} is not a cache entry of this version")
+        meta = json.loads(data.readline())
+        mnvs = {}
+        for (contig, length) in meta["contigs"]:
+            (starts, ends) = (array("q"), array("q"))
+            starts.fromfile(data, length)
+            ends.fromfile(data, length)
+            if meta["byteorder"] != sys.byteorder:
+                starts.byteswap()
+                ends.byteswap()
+            mnvs[contig] = ContigMNVs(starts, ends)
+    return mnvs, meta["max_len"], Counter(meta["counts"])
+
+
+class MNVCache:
+    """
+    Directory of cache entries limited to max_size bytes. Reading an entry
+    updates its modification time, the least recently used entries are
+    removed first.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int = DEFAULT_MAX_SIZE_MB << 20):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + CACHE_EXTENSION)
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """
+        The entry of key, None if it is not cached or can't be read
+        """
+        path = self.path(key)
+        try:
+            entry = read_entry(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError, KeyError) as err:
+            LOGGER.warning(f"Ignoring unreadable cache entry {path}: {err}")
+            return None
+        os.utime(path)
+        return entry
+
+    def put(self, key: str, mnvs: Dict[str, ContigMNVs], max_len: int, counts: Counter):
+        """
+        Store an entry, then evict entries beyond the size limit
+        """
+        try:
+            write_entry(self.path(key), mnvs, max_len, counts)
+        except OSError as err:
+            LOGGER.warning(f"Unable to write cache entry {self.path(key)}: {err}")
+            return
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits max_size
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(CACHE_EXTENSION):
+                info = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((info.st_mtime_ns, info.st_size, name))
+        total = sum(size for (_mtime, size, _name) in entries)
+        for (_mtime, size, name) in sorted(entries):
+            if total <= self.max_size:
+                break
+            LOGGER.info(f"Evicting cache entry {name}")
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                # Removed by a concurrent run
+                pass
+            total -= size
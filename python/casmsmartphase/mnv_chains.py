@@ -0,0 +1,184 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module for building MNVs from chains of adjacent phased SNV pairs
+and storing them compactly per contig
+"""
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from typing import Dict
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+
+class ContigMNVs(Mapping):
+    """
+    Compact store of the MNVs on a single contig, held as sorted arrays of
+    start and end positions. Behaves as a read only mapping of MNV start to
+    MNV end position.
+    """
+
+    __slots__ = ("starts", "ends")
+
+    def __init__(self, starts: array, ends: array):
+        self.starts = starts
+        self.ends = ends
+
+    @classmethod
+    def from_dict(cls, start_to_end: Dict[int, int]) -> "ContigMNVs":
+        """
+        Build the store from a (possibly unsorted) dict of start to end
+        """
+        starts = array("q", sorted(start_to_end))
+        ends = array("q", (start_to_end[start] for start in starts))
+        return cls(starts, ends)
+
+    def _index(self, start: int) -> int:
+        idx = bisect_left(self.starts, start)
+        if idx < len(self.starts) and self.starts[idx] == start:
+            return idx
+        return -1
+
+    def __getitem__(self, start: int) -> int:
+        idx = self._index(start)
+        if idx < 0:
+            raise KeyError(start)
+        return self.ends[idx]
+
+    def __contains__(self, start) -> bool:
+        return self._index(start) >= 0
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.starts)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({dict(self.items())})"
+
+    def max_length(self) -> int:
+        """
+        Length of the longest MNV on this contig, 0 if there are none
+        """
+        if not self.starts:
+            return 0
+        starts = np.frombuffer(self.starts, dtype=np.int64)
+        ends = np.frombuffer(self.ends, dtype=np.int64)
+        return int((ends - starts).max()) + 1
+
+    def merged(self, other: "ContigMNVs") -> "ContigMNVs":
+        """
+        Return the MNVs of both stores, those of other replacing any with
+        the same start position
+        """
+        if not self.starts:
+            return other
+        if not other.starts:
+            return self
+        (starts, ends, other_starts, other_ends) = (
+            np.frombuffer(positions, dtype=np.int64)
+            for positions in (self.starts, self.ends, other.starts, other.ends)
+        )
+        kept = ~np.isin(starts, other_starts)
+        starts = np.concatenate((starts[kept], other_starts))
+        ends = np.concatenate((ends[kept], other_ends))
+        order = np.argsort(starts, kind="stable")
+        return ContigMNVs(
+            array("q", starts[order].tobytes()), array("q", ends[order].tobytes())
+        )
+
+
+class MNVChainBuilder:
+    """
+    Builds MNVs by chaining phased pairs of adjacent SNVs. Pairs may be
+    added in any order and may be repeated (e.g. where smart-phase regions
+    overlap). Each addition takes constant time, chains are found via an
+    index of chain start to end and a reverse index of chain end to start.
+    """
+
+    def __init__(self):
+        self._start_to_end = {}
+        self._end_to_start = {}
+        self._pair_starts = {}
+        self._blocks = {}
+
+    def add_pair(self, contig: str, start: int, end: int):
+        """
+        Add a phased pair of adjacent SNVs (end == start + 1), joining it
+        to any chain ending at start and any chain starting at end
+        """
+        pair_starts = self._pair_starts.setdefault(contig, set())
+        if start in pair_starts:
+            # Repeated pair, already part of a chain
+            return
+        pair_starts.add(start)
+        start_to_end = self._start_to_end.setdefault(contig, {})
+        end_to_start = self._end_to_start.setdefault(contig, {})
+        # Entries of the chains being joined are overwritten below
+        chain_start = end_to_start.pop(start, start)
+        chain_end = start_to_end.pop(end, end)
+        start_to_end[chain_start] = chain_end
+        end_to_start[chain_end] = chain_start
+
+    def add_block(self, contig: str, start: int, end: int):
+        """
+        Add a block of SNVs known to form an MNV (e.g. adjacent homozygous
+        SNVs). Blocks replace any chain with the same start position.
+        """
+        self._blocks.setdefault(contig, {})[start] = end
+
+    def build(
+        self, blocks: Optional[Dict[str, ContigMNVs]] = None
+    ) -> Tuple[Dict[str, ContigMNVs], int]:
+        """
+        Return the MNVs of each contig and the length of the longest MNV
+        (1 if there are no MNVs). The sorted blocks of each contig in blocks
+        (e.g. from hom_blocks.load_hom_blocks) replace chains, as add_block.
+        """
+        blocks = blocks or {}
+        mnvs = {}
+        max_len = 1
+        contigs = dict.fromkeys(self._start_to_end)
+        contigs.update(dict.fromkeys(self._blocks))
+        contigs.update(dict.fromkeys(blocks))
+        for contig in contigs:
+            start_to_end = dict(self._start_to_end.get(contig, {}))
+            start_to_end.update(self._blocks.get(contig, {}))
+            mnvs[contig] = ContigMNVs.from_dict(start_to_end)
+            if contig in blocks:
+                mnvs[contig] = mnvs[contig].merged(blocks[contig])
+            max_len = max(max_len, mnvs[contig].max_length())
+        return mnvs, max_len
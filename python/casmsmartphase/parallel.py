@@ -0,0 +1,193 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module for merging MNVs across genomic windows of a bgzipped,
+tabix indexed VCF using a pool of worker processes
+"""
+import io
+import math
+import multiprocessing
+import os
+from bisect import bisect_right
+from collections import Counter
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import pysam
+import vcfpy
+from casmsmartphase.vcf_lines import split_chrom_pos
+
+# Number of windows generated per worker, more windows than workers
+# evens out the load where the density of variants differs between windows
+WINDOWS_PER_WORKER = 8
+INDEX_EXTENSIONS = (".tbi", ".csi")
+
+# Per process state, set by _init_worker
+_WORKER = {}
+
+
+def can_fetch_windows(vcf_path: str) -> bool:
+    """
+    Check the VCF is bgzipped and has a tabix or CSI index, so
+    windows can be fetched from it
+    """
+    return vcf_path.endswith(".gz") and any(
+        os.path.exists(vcf_path + ext) for ext in INDEX_EXTENSIONS
+    )
+
+
+def get_contig_lengths(header: vcfpy.Header) -> Dict[str, int]:
+    """
+    Return the length of each contig with a length in the VCF header
+    """
+    lengths = {}
+    for line in header.get_lines("contig"):
+        if line.length is not None:
+            lengths[line.id] = int(line.length)
+    return lengths
+
+
+def shift_boundary(boundary: int, starts: List[int], ends: List[int]) -> int:
+    """
+    Move a window boundary (last 1-based position in the window) past the
+    end of any MNV it would otherwise split
+    """
+    idx = bisect_right(starts, boundary) - 1
+    while idx >= 0 and ends[idx] > boundary:
+        boundary = ends[idx]
+        idx = bisect_right(starts, boundary) - 1
+    return boundary
+
+
+def plan_windows(
+    contigs: List[str], lengths: Dict[str, int], mnvs: Dict, n_windows: int
+) -> List[Tuple[str, int, Optional[int]]]:
+    """
+    Split the contigs into approximately n_windows windows of equal span.
+    Windows are (contig, start, end) in 0-based half open coordinates, the
+    last window of each contig has an end of None. No window boundary
+    falls within an MNV.
+    """
+    total = sum(lengths.get(contig, 0) for contig in contigs)
+    window_size = max(1, math.ceil(total / max(1, n_windows)))
+    windows = []
+    for contig in contigs:
+        length = lengths.get(contig)
+        contig_mnvs = sorted(mnvs.get(contig, {}).items())
+        starts = [start for (start, _end) in contig_mnvs]
+        ends = [end for (_start, end) in contig_mnvs]
+        start = 0
+        if length is not None:
+            boundary = window_size
+            while boundary < length:
+                end = shift_boundary(boundary, starts, ends)
+                if end >= length:
+                    break
+                windows.append((contig, start, end))
+                start = end
+                boundary = max(end + 1, boundary + window_size)
+        windows.append((contig, start, None))
+    return windows
+
+
+def _init_worker(merger, mnvs: Dict, header: vcfpy.Header):
+    """
+    Set up the per process state used by _merge_window
+    """
+    buffer = io.StringIO()
+    writer = vcfpy.Writer.from_stream(buffer, header)
+    _WORKER["merger"] = merger
+    _WORKER["mnvs"] = mnvs
+    _WORKER["tabix"] = pysam.TabixFile(merger.vcfinpath)
+    _WORKER["buffer"] = buffer
+    _WORKER["writer"] = writer
+
+
+def _merge_window(
+    window: Tuple[str, int, Optional[int]]
+) -> Tuple[str, Counter, Counter]:
+    """
+    Merge MNVs in a single window, returning the serialised records, the
+    count of records by MNV length and the merge warnings of the window
+    """
+    (contig, start, end) = window
+    buffer = _WORKER["buffer"]
+    buffer.seek(0)
+    buffer.truncate()
+    merger = _WORKER["merger"]
+    merger.merge_warnings.clear()
+
+    def fetch_lines():
+        for line in _WORKER["tabix"].fetch(contig, start, end):
+            pos = split_chrom_pos(line)[1]
+            # Only records starting in this window, tabix also returns overlaps
+            if pos > start and (end is None or pos <= end):
+                yield line + "\n"
+
+    lengths = merger.merge_lines(fetch_lines(), _WORKER["mnvs"], _WORKER["writer"])
+    return buffer.getvalue(), lengths, merger.merge_warnings
+
+
+def merge_windows(merger, mnvs: Dict, writer: vcfpy.Writer, progress=None) -> Counter:
+    """
+    Merge MNVs of the bgzipped, tabix indexed input VCF of merger across
+    merger.threads worker processes, writing records to writer in the
+    contig order of the input file. Returns the count of records written by
+    MNV length, progress is updated as each window completes. Merge warnings
+    of the workers are added to merger.merge_warnings.
+    """
+    with pysam.TabixFile(merger.vcfinpath) as tabix:
+        # Index contigs are in the order they appear in the file
+        contigs = list(tabix.contigs)
+    windows = plan_windows(
+        contigs,
+        get_contig_lengths(writer.header),
+        mnvs,
+        merger.threads * WINDOWS_PER_WORKER,
+    )
+    with multiprocessing.Pool(
+        merger.threads,
+        initializer=_init_worker,
+        initargs=(merger, mnvs, writer.header),
+    ) as pool:
+        lengths = Counter()
+        results = pool.imap(_merge_window, windows)
+        for ((contig, start, end), result) in zip(windows, results):
+            (text, window_lengths, warnings) = result
+            writer.stream.write(text)
+            lengths.update(window_lengths)
+            merger.merge_warnings.update(warnings)
+            if progress is not None:
+                records = sum(length * n for (length, n) in window_lengths.items())
+                progress.update(contig, start if end is None else end, records)
+    return lengths
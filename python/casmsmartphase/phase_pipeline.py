@@ -0,0 +1,180 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Run candidate bed generation, phasing and MNV merging for a CaVEMan
+VCF in a single invocation. Candidate and homozygous blocks are kept in
+memory between the stages rather than re-derived from the VCF and bed.
+"""
+import logging
+import os
+import shlex
+import subprocess
+import tempfile
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from casmsmartphase import vcf_to_bed
+from casmsmartphase.MNVMerge import MNVMerge
+
+LOGGER = logging.getLogger(__name__)
+
+BED_NAME = "candidates.bed"
+PHASED_NAME = "sample.phased.output"
+
+
+def scan_candidates(vcfin: str) -> List[Tuple[str, int, int, bool]]:
+    """
+    Single pass over the VCF collecting candidate blocks of adjacent SNVs
+    """
+    (_header, sites) = vcf_to_bed.scan_sites(vcfin)
+    return list(vcf_to_bed.iter_blocks(sites))
+
+
+def get_hom_blocks(blocks: List[Tuple[str, int, int, bool]]) -> Dict:
+    """
+    Homozygous candidate blocks in the format of parse_homs_bed_to_dict
+    """
+    hom_blocks = {}
+    for (contig, start, end, is_het) in blocks:
+        if not is_het:
+            hom_blocks.setdefault(contig, []).append((start + 1, end, True))
+    return hom_blocks
+
+
+def write_candidates(vcfin: str, bed: str, markhz: bool) -> Tuple[int, Optional[Dict]]:
+    """
+    Scan the VCF for candidate blocks, writing them to bed. Returns the
+    number of blocks and the homozygous blocks where markhz, else None.
+    """
+    blocks = scan_candidates(vcfin)
+    with open(bed, "w") as bedout:
+        for block in blocks:
+            print(vcf_to_bed.format_bed_line(block, markhz), file=bedout)
+    return len(blocks), get_hom_blocks(blocks) if markhz else None
+
+
+def phasing_command(
+    phase_cmd: str, vcfin: str, bed: str, phased: str, **fields: str
+) -> List[str]:
+    """
+    Arguments of the external phasing command. {vcf}, {bed} and {output} in
+    the command are replaced by the input VCF, candidate bed and the phased
+    output path the command must write, other fields by keyword.
+    """
+    cmd = phase_cmd.format(vcf=vcfin, bed=bed, output=phased, **fields)
+    LOGGER.info(f"Running phasing command: {cmd}")
+    return shlex.split(cmd)
+
+
+def run_phasing(phase_cmd: str, vcfin: str, bed: str, phased: str):
+    """
+    Run the external phasing command, see phasing_command
+    """
+    subprocess.run(phasing_command(phase_cmd, vcfin, bed, phased), check=True)
+
+
+def merge_phased(
+    vcfin: str,
+    output: str,
+    phased: str,
+    cutoff: float,
+    exclude: int,
+    arg_str: str,
+    hom_blocks: Optional[Dict],
+    mnv_encoding: str = "incremental",
+):
+    """
+    Merge the phased MNVs and homozygous blocks into output
+    """
+    mnvmerge = MNVMerge(
+        vcfin,
+        output,
+        phased,
+        cutoff,
+        exclude,
+        os.path.basename(__file__),
+        arg_str,
+        hom_blocks=hom_blocks,
+        mnv_encoding=mnv_encoding,
+    )
+    mnvmerge.perform_mnv_merge_to_vcf()
+
+
+def phase_and_merge(
+    vcfin: str,
+    output: str,
+    phase_cmd: str,
+    cutoff: float,
+    exclude: int,
+    markhz: bool,
+    arg_str: str,
+    workdir: str,
+    mnv_encoding: str = "incremental",
+):
+    """
+    Generate candidate blocks, phase them with phase_cmd and merge the
+    phased MNVs into output, exchanging files with the phasing command
+    in workdir
+    """
+    bed = os.path.join(workdir, BED_NAME)
+    phased = os.path.join(workdir, PHASED_NAME)
+    (n_blocks, hom_blocks) = write_candidates(vcfin, bed, markhz)
+    if n_blocks:
+        run_phasing(phase_cmd, vcfin, bed, phased)
+    else:
+        # Nothing to phase
+        open(phased, "w").close()
+    merge_phased(
+        vcfin, output, phased, cutoff, exclude, arg_str, hom_blocks, mnv_encoding
+    )
+
+
+def run(
+    vcfin,
+    output,
+    phase_cmd,
+    cutoff,
+    exclude,
+    markhz,
+    arg_str,
+    workdir=None,
+    mnv_encoding="incremental",
+):
+    args = (vcfin, output, phase_cmd, cutoff, exclude, markhz, arg_str)
+    # Keep files exchanged with the phasing command if a workdir is given
+    if workdir:
+        os.makedirs(workdir, exist_ok=True)
+        phase_and_merge(*args, workdir, mnv_encoding)
+    else:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            phase_and_merge(*args, tmpdir, mnv_encoding)
@@ -0,0 +1,159 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module profiling a run of a command into a directory: cProfile
+statistics, or stacks sampled at an interval at much lower cost, and
+optionally tracemalloc snapshots at the end of each stage
+"""
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Optional
+
+from casmsmartphase import stats as run_stats
+
+LOGGER = logging.getLogger(__name__)
+
+# Frames of the stack kept for each allocation traced by tracemalloc
+MEMORY_FRAMES = 16
+SAMPLER_THREAD = "profile-sampler"
+
+
+def fold_stack(thread: str, frame) -> str:
+    """
+    Stack of frame in the folded format of flame graph tools, outermost
+    function first, prefixed by the thread name
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(
+            f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        )
+        frame = frame.f_back
+    return ";".join([thread] + names[::-1])
+
+
+class StackSampler:
+    """
+    Samples the stack of every other thread each interval seconds on a
+    thread of its own, counting the folded stacks seen
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.counts: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=SAMPLER_THREAD, daemon=True
+        )
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for (ident, frame) in sys._current_frames().items():
+                if ident != own:
+                    self.counts[fold_stack(names.get(ident, str(ident)), frame)] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: str):
+        with open(path, "w") as out:
+            for (stack, count) in self.counts.most_common():
+                out.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """
+    Profiles the run of command into files under outdir named
+    command.YYYYmmdd-HHMMSS.pid: .pstats of cProfile, or .folded stacks
+    sampled every sample_interval seconds where given, and with memory a
+    .NN.stage.tracemalloc snapshot at the end of each stage and at the end
+    of the run
+    """
+
+    def __init__(
+        self,
+        outdir: str,
+        command: str,
+        memory: bool = False,
+        sample_interval: Optional[float] = None,
+    ):
+        self.outdir = outdir
+        self.prefix = os.path.join(
+            outdir, f"{command}.{time.strftime('%Y%m%d-%H%M%S')}.{os.getpid()}"
+        )
+        self.memory = memory
+        self.sample_interval = sample_interval
+        self.profile = None
+        self.sampler = None
+        self.snapshots = 0
+
+    def start(self):
+        os.makedirs(self.outdir, exist_ok=True)
+        if self.memory:
+            tracemalloc.start(MEMORY_FRAMES)
+            run_stats.STAGE_HOOKS.append(self.snapshot)
+        if self.sample_interval:
+            self.sampler = StackSampler(self.sample_interval)
+            self.sampler.start()
+        else:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def snapshot(self, stage: run_stats.Stage):
+        self.snapshots += 1
+        path = f"{self.prefix}.{self.snapshots:02d}.{stage.name}.tracemalloc"
+        tracemalloc.take_snapshot().dump(path)
+
+    def stop(self):
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.prefix + ".pstats")
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler.write(self.prefix + ".folded")
+        if self.memory:
+            run_stats.STAGE_HOOKS.remove(self.snapshot)
+            self.snapshot(run_stats.Stage("end"))
+            tracemalloc.stop()
+        LOGGER.info(f"Profile written to {self.prefix}.*")
@@ -0,0 +1,167 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module for restricting runs to genomic regions, fetching the
+records of each region from a bgzipped, tabix or CSI indexed VCF
+"""
+import re
+from bisect import bisect_right
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import pysam
+from casmsmartphase.parallel import can_fetch_windows
+from casmsmartphase.vcf_lines import split_chrom_pos
+
+# (contig, start, end) in 0-based half open coordinates, end None for the
+# end of the contig
+Region = Tuple[str, int, Optional[int]]
+
+REGION_PATTERN = re.compile(r"^(?P<contig>[^:]+)(:(?P<start>\d+)(-(?P<end>\d+)?)?)?$")
+
+
+def parse_region(region: str) -> Region:
+    """
+    Parse a samtools style region, contig, contig:start or contig:start-end
+    with 1-based inclusive coordinates
+    """
+    match = REGION_PATTERN.match(region.replace(",", ""))
+    if match is None:
+        raise ValueError(f"Invalid region {region}, expected chr:start-end")
+    start = int(match["start"] or 1)
+    end = int(match["end"]) if match["end"] else None
+    if start < 1 or (end is not None and end < start):
+        raise ValueError(f"Invalid region {region}, start must be 1 to end")
+    return (match["contig"], start - 1, end)
+
+
+def read_regions_file(path: str) -> List[Region]:
+    """
+    Read regions from a bed file, skipping blank, comment and track lines
+    """
+    regions = []
+    with open(path) as bed:
+        for line in bed:
+            if not line.strip() or line.startswith(("#", "track", "browser")):
+                continue
+            fields = line.rstrip("\r\n").split("\t")
+            try:
+                regions.append((fields[0], int(fields[1]), int(fields[2])))
+            except (IndexError, ValueError):
+                raise ValueError(f"Invalid line in regions file {path}: {line}")
+    return regions
+
+
+def normalise_regions(regions: List[Region], contigs: List[str]) -> List[Region]:
+    """
+    Sort regions into the order of contigs, merging overlapping and abutting
+    regions. Regions on contigs not listed are dropped.
+    """
+    rank = {contig: i for (i, contig) in enumerate(contigs)}
+    ordered = sorted(
+        (region for region in regions if region[0] in rank),
+        key=lambda region: (rank[region[0]], region[1]),
+    )
+    merged = []
+    for (contig, start, end) in ordered:
+        if merged and merged[-1][0] == contig:
+            (_prev_contig, prev_start, prev_end) = merged[-1]
+            if prev_end is None or start <= prev_end:
+                if prev_end is not None and (end is None or end > prev_end):
+                    merged[-1] = (contig, prev_start, end)
+                continue
+        merged.append((contig, start, end))
+    return merged
+
+
+def index_contigs(vcf_path: str) -> List[str]:
+    """
+    Contigs of an indexed VCF in file order, raising ValueError if the VCF
+    can't be fetched from by region
+    """
+    if not can_fetch_windows(vcf_path):
+        raise ValueError(
+            f"{vcf_path} is not a bgzipped, tabix or CSI indexed VCF, required for regions"
+        )
+    with pysam.TabixFile(vcf_path) as tabix:
+        return list(tabix.contigs)
+
+
+def load_regions(
+    vcf_path: str, region: Tuple[str, ...] = (), regions_file: Optional[str] = None
+) -> Optional[List[Region]]:
+    """
+    Regions from --region and --regions-file options, in the order of the
+    VCF. None if neither is given.
+    """
+    if not region and not regions_file:
+        return None
+    regions = [parse_region(text) for text in region]
+    if regions_file:
+        regions.extend(read_regions_file(regions_file))
+    return normalise_regions(regions, index_contigs(vcf_path))
+
+
+def fetch_lines(vcf_path: str, regions: List[Region]) -> Iterator[str]:
+    """
+    Iterate through the record lines of an indexed VCF starting in each
+    region, in region order
+    """
+    with pysam.TabixFile(vcf_path) as tabix:
+        for (contig, start, end) in regions:
+            for line in tabix.fetch(contig, start, end):
+                # Only records starting in the region, tabix also returns overlaps
+                pos = split_chrom_pos(line)[1]
+                if pos > start and (end is None or pos <= end):
+                    yield line + "\n"
+
+
+def expand_to_mnvs(regions: List[Region], mnvs: Dict) -> List[Region]:
+    """
+    Widen regions so no MNV in mnvs is only partly covered by a region
+    """
+    expanded = []
+    for (contig, start, end) in regions:
+        contig_mnvs = sorted(mnvs.get(contig, {}).items())
+        starts = [mnv_start for (mnv_start, _mnv_end) in contig_mnvs]
+        # An MNV covering the first position of the region
+        idx = bisect_right(starts, start + 1) - 1
+        if idx >= 0 and contig_mnvs[idx][1] >= start + 1:
+            start = contig_mnvs[idx][0] - 1
+        if end is not None:
+            idx = bisect_right(starts, end) - 1
+            if idx >= 0 and contig_mnvs[idx][1] > end:
+                end = contig_mnvs[idx][1]
+        expanded.append((contig, start, end))
+    return expanded
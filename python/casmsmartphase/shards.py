@@ -0,0 +1,91 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module splitting the candidate blocks of generate-bed into shards
+of about equal candidate count or span, so smart-phase can be run on each
+shard separately and the phased output of the shards merged as one
+"""
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+# Replaced by the 1-based shard number in output paths
+SHARD_FIELD = "{shard}"
+# Blocks are balanced by their number or their total span in bases
+SHARD_BY = ("count", "span")
+
+# A candidate block, (contig, bed start, bed end, is_het)
+Block = Tuple[str, int, int, bool]
+
+
+def block_weight(block: Block, shard_by: str) -> int:
+    (_contig, start, end, _is_het) = block
+    return 1 if shard_by == "count" else end - start
+
+
+def assign_shards(weights: List[int], n_shards: int) -> List[int]:
+    """
+    Shard of each of a sequence of weighted items, splitting them in order
+    into n_shards runs of about equal total weight. Each item is placed in
+    the shard its midpoint falls in.
+    """
+    total = sum(weights)
+    shards = []
+    before = 0
+    for weight in weights:
+        shard = int((before + weight / 2) * n_shards / total)
+        shards.append(min(shard, n_shards - 1))
+        before += weight
+    return shards
+
+
+def shard_blocks(
+    sample_blocks: Iterable[Tuple[int, Block]],
+    n_samples: int,
+    n_shards: int,
+    shard_by: str = "count",
+) -> Iterator[Tuple[int, Block]]:
+    """
+    Collect (sample index, block) of the candidate blocks of each sample,
+    yielding (sample index * n_shards + shard, block) with the blocks of
+    each sample split in order into n_shards shards. Blocks are never split
+    and each shard keeps the sorted order of the blocks.
+    """
+    if shard_by not in SHARD_BY:
+        raise ValueError(f"Unknown shard balance {shard_by}")
+    blocks: List[List[Block]] = [[] for _sample in range(n_samples)]
+    for (index, block) in sample_blocks:
+        blocks[index].append(block)
+    for (index, sample) in enumerate(blocks):
+        weights = [block_weight(block, shard_by) for block in sample]
+        for (shard, block) in zip(assign_shards(weights, n_shards), sample):
+            yield (index * n_shards + shard, block)
@@ -0,0 +1,290 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module parsing smart-phase output in bulk. The file is memory mapped
+and split at line boundaries into ranges, parsed across worker processes.
+Ranges of regular output are tokenised as a whole and the cutoff and
+exclude flags applied to NumPy columns, any other range is parsed line by
+line.
+"""
+import mmap
+import multiprocessing
+from collections import Counter
+from typing import Callable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+TRAILER = b"Denovo count"
+# Size of the ranges of the file parsed at a time, bounding the memory used
+# by the per byte arrays of each range
+CHUNK_BYTES = 8 << 20
+# Fields of a phased pair line: MNV id, first and second SNV, flag, confidence
+PAIR_FIELDS = 5
+# Dashes of an MNV id (n-start-end) and of an SNV (contig-pos-ref-alt)
+ID_DASHES = 2
+SNV_DASHES = 3
+NEWLINE = ord("\n")
+# Classes of bytes: part of a field, whitespace separating fields, a dash,
+# or any other control or non-ASCII byte, only found in irregular output
+(FIELD, WHITESPACE, DASH_CLASS, OTHER) = range(4)
+CHAR_CLASSES = np.full(256, OTHER, dtype=np.uint8)
+CHAR_CLASSES[33:127] = FIELD
+CHAR_CLASSES[list(b" \t\n\r\x0b\x0c")] = WHITESPACE
+CHAR_CLASSES[ord("-")] = DASH_CLASS
+
+# Contig names, then per pair the index of the contig, start and end position
+PairColumns = Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]
+
+
+def find_trailer(data) -> int:
+    """
+    Offset of the Denovo count trailer line, or the length of data if
+    there is none
+    """
+    if data[: len(TRAILER)] == TRAILER:
+        return 0
+    offset = data.find(b"\n" + TRAILER)
+    return len(data) if offset < 0 else offset + 1
+
+
+def split_ranges(data, end: int, n_ranges: int) -> List[Tuple[int, int]]:
+    """
+    Split data[:end] into up to n_ranges (start, end) ranges of about equal
+    size, each but the last ending after a newline
+    """
+    bounds = [0]
+    for i in range(1, n_ranges):
+        offset = data.find(b"\n", max(bounds[-1], end * i // n_ranges), end)
+        if offset < 0:
+            break
+        if offset + 1 > bounds[-1]:
+            bounds.append(offset + 1)
+    if bounds[-1] < end:
+        bounds.append(end)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def pairs_to_columns(pairs: Iterator[Tuple[str, int, int]]) -> PairColumns:
+    """
+    Columns of (contig, start, end) pairs
+    """
+    name_index = {}
+    (contig_index, starts, ends) = ([], [], [])
+    for (contig, start, end) in pairs:
+        contig_index.append(name_index.setdefault(contig, len(name_index)))
+        starts.append(start)
+        ends.append(end)
+    return (
+        list(name_index),
+        np.array(contig_index, dtype=np.int64),
+        np.array(starts, dtype=np.int64),
+        np.array(ends, dtype=np.int64),
+    )
+
+
+def iter_pairs(columns: PairColumns) -> Iterator[Tuple[str, int, int]]:
+    """
+    Iterate (contig, start, end) of each pair of columns
+    """
+    (names, contig_index, starts, ends) = columns
+    return zip(
+        (names[i] for i in contig_index.tolist()), starts.tolist(), ends.tolist()
+    )
+
+
+def parse_pair_bytes(
+    data: bytes, cutoff: float, exclude_flags: int, counts: Optional[Counter] = None
+) -> Optional[PairColumns]:
+    """
+    Parse lines of regular smart-phase output (without the trailer), of five
+    whitespace separated fields, returning the columns of the phased pairs of
+    adjacent SNVs passing the cutoff and exclude flags, in file order. Pairs
+    accepted, filtered and skipped are added to counts. Returns None, with
+    counts unchanged, where the lines are not regular.
+    """
+    if not data:
+        return pairs_to_columns([])
+    if not data.endswith(b"\n"):
+        data += b"\n"
+    classes = CHAR_CLASSES[np.frombuffer(data, dtype=np.uint8)]
+    if np.any(classes == OTHER):
+        return None
+    space = classes == WHITESPACE
+    token_starts = np.flatnonzero(~space[1:] & space[:-1]) + 1
+    if not space[0]:
+        token_starts = np.concatenate(([0], token_starts))
+    line_ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == NEWLINE)
+    # Each line has five fields with no leading whitespace: its first field
+    # starts after the end of the previous line and its last before its end
+    if (
+        len(token_starts) != PAIR_FIELDS * len(line_ends)
+        or not len(line_ends)
+        or token_starts[0] != 0
+        or np.any(token_starts[PAIR_FIELDS::PAIR_FIELDS] != line_ends[:-1] + 1)
+        or np.any(token_starts[PAIR_FIELDS - 1 :: PAIR_FIELDS] > line_ends)
+    ):
+        return None
+    field_dashes = np.bincount(
+        np.searchsorted(token_starts, np.flatnonzero(classes == DASH_CLASS), "right")
+        - 1,
+        minlength=len(token_starts),
+    ).reshape(-1, PAIR_FIELDS)
+    if np.any(field_dashes[:, 0] != ID_DASHES) or np.any(
+        field_dashes[:, 1:3] != SNV_DASHES
+    ):
+        return None
+    tokens = data.split()
+    try:
+        flags = np.array(tokens[3::PAIR_FIELDS]).astype(np.int64)
+        confidence = np.array(tokens[4::PAIR_FIELDS]).astype(float)
+    except ValueError:
+        return None
+    keep = ~(confidence < cutoff) & ((flags & exclude_flags) == 0)
+    positions = []
+    for snv in (1, 2):
+        snvs = np.array(tokens[snv::PAIR_FIELDS], dtype=object)[keep]
+        parts = b"-".join(snvs.tolist()).split(b"-")
+        try:
+            positions.append(np.array(parts[1 :: SNV_DASHES + 1]).astype(np.int64))
+        except ValueError:
+            return None
+    (starts, ends) = positions
+    adjacent = starts + 1 == ends
+    # As parse_phased_lines, the contig is taken from the second SNV. Pairs
+    # are in runs by contig, only the first of each run is looked up.
+    contigs = np.array(parts[:: SNV_DASHES + 1], dtype=bytes)[adjacent]
+    run_starts = np.ones(len(contigs), dtype=bool)
+    run_starts[1:] = contigs[1:] != contigs[:-1]
+    runs = np.flatnonzero(run_starts)
+    name_index = {}
+    run_index = [
+        name_index.setdefault(contig, len(name_index))
+        for contig in contigs[runs].tolist()
+    ]
+    contig_index = np.repeat(
+        np.array(run_index, dtype=np.int64), np.diff(np.append(runs, len(contigs)))
+    )
+    n_kept = len(starts)
+    n_accepted = len(contig_index)
+    if counts is not None:
+        counts["pairs_accepted"] += n_accepted
+        counts["pairs_filtered"] += len(keep) - n_kept
+        counts["pairs_skipped"] += n_kept - n_accepted
+    return (
+        [name.decode() for name in name_index],
+        contig_index,
+        starts[adjacent],
+        ends[adjacent],
+    )
+
+
+def _parse_range(
+    sphaseout: str,
+    start: int,
+    end: int,
+    cutoff: float,
+    exclude_flags: int,
+    parse_lines: Callable,
+) -> Tuple[PairColumns, Counter]:
+    """
+    Parse the lines in a byte range of a smart-phase output file, using
+    parse_lines if they are not regular output
+    """
+    counts = Counter()
+    with open(sphaseout, "rb") as readspout:
+        with mmap.mmap(readspout.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            lines = data[start:end]
+    columns = parse_pair_bytes(lines, cutoff, exclude_flags, counts)
+    if columns is None:
+        pairs = parse_lines(
+            lines.decode().splitlines(keepends=True), cutoff, exclude_flags, counts
+        )
+        columns = pairs_to_columns(pairs)
+    return (columns, counts)
+
+
+def parse_pair_file(
+    sphaseout: str,
+    cutoff: float,
+    exclude_flags: int,
+    parse_lines: Callable,
+    counts: Optional[Counter] = None,
+    workers: int = 1,
+) -> PairColumns:
+    """
+    Parse a smart-phase output file up to its Denovo count trailer, returning
+    the columns of the phased pairs of adjacent SNVs passing the cutoff and
+    exclude flags, in file order. The file is parsed in ranges of lines of
+    up to about CHUNK_BYTES, across workers processes. Ranges that
+    are not regular output are parsed by parse_lines, taking lines, cutoff,
+    exclude flags and counts as MNVMerge.parse_phased_lines.
+    """
+    with open(sphaseout, "rb") as readspout:
+        if not readspout.read(1):
+            # An empty file cannot be mapped
+            return pairs_to_columns([])
+        with mmap.mmap(readspout.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            end = find_trailer(data)
+            ranges = split_ranges(data, end, -(-end // CHUNK_BYTES))
+    args = [
+        (sphaseout, start, stop, cutoff, exclude_flags, parse_lines)
+        for (start, stop) in ranges
+    ]
+    if workers > 1 and len(ranges) > 1:
+        with multiprocessing.Pool(min(workers, len(ranges))) as pool:
+            results = pool.starmap(_parse_range, args)
+    else:
+        results = [_parse_range(*arg) for arg in args]
+    # Contig indices are local to each range, map them to a common list
+    name_index = {}
+    (contig_index, starts, ends) = ([], [], [])
+    for ((names, range_index, range_starts, range_ends), range_counts) in results:
+        remap = np.array(
+            [name_index.setdefault(name, len(name_index)) for name in names],
+            dtype=np.int64,
+        )
+        contig_index.append(remap[range_index] if len(remap) else range_index)
+        starts.append(range_starts)
+        ends.append(range_ends)
+        if counts is not None:
+            counts.update(range_counts)
+    if not results:
+        return pairs_to_columns([])
+    return (
+        list(name_index),
+        np.concatenate(contig_index),
+        np.concatenate(starts),
+        np.concatenate(ends),
+    )
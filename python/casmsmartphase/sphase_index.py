@@ -0,0 +1,170 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module for a sidecar index over smart-phase output, recording the
+byte range and the positions of each segment of lines on a contig, so the
+lines relevant to genomic regions can be read without reading the file
+"""
+import logging
+import os
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+from casmsmartphase.regions import Region
+
+LOGGER = logging.getLogger(__name__)
+
+INDEX_EXTENSION = ".spidx"
+INDEX_MAGIC = "##casmsmartphase_sphase_index"
+# Maximum lines in a segment of the index
+SEGMENT_LINES = 10000
+
+# (contig, first pair start, last pair start, byte offset, byte length)
+Segment = Tuple[str, int, int, int, int]
+
+
+def _source_id(sphaseout: str) -> str:
+    """
+    Size and modification time of smart-phase output, an index built from
+    a different version of the file is stale
+    """
+    info = os.stat(sphaseout)
+    return f"{info.st_size}\t{info.st_mtime_ns}"
+
+
+def build_index(sphaseout: str) -> List[Segment]:
+    """
+    Read smart-phase output, returning segments of consecutive lines
+    phasing pairs on a single contig. Lines that are not phased pairs are
+    kept in the current segment.
+    """
+    segments = []
+    (contig, first, last, offset, n_lines) = (None, 0, 0, 0, 0)
+    position = 0
+    with open(sphaseout, "rb") as sphase:
+        for raw in sphase:
+            line = raw.decode()
+            if line.startswith("Denovo count"):
+                break
+            fields = line.split()
+            pair = None
+            if len(fields) > 1 and fields[1].count("-") >= 2:
+                (pair_contig, pair_pos, _rest) = fields[1].split("-", 2)
+                if pair_pos.isdigit():
+                    pair = (pair_contig, int(pair_pos))
+            if pair is not None and (pair[0] != contig or n_lines >= SEGMENT_LINES):
+                if contig is not None:
+                    segments.append((contig, first, last, offset, position - offset))
+                (contig, first, last, offset, n_lines) = (
+                    pair[0],
+                    pair[1],
+                    pair[1],
+                    position,
+                    0,
+                )
+            elif pair is not None:
+                first = min(first, pair[1])
+                last = max(last, pair[1])
+            n_lines += 1
+            position += len(raw)
+    if contig is not None:
+        segments.append((contig, first, last, offset, position - offset))
+    return segments
+
+
+def write_index(path: str, source_id: str, segments: List[Segment]):
+    """
+    Write segments to an index file, tab separated after a header line
+    identifying the source smart-phase output
+    """
+    with open(path, "w") as out:
+        print(INDEX_MAGIC, source_id, sep="\t", file=out)
+        for segment in segments:
+            print(*segment, sep="\t", file=out)
+
+
+def read_index(path: str, source_id: str):
+    """
+    Segments of an index file, None if it is missing or was built from a
+    different version of the smart-phase output
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as index:
+        if index.readline().rstrip("\n") != f"{INDEX_MAGIC}\t{source_id}":
+            return None
+        segments = []
+        for line in index:
+            (contig, *values) = line.rstrip("\n").split("\t")
+            segments.append((contig, *map(int, values)))
+    return segments
+
+
+def load_index(sphaseout: str) -> List[Segment]:
+    """
+    Segments of the sidecar index of smart-phase output, building and
+    writing the index where it is missing or stale
+    """
+    path = sphaseout + INDEX_EXTENSION
+    source_id = _source_id(sphaseout)
+    segments = read_index(path, source_id)
+    if segments is None:
+        LOGGER.info(f"Building index {path}")
+        segments = build_index(sphaseout)
+        try:
+            write_index(path, source_id, segments)
+        except OSError as err:
+            LOGGER.warning(f"Unable to write index {path}, not kept: {err}")
+    return segments
+
+
+def iter_region_lines(sphaseout: str, regions: List[Region]) -> Iterator[str]:
+    """
+    Iterate through the lines of the smart-phase output segments with
+    pairs that may overlap regions, in file order
+    """
+    by_contig = {}
+    for segment in load_index(sphaseout):
+        by_contig.setdefault(segment[0], []).append(segment)
+    selected = set()
+    for (contig, start, end) in regions:
+        for segment in by_contig.get(contig, []):
+            (_contig, first, last, _offset, _length) = segment
+            # A pair starting at pos covers pos and pos + 1
+            if last + 1 > start and (end is None or first <= end):
+                selected.add(segment)
+    with open(sphaseout, "rb") as sphase:
+        for (_contig, _first, _last, offset, length) in sorted(
+            selected, key=lambda segment: segment[3]
+        ):
+            sphase.seek(offset)
+            yield from sphase.read(length).decode().splitlines(keepends=True)
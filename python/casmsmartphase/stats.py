@@ -0,0 +1,207 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module recording per stage run statistics, written as JSON, and
+reporting throttled progress to stderr
+"""
+import datetime
+import json
+import resource
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+# Minimum seconds between progress lines
+PROGRESS_INTERVAL = 10.0
+# Records between checks of the time for progress reporting
+CHECK_EVERY = 10000
+# Called with each stage as it ends, e.g. by profiling
+STAGE_HOOKS: List[Callable[["Stage"], None]] = []
+
+
+def peak_rss_kb() -> Dict[str, int]:
+    """
+    Peak resident set size in KB of this process and of its largest child
+    """
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+class Stage:
+    """
+    Wall time and number of records processed by a single stage
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.records = 0
+        self.wall_seconds = 0.0
+        self.peak_rss_kb = {}
+
+    def to_dict(self) -> Dict:
+        rate = self.records / self.wall_seconds if self.wall_seconds else None
+        return {
+            "wall_seconds": round(self.wall_seconds, 6),
+            "records": self.records,
+            "records_per_second": None if rate is None else round(rate, 1),
+            "peak_rss_kb": self.peak_rss_kb,
+        }
+
+
+class RunStats:
+    """
+    Statistics of a run: the stages in the order run, counts of events
+    (e.g. filtered pairs) and a histogram of MNV lengths
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Stage] = {}
+        self.counts: Counter = Counter()
+        self.mnv_lengths: Counter = Counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Stage]:
+        stage = self.stages.setdefault(name, Stage(name))
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.wall_seconds += time.perf_counter() - start
+            stage.peak_rss_kb = peak_rss_kb()
+            for hook in STAGE_HOOKS:
+                hook(stage)
+
+    def to_dict(self) -> Dict:
+        return {
+            "stages": {name: stage.to_dict() for (name, stage) in self.stages.items()},
+            "counts": dict(sorted(self.counts.items())),
+            "mnv_length_histogram": {
+                str(length): n for (length, n) in sorted(self.mnv_lengths.items())
+            },
+            "peak_rss_kb": peak_rss_kb(),
+        }
+
+    def write_json(self, path: str):
+        with open(path, "w") as out:
+            json.dump(self.to_dict(), out, indent=2)
+            out.write("\n")
+
+
+class Progress:
+    """
+    Writes a progress line at most every interval seconds, giving the
+    position reached and, where contig lengths are known, an estimate of the
+    time remaining
+    """
+
+    def __init__(
+        self,
+        contig_lengths: Optional[Dict[str, int]] = None,
+        interval: float = PROGRESS_INTERVAL,
+        stream=None,
+    ):
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        # Offset of each contig in the genome, in the order given
+        self.offsets = {}
+        self.total = 0
+        for (contig, length) in (contig_lengths or {}).items():
+            self.offsets[contig] = self.total
+            self.total += length
+        self.records = 0
+        self.start = time.perf_counter()
+        self.last = self.start
+
+    def format_line(self, contig: str, pos: int, now: float) -> str:
+        elapsed = now - self.start
+        line = f"{contig}:{pos} {self.records} records ({self.records / elapsed:.0f}/s)"
+        if self.total and contig in self.offsets:
+            done = (self.offsets[contig] + pos) / self.total
+            if done > 0:
+                remaining = datetime.timedelta(
+                    seconds=round(elapsed * (1 - done) / done)
+                )
+                line += f" {done:.1%} ETA {remaining}"
+        return line
+
+    def update(self, contig: str, pos: int, records: int):
+        self.records += records
+        now = time.perf_counter()
+        if now - self.last >= self.interval:
+            self.last = now
+            print(self.format_line(contig, pos, now), file=self.stream)
+
+    def finish(self):
+        elapsed = time.perf_counter() - self.start
+        print(f"Done: {self.records} records in {elapsed:.1f}s", file=self.stream)
+
+
+def iter_tracked(
+    items: Iterable,
+    locate: Callable[[object], Tuple[str, int]],
+    stage: Optional[Stage] = None,
+    progress: Optional[Progress] = None,
+) -> Iterable:
+    """
+    Count items into stage and report progress every CHECK_EVERY items,
+    locate gives the (contig, pos) of an item. Items are returned untouched
+    if there is nothing to track.
+    """
+    if stage is None and progress is None:
+        return items
+
+    def tracked():
+        n = 0
+        for item in items:
+            n += 1
+            if n == CHECK_EVERY:
+                if stage is not None:
+                    stage.records += n
+                if progress is not None:
+                    progress.update(*locate(item), n)
+                n = 0
+            yield item
+        if stage is not None:
+            stage.records += n
+        if progress is not None:
+            progress.records += n
+
+    return tracked()
@@ -0,0 +1,112 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module for reading and writing through stdin, stdout and named
+pipes, which are streamed once in order without seeking
+"""
+import gzip
+import io
+import os
+import stat
+import sys
+from typing import List
+from typing import Sequence
+from typing import TextIO
+from typing import Union
+
+# Path given for stdin or stdout
+STDIO = "-"
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def is_stdio(path: str) -> bool:
+    return path == STDIO
+
+
+def as_paths(paths: Union[str, Sequence[str]]) -> List[str]:
+    """
+    A path or sequence of paths as a list of paths
+    """
+    return [paths] if isinstance(paths, str) else list(paths)
+
+
+def is_stream(path: str) -> bool:
+    """
+    Whether path is stdin or a named pipe, which can only be read once
+    """
+    return is_stdio(path) or stat.S_ISFIFO(os.stat(path).st_mode)
+
+
+def open_stdin() -> TextIO:
+    """
+    Open stdin for reading text, decompressing gzip or BGZF input
+    """
+    buffer = sys.stdin.buffer
+    if not hasattr(buffer, "peek"):
+        buffer = io.BufferedReader(buffer)
+    if buffer.peek(len(GZIP_MAGIC)).startswith(GZIP_MAGIC):
+        return gzip.open(buffer, "rt")
+    return io.TextIOWrapper(buffer)
+
+
+def open_input(path: str) -> TextIO:
+    """
+    Open a file, named pipe or - for stdin for reading text. Paths ending
+    .gz are decompressed.
+    """
+    if is_stdio(path):
+        return open_stdin()
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt")
+    return open(path)
+
+
+class StdoutWriter:
+    """
+    Text output to stdout. Closing flushes stdout without closing it, so
+    messages written after the output are not lost.
+    """
+
+    def __init__(self):
+        self.stream = sys.stdout
+        self.write = self.stream.write
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.close()
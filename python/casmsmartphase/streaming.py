@@ -0,0 +1,198 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module for merge joining sorted streams of phased pairs and
+homozygous blocks against a VCF, holding only the MNVs near the current
+VCF record in memory
+"""
+import heapq
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+Interval = Tuple[str, int, int]
+
+
+class ContigOrder:
+    """
+    Rank of each contig, taken from the VCF header. Contigs missing from
+    the header are ranked after all others in the order they are first seen.
+    """
+
+    def __init__(self, contigs: List[str]):
+        self._ranks = {contig: rank for (rank, contig) in enumerate(contigs)}
+
+    def rank(self, contig: str) -> int:
+        if contig not in self._ranks:
+            self._ranks[contig] = len(self._ranks)
+        return self._ranks[contig]
+
+
+def check_sorted(
+    intervals: Iterable[Interval], order: ContigOrder, source: str
+) -> Iterator[Interval]:
+    """
+    Pass through (contig, start, end) intervals, raising a ValueError if
+    they are not sorted by contig (in VCF header order) and start
+    """
+    prev = None
+    prev_key = None
+    for interval in intervals:
+        key = (order.rank(interval[0]), interval[1])
+        if prev_key is not None and key < prev_key:
+            raise ValueError(
+                f"{source} is not sorted in VCF header contig order: "
+                f"{interval[0]}:{interval[1]} follows {prev[0]}:{prev[1]}"
+            )
+        prev = interval
+        prev_key = key
+        yield interval
+
+
+def merge_sorted(
+    streams: List[Iterable[Interval]], order: ContigOrder
+) -> Iterator[Interval]:
+    """
+    Merge sorted streams of intervals, e.g. the phased pairs of the
+    smart-phase output of each shard, into one sorted stream
+    """
+    if len(streams) == 1:
+        return iter(streams[0])
+    return heapq.merge(
+        *streams, key=lambda interval: (order.rank(interval[0]), interval[1])
+    )
+
+
+def iter_chains(pairs: Iterable[Interval]) -> Iterator[Interval]:
+    """
+    Chain sorted phased pairs of adjacent SNVs into MNVs, yielding each
+    (contig, start, end) once no later pair can extend it
+    """
+    chain = None
+    for (contig, start, end) in pairs:
+        if chain is not None and contig == chain[0] and start <= chain[2]:
+            # Extends the chain, or is a repeat of a pair within it
+            chain = (contig, chain[1], max(chain[2], end))
+            continue
+        if chain is not None:
+            yield chain
+        chain = (contig, start, end)
+    if chain is not None:
+        yield chain
+
+
+def merge_blocks(
+    chains: Iterable[Interval], blocks: Iterable[Interval], order: ContigOrder
+) -> Iterator[Interval]:
+    """
+    Merge sorted MNV chains and homozygous blocks into a single sorted stream.
+    A block replaces a chain with the same start.
+    """
+    # Blocks sort ahead of chains with the same start so the chain is dropped
+    keyed_blocks = ((order.rank(b[0]), b[1], 0, b) for b in blocks)
+    keyed_chains = ((order.rank(c[0]), c[1], 1, c) for c in chains)
+    prev_key = None
+    for (rank, start, _priority, mnv) in heapq.merge(keyed_blocks, keyed_chains):
+        if (rank, start) != prev_key:
+            yield mnv
+        prev_key = (rank, start)
+
+
+class SortedMNVStream:
+    """
+    Read only view of a sorted stream of MNVs, standing in for the dict of
+    contig to MNVs used by group_mnv_runs. Records must be queried in the same
+    contig order as the stream and in increasing position within a contig;
+    MNVs are consumed from the stream as the queries pass them.
+    """
+
+    def __init__(self, mnvs: Iterable[Interval], order: ContigOrder):
+        self._mnvs = iter(mnvs)
+        self._order = order
+        self._next = next(self._mnvs, None)
+        self._contig = None
+        self._rank = -1
+
+    def _advance(self):
+        self._next = next(self._mnvs, None)
+
+    def get(self, contig: str, default=None) -> Optional["SortedMNVStream"]:
+        """
+        Return this stream positioned at contig if MNVs remain on contig
+        """
+        if contig != self._contig:
+            rank = self._order.rank(contig)
+            if rank < self._rank:
+                raise ValueError(
+                    f"VCF is not sorted in header contig order: {contig} follows {self._contig}"
+                )
+            self._contig = contig
+            self._rank = rank
+            # Drop MNVs on contigs without VCF records
+            while self._next is not None and self._order.rank(self._next[0]) < rank:
+                self._advance()
+        if self._next is not None and self._next[0] == contig:
+            return self
+        return default
+
+    def _seek(self, pos: int):
+        while (
+            self._next is not None
+            and self._next[0] == self._contig
+            and self._next[1] < pos
+        ):
+            self._advance()
+
+    def __contains__(self, pos: int) -> bool:
+        self._seek(pos)
+        return (
+            self._next is not None
+            and self._next[0] == self._contig
+            and self._next[1] == pos
+        )
+
+    def __getitem__(self, pos: int) -> int:
+        if pos not in self:
+            raise KeyError(pos)
+        return self._next[2]
+
+
+def sorted_mnvs(
+    pairs: Iterable[Interval], blocks: Iterable[Interval], order: ContigOrder
+) -> Iterator[Interval]:
+    """
+    Stream of MNVs from sorted phased pairs and homozygous blocks, raising a
+    ValueError if either is not sorted
+    """
+    chains = iter_chains(check_sorted(pairs, order, "smart-phase output"))
+    return merge_blocks(chains, check_sorted(blocks, order, "bed file"), order)
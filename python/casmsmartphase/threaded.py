@@ -0,0 +1,180 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module running the reading and writing of a merge on threads,
+connected to the merging thread by bounded queues. Gzip inflation on
+reading and zlib compression on writing release the GIL, so overlap with
+the merge.
+"""
+import io
+import queue
+import threading
+from itertools import islice
+from typing import Iterable
+from typing import Iterator
+
+import vcfpy
+
+# Characters of lines read at a time from a text stream by the reader thread
+READ_CHARS = 1 << 20
+# Lines read at a time from any other iterable of lines
+READ_LINES = 16384
+# Record lines and merged records passed to the writer thread at a time
+WRITE_BATCH = 4096
+# Batches held by each queue, bounding the memory used
+QUEUE_DEPTH = 4
+# Marks the end of the batches of a queue
+_DONE = object()
+
+
+def read_ahead(lines: Iterable[str], depth: int = QUEUE_DEPTH) -> Iterator[str]:
+    """
+    Iterate lines read in batches on a reader thread, up to depth batches
+    ahead of the consumer. Text streams are read READ_CHARS at a time with
+    readlines, other iterables READ_LINES lines at a time. Errors reading
+    are raised in the consumer.
+    """
+    batches = queue.Queue(depth)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # Stop reading once the consumer has stopped
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read():
+        try:
+            if hasattr(lines, "readlines"):
+                reads = iter(lambda: lines.readlines(READ_CHARS), [])
+            else:
+                line_iter = iter(lines)
+                reads = iter(lambda: list(islice(line_iter, READ_LINES)), [])
+            for batch in reads:
+                if not put(batch):
+                    return
+            put(_DONE)
+        except Exception as err:
+            put(err)
+
+    thread = threading.Thread(target=read, name="read_ahead", daemon=True)
+    thread.start()
+    try:
+        while True:
+            batch = batches.get()
+            if batch is _DONE:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            yield from batch
+    finally:
+        stop.set()
+        thread.join()
+
+
+class ThreadedWriter:
+    """
+    Stand-in for a vcfpy.Writer with its header written. Lines written to
+    stream and records passed to write_record are sent in batches to a
+    writer thread, which serialises the records and writes each batch to
+    the stream of the vcfpy.Writer at once. Errors writing are raised on the
+    next batch sent or on close.
+    """
+
+    def __init__(self, writer: vcfpy.Writer, depth: int = QUEUE_DEPTH):
+        self.header = writer.header
+        # Record lines are written as to the stream of a vcfpy.Writer
+        self.stream = self
+        self._writer = writer
+        self._batch = []
+        self._batches = queue.Queue(depth)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        buffer = io.StringIO()
+        serialiser = vcfpy.Writer.from_stream(buffer, self.header)
+        while True:
+            batch = self._batches.get()
+            if batch is _DONE:
+                return
+            # Batches are still taken after an error, so senders don't block
+            if self._error is not None:
+                continue
+            # Discard the header, then the previous batch
+            buffer.seek(0)
+            buffer.truncate()
+            try:
+                for item in batch:
+                    if isinstance(item, str):
+                        buffer.write(item)
+                    else:
+                        serialiser.write_record(item)
+                self._writer.stream.write(buffer.getvalue())
+            except Exception as err:
+                self._error = err
+
+    def _send(self):
+        if self._error is not None:
+            raise self._error
+        if self._batch:
+            self._batches.put(self._batch)
+            self._batch = []
+
+    def write(self, text: str) -> int:
+        self._batch.append(text)
+        if len(self._batch) >= WRITE_BATCH:
+            self._send()
+        return len(text)
+
+    def write_record(self, record: vcfpy.Record):
+        self._batch.append(record)
+        if len(self._batch) >= WRITE_BATCH:
+            self._send()
+
+    def flush(self):
+        self._send()
+
+    def close(self):
+        """
+        Write the remaining batches and close the vcfpy.Writer
+        """
+        self._send()
+        self._batches.put(_DONE)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        self._writer.close()
@@ -0,0 +1,131 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Python module for reading VCF record lines as text, leaving
+decoding through vcfpy to only the records that need it
+"""
+import io
+import re
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import TextIO
+from typing import Tuple
+
+import vcfpy
+from casmsmartphase.stdio import open_input
+
+
+def open_vcf_records(vcf_path: str) -> Tuple[vcfpy.Reader, TextIO]:
+    """
+    Open a (optionally gzipped) VCF, - for stdin. Returns a vcfpy Reader of the header
+    only, used to parse selected record lines, and the text stream
+    positioned at the first record line.
+    """
+    stream = open_input(vcf_path)
+    header_lines = []
+    for line in stream:
+        header_lines.append(line)
+        if line.startswith("#CHROM"):
+            break
+    reader = vcfpy.Reader.from_stream(io.StringIO("".join(header_lines)))
+    return reader, stream
+
+
+def split_chrom_pos(line: str) -> Tuple[str, int]:
+    """
+    Return CHROM and POS of a VCF record line without splitting the rest
+    of the line
+    """
+    chrom_end = line.index("\t")
+    pos_end = line.index("\t", chrom_end + 1)
+    return line[:chrom_end], int(line[chrom_end + 1 : pos_end])
+
+
+def gt_is_het(gt: str) -> bool:
+    """
+    Whether a GT value is heterozygous, as vcfpy Call.is_het: every allele
+    called and not all the same allele
+    """
+    alleles = re.split(r"[|/]", gt)
+    if "." in alleles or "" in alleles:
+        return False
+    return len(set(map(int, alleles))) > 1
+
+
+class ZygosityReader:
+    """
+    Reads whether a sample is heterozygous from VCF record lines split on
+    tabs. The GT index is found once per FORMAT string and is_het once per
+    GT value.
+    """
+
+    def __init__(self, sample: int):
+        self.column = 9 + sample
+        self.gt_index: Dict[str, int] = {}
+        self.het_gts: Dict[str, bool] = {}
+
+    def is_het(self, fields: List[str]) -> bool:
+        index = self.gt_index.get(fields[8])
+        if index is None:
+            keys = fields[8].split(":")
+            index = self.gt_index[fields[8]] = keys.index("GT") if "GT" in keys else -1
+        if index < 0:
+            return False
+        values = fields[self.column].rstrip("\r\n").split(":")
+        if index >= len(values):
+            return False
+        is_het = self.het_gts.get(values[index])
+        if is_het is None:
+            is_het = self.het_gts[values[index]] = gt_is_het(values[index])
+        return is_het
+
+
+def iter_zygosity(lines: Iterable[str], sample: int) -> Iterator[Tuple[str, int, bool]]:
+    """
+    Iterate through VCF record lines, yielding (CHROM, POS, is_het) of the
+    sample at index sample, reading only the columns needed
+    """
+    is_het = ZygosityReader(sample).is_het
+    for line in lines:
+        fields = line.split("\t")
+        yield (fields[0], int(fields[1]), is_het(fields))
+
+
+def iter_split_records(lines: Iterable[str]) -> Iterator[Tuple[str, int, List[str]]]:
+    """
+    Iterate through VCF record lines, yielding (CHROM, POS, fields) of each
+    line split on tabs
+    """
+    for line in lines:
+        fields = line.split("\t")
+        yield (fields[0], int(fields[1]), fields)
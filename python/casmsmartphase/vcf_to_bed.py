@@ -33,65 +33,330 @@ Merge adjacent SNVs in a CaVEMan generated
 VCF into a new VCF containing SNVs and merged MNVs in order to be
 processed by Smart-phase
 """
+from contextlib import closing
+from operator import itemgetter
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import TextIO
+from typing import Tuple
+
 import vcfpy
+from casmsmartphase import bgzf
+from casmsmartphase.columnar import iter_blocks_columnar
+from casmsmartphase.columnar import iter_columns
+from casmsmartphase.parallel import get_contig_lengths
+from casmsmartphase.regions import fetch_lines
+from casmsmartphase.regions import load_regions
+from casmsmartphase.shards import shard_blocks
+from casmsmartphase.shards import SHARD_FIELD
+from casmsmartphase.stats import iter_tracked
+from casmsmartphase.stats import Progress
+from casmsmartphase.stats import RunStats
+from casmsmartphase.vcf_lines import iter_split_records
+from casmsmartphase.vcf_lines import iter_zygosity
+from casmsmartphase.vcf_lines import open_vcf_records
+from casmsmartphase.vcf_lines import ZygosityReader
 
 HOM_OUTPUT = "\t\thom"
+TUMOUR_SAMPLE = "TUMOUR"
+# Sample selecting every sample of the VCF, unless a sample has the name
+ALL_SAMPLES = "all"
+# Replaced by the sample name in output paths
+SAMPLE_FIELD = "{sample}"
+
+# A candidate block, (contig, bed start, bed end, is_het)
+Block = Tuple[str, int, int, bool]
 
 
-def parse_vcf(reader, outfile, markhz=False):
-    prev_contig = ""
-    prev_snv = []
-    prev_pos = 0
-    for variant in reader:
+def iter_blocks(sites: Iterable[Tuple[str, int, bool]]) -> Iterator[Block]:
+    """
+    Iterate through (contig, pos, is_het) of VCF records, yielding
+    (contig, bed start, bed end, is_het) for each block of two or more
+    adjacent SNVs with the same zygosity
+    """
+    run_contig = None
+    run_start = 0
+    run_end = 0
+    run_het = None
+    run_length = 0
+    for (contig, pos, is_het) in sites:
         # If this variant is not adjacent to the previous
         # Or the variant zygosity differs
-        if len(prev_snv) > 0 and (
-            variant.CHROM != prev_contig
-            or int(variant.POS) > prev_pos + 1
-            or (prev_snv[-1].call_for_sample["TUMOUR"]).is_het
-            != (variant.call_for_sample["TUMOUR"]).is_het
+        if run_length and (
+            contig != run_contig or pos > run_end + 1 or is_het != run_het
         ):
-            # Print any already adjacent SNVs as MNVs
-            if len(prev_snv) > 1:
-                # MNVs print possible MNV location to bed file
-                bed_str = (
-                    f"{prev_snv[0].CHROM}\t{prev_snv[0].POS-1}\t{prev_snv[-1].POS}"
-                )
-                is_het = (prev_snv[0].call_for_sample["TUMOUR"]).is_het
-                if not is_het and markhz:
-                    bed_str = bed_str + HOM_OUTPUT
-                print(
-                    bed_str,
-                    file=outfile,
-                )
-            prev_snv.clear()
-            prev_het = -1
-
-        prev_snv.append(variant)
-        prev_contig = str(variant.CHROM)
-        prev_pos = int(variant.POS)
-
-    # Print any already adjacent SNVs as MNVs
-    if len(prev_snv) > 1:
-        het = ((prev_snv[0]).call_for_sample["TUMOUR"]).is_het
-        # MNVs pront possible MNV location to bed file
-        bed_str = f"{prev_snv[0].CHROM}\t{prev_snv[0].POS-1}\t{prev_snv[-1].POS}"
-        if not het and markhz:
-            bed_str = bed_str + HOM_OUTPUT
-        print(
-            bed_str,
-            file=outfile,
+            # Output any already adjacent SNVs as MNVs
+            if run_length > 1:
+                yield (run_contig, run_start - 1, run_end, run_het)
+            run_length = 0
+        if not run_length:
+            (run_contig, run_start, run_het) = (contig, pos, is_het)
+        run_end = pos
+        run_length += 1
+
+    # Output any already adjacent SNVs as MNVs
+    if run_length > 1:
+        yield (run_contig, run_start - 1, run_end, run_het)
+
+
+def iter_sample_blocks(
+    records: Iterable[Tuple[str, int, List[str]]], samples: List[int]
+) -> Iterator[Tuple[int, Block]]:
+    """
+    Iterate through (CHROM, POS, fields) of VCF records, yielding (index in
+    samples, block) for the blocks iter_blocks finds for each sample at the
+    indices samples. Adjacency is the same for every sample, so the
+    zygosity of each sample is only read for runs of two or more adjacent
+    records, the only records that can form blocks.
+    """
+    readers = [ZygosityReader(sample).is_het for sample in samples]
+    run: List[Tuple[str, int, List[str]]] = []
+    for record in records:
+        if run and (record[0] != run[-1][0] or record[1] > run[-1][1] + 1):
+            if len(run) > 1:
+                yield from _run_blocks(run, readers)
+            run = []
+        run.append(record)
+    if len(run) > 1:
+        yield from _run_blocks(run, readers)
+
+
+def _run_blocks(run, readers) -> Iterator[Tuple[int, Block]]:
+    for (index, is_het) in enumerate(readers):
+        sites = [(contig, pos, is_het(fields)) for (contig, pos, fields) in run]
+        for block in iter_blocks(sites):
+            yield (index, block)
+
+
+def iter_candidate_blocks(reader) -> Iterator[Block]:
+    """
+    Iterate through vcfpy records, yielding (contig, bed start, bed end, is_het)
+    for each block of two or more adjacent SNVs with the same TUMOUR zygosity
+    """
+    return iter_blocks(
+        (
+            variant.CHROM,
+            variant.POS,
+            variant.call_for_sample[TUMOUR_SAMPLE].is_het,
         )
-    prev_snv.clear()
-    prev_het = -1
+        for variant in reader
+    )
+
+
+def get_sample_index(header: vcfpy.Header, sample: str) -> int:
+    if sample not in header.samples.names:
+        raise ValueError(f"Sample {sample} not found in the VCF header")
+    return header.samples.names.index(sample)
+
+
+def select_samples(
+    header: vcfpy.Header, samples: Sequence[str]
+) -> List[Tuple[str, int]]:
+    """
+    Name and index of each of samples, all selecting every sample of the
+    VCF in header order. Repeated samples are selected once.
+    """
+    names = header.samples.names
+    if ALL_SAMPLES in samples and ALL_SAMPLES not in names:
+        samples = names
+    return [(name, get_sample_index(header, name)) for name in dict.fromkeys(samples)]
+
+
+def open_selected_records(
+    vcfin: str, samples: Sequence[str]
+) -> Tuple[vcfpy.Header, TextIO, List[Tuple[str, int]]]:
+    """
+    Open a VCF for scanning as text, returning the header, the record lines
+    and the name and index of each of samples, as select_samples
+    """
+    (reader, records) = open_vcf_records(vcfin)
+    try:
+        selected = select_samples(reader.header, samples)
+    except ValueError:
+        records.close()
+        raise
+    return reader.header, records, selected
+
+
+def open_sample_records(vcfin: str) -> Tuple[vcfpy.Header, TextIO, int]:
+    """
+    Open a VCF for scanning as text, returning the header, the record lines
+    and the index of the TUMOUR sample
+    """
+    (header, records, [(_name, sample)]) = open_selected_records(
+        vcfin, (TUMOUR_SAMPLE,)
+    )
+    return header, records, sample
 
 
-def run_parse(vcfin, output, markhz):
+def bed_output_paths(
+    output: Optional[str], names: List[str], shards: int = 1
+) -> List[Optional[str]]:
+    """
+    Output path of the bed of each sample and shard, ordered by sample then
+    shard. SAMPLE_FIELD in output is replaced by the sample name and
+    SHARD_FIELD by the 1-based shard number, each required where there are
+    several samples or shards.
+    """
+    for (field, n, files) in (
+        (SAMPLE_FIELD, len(names), f"each of samples {', '.join(names)}"),
+        (SHARD_FIELD, shards, f"each of {shards} shards"),
+    ):
+        if n > 1 and (output is None or field not in output):
+            raise ValueError(f"Output must include {field} to write a bed for {files}")
+    if output is None:
+        return [output]
+    return [
+        output.replace(SAMPLE_FIELD, name).replace(SHARD_FIELD, str(shard))
+        for name in names
+        for shard in range(1, shards + 1)
+    ]
+
+
+def scan_sites(vcfin: str) -> Tuple[vcfpy.Header, Iterator[Tuple[str, int, bool]]]:
+    """
+    Open a VCF for scanning as text, returning the header and an iterator
+    of (contig, pos, is_het) of the TUMOUR sample at each record
+    """
+    (header, records, sample) = open_sample_records(vcfin)
+
+    def iter_sites():
+        with records:
+            yield from iter_zygosity(records, sample)
+
+    return header, iter_sites()
+
+
+def track_chunks(chunks, stage, progress):
+    """
+    Count records of column chunks into stage, reporting progress per chunk
+    """
+    for chunk in chunks:
+        (contigs, positions, _hets) = chunk
+        stage.records += len(positions)
+        if progress is not None:
+            progress.update(contigs[-1], positions[-1], len(positions))
+        yield chunk
+
+
+def format_bed_line(block: Tuple[str, int, int, bool], markhz: bool) -> str:
+    """
+    Bed line of a candidate block, homozygous blocks are marked if markhz
+    """
+    (contig, start, end, is_het) = block
+    bed_str = f"{contig}\t{start}\t{end}"
+    if not is_het and markhz:
+        bed_str = bed_str + HOM_OUTPUT
+    return bed_str
+
+
+def count_block(stats: RunStats, block: Block):
+    (_contig, start, end, is_het) = block
+    stats.counts["het_blocks" if is_het else "hom_blocks"] += 1
+    stats.mnv_lengths[end - start] += 1
+
+
+def write_blocks(blocks, outfile, markhz=False, stats: Optional[RunStats] = None):
+    for block in blocks:
+        # MNVs print possible MNV location to bed file
+        print(format_bed_line(block, markhz), file=outfile)
+        if stats is not None:
+            count_block(stats, block)
+
+
+def write_sample_blocks(
+    sample_blocks, outfiles, markhz=False, stats: Optional[RunStats] = None
+):
+    """
+    Write (index, block) of iter_sample_blocks or shard_blocks to the
+    outfile at the index, stats counting the blocks of all outfiles
+    """
+    for (index, block) in sample_blocks:
+        print(format_bed_line(block, markhz), file=outfiles[index])
+        if stats is not None:
+            count_block(stats, block)
+
+
+def parse_vcf(reader, outfile, markhz=False, stats: Optional[RunStats] = None):
+    write_blocks(iter_candidate_blocks(reader), outfile, markhz, stats)
+
+
+def run_parse(
+    vcfin,
+    output,
+    markhz,
+    compress_level=bgzf.DEFAULT_COMPRESS_LEVEL,
+    compress_threads=1,
+    index_format="tbi",
+    stats_json=None,
+    progress=False,
+    columnar=False,
+    region=(),
+    regions_file=None,
+    sample=(TUMOUR_SAMPLE,),
+    shards=1,
+    shard_by="count",
+):
     # Run through input VCF file and output any bed locations
+    # An output ending .gz is bgzipped and indexed
     """
-    Iterate through VCF records. Outputting a new VCF with
-    requested filters removed.
+    Scan the VCF records as text, optionally only in regions, writing a
+    candidate bed of the blocks of adjacent SNVs of each selected sample,
+    split into shards where shards is more than one. Homozygous blocks are
+    marked if markhz. Run statistics are written to stats_json if given.
     """
-    reader = vcfpy.Reader.from_path(vcfin)
-    with open(output, "w") as outfile:
-        parse_vcf(reader, outfile, markhz)
+    stats = RunStats()
+    (header, records, samples) = open_selected_records(vcfin, sample)
+    try:
+        names = [name for (name, _index) in samples]
+        paths = bed_output_paths(output, names, shards)
+        if columnar and len(samples) > 1:
+            raise ValueError("--columnar scans a single sample")
+    except ValueError:
+        records.close()
+        raise
+    regions = load_regions(vcfin, region, regions_file)
+    if regions is not None:
+        # Runs of adjacent SNVs are only found within each region
+        records.close()
+        records = closing(fetch_lines(vcfin, regions))
+    tracker = Progress(get_contig_lengths(header)) if progress else None
+    outfiles = [
+        bgzf.open_output(
+            path, bgzf.TBX_BED, compress_level, compress_threads, index_format
+        )
+        for path in paths
+    ]
+    sample = samples[0][1]
+    with stats.stage("records") as stage, records as lines:
+        # Blocks are counted as they are written, columnar blocks as found
+        block_stats = stats
+        if len(samples) > 1:
+            # All samples are scanned from one pass over the records
+            sites = iter_tracked(
+                iter_split_records(lines), itemgetter(0, 1), stage, tracker
+            )
+            blocks = iter_sample_blocks(sites, [index for (_name, index) in samples])
+        else:
+            if columnar:
+                chunks = track_chunks(iter_columns(lines, sample), stage, tracker)
+                sample_blocks = iter_blocks_columnar(chunks, stats)
+                block_stats = None
+            else:
+                sites = iter_zygosity(lines, sample)
+                sites = iter_tracked(sites, itemgetter(0, 1), stage, tracker)
+                sample_blocks = iter_blocks(sites)
+            blocks = ((0, block) for block in sample_blocks)
+        if shards > 1:
+            blocks = shard_blocks(blocks, len(samples), shards, shard_by)
+        write_sample_blocks(blocks, outfiles, markhz, block_stats)
+    with stats.stage("write"):
+        for outfile in outfiles:
+            outfile.close()
+    if tracker is not None:
+        tracker.finish()
+    if stats_json:
+        stats.write_json(stats_json)
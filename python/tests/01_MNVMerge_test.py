@@ -31,11 +31,14 @@
 """
 Tests of the MNVMerge module
 """
+import gzip
 import os
 
 import pytest
 import vcfpy
 from casmsmartphase.MNVMerge import get_last_vcf_process_index
+from casmsmartphase.MNVMerge import group_mnv_runs
+from casmsmartphase.MNVMerge import merge_fields_compact
 from casmsmartphase.MNVMerge import MNVMerge
 from casmsmartphase.MNVMerge import parse_homs_bed_to_dict
 from casmsmartphase.MNVMerge import parse_sphase_output
@@ -262,3 +265,150 @@ def test_perform_mnv_merge(invcf, exp_res, spout):
     merge_obj.perform_mnv_merge_to_vcf()
     assert compare_vcf_files(OUTPUT_VCF, exp_res)
     os.remove(OUTPUT_VCF)
+
+
+@pytest.mark.parametrize(
+    "entries,exp_result",
+    [
+        (
+            [("chr1", 1, "a"), ("chr1", 2, "b"), ("chr1", 3, "c"), ("chr1", 5, "d")],
+            [("a", False), (["b", "c"], True), ("d", False)],
+        ),
+        # MNV not completed in the input is left unmerged
+        (
+            [("chr1", 2, "b"), ("chr1", 4, "c"), ("chr2", 2, "d"), ("chr2", 3, "e")],
+            [("b", False), ("c", False), ("d", False), ("e", False)],
+        ),
+        (
+            [("chr1", 2, "b"), ("chr2", 2, "c")],
+            [("b", False), ("c", False)],
+        ),
+    ],
+)
+def test_group_mnv_runs(entries, exp_result):
+    assert list(group_mnv_runs(entries, {"chr1": {2: 3}})) == exp_result
+
+
+def test_perform_mnv_merge_copies_unmerged_lines():
+    merge_obj = MNVMerge(
+        FILT_QUAL_INPUT_VCF, OUTPUT_VCF, SPOUT, CUTOFF, EXCLUDE, RUN_SCRIPT, ARG_STR
+    )
+    merge_obj.perform_mnv_merge_to_vcf()
+    with gzip.open(FILT_QUAL_INPUT_VCF, "rt") as vcf:
+        in_lines = [line for line in vcf if not line.startswith("#")]
+    with open(OUTPUT_VCF) as vcf:
+        out_lines = [line for line in vcf if not line.startswith("#")]
+    os.remove(OUTPUT_VCF)
+    # The two SNVs at 1627262 and 1627263 are merged, all others are unchanged
+    assert out_lines[:5] == in_lines[:5]
+    assert out_lines[6:] == in_lines[7:]
+    assert out_lines[5].startswith("chr1\t1627262\t")
+
+
+def test_merge_snv_to_mnv_calls():
+    merge_obj = MNVMerge(
+        INPUT_VCF, OUTPUT_VCF, SPOUT, CUTOFF, EXCLUDE, RUN_SCRIPT, ARG_STR
+    )
+    snvs = [
+        merge_obj.vcfin.parser.parse_line(line)
+        for (_i, line) in zip(range(3), merge_obj.vcfin_records)
+    ]
+    merge_obj.vcfin_records.close()
+    mnv = merge_obj.merge_snv_to_mnv(snvs)
+    assert mnv.REF == "".join(snv.REF for snv in snvs)
+    assert [call.sample for call in mnv.calls] == ["NORMAL", "TUMOUR"]
+    for call in mnv.calls:
+        assert call.data == {
+            f"{key}_{n}": value
+            for (n, snv) in enumerate(snvs, start=1)
+            for (key, value) in snv.call_for_sample[call.sample].data.items()
+        }
+    # The calls of the SNVs are left unchanged
+    assert all("GT" in call.data for snv in snvs for call in snv.calls)
+
+
+def test_perform_mnv_merge_warnings_summarised(caplog):
+    merge_obj = MNVMerge(
+        FILT_QUAL_INPUT_VCF, OUTPUT_VCF, SPOUT, CUTOFF, EXCLUDE, RUN_SCRIPT, ARG_STR
+    )
+    merge_obj.perform_mnv_merge_to_vcf()
+    os.remove(OUTPUT_VCF)
+    assert [record.getMessage() for record in caplog.records] == [
+        "Found a QUAL value in 1 MNVs, output will be a mean of all QUAL.",
+        "Found a FILTER value in 1 MNVs, output will be all FILTERs encountered at all bases.",
+    ]
+    assert merge_obj.stats.counts["mnvs_merged_qual"] == 1
+    assert merge_obj.stats.counts["mnvs_merged_filter"] == 1
+
+
+def test_perform_mnv_merge_compact():
+    merge_obj = MNVMerge(
+        INPUT_VCF,
+        OUTPUT_VCF,
+        SPOUT,
+        CUTOFF,
+        EXCLUDE,
+        RUN_SCRIPT,
+        ARG_STR,
+        mnv_encoding="compact",
+    )
+    merge_obj.perform_mnv_merge_to_vcf()
+    reader = vcfpy.Reader.from_path(OUTPUT_VCF)
+    in_header = merge_obj.vcfin.header
+    assert [line.id for line in reader.header.get_lines("INFO")] == [
+        line.id for line in in_header.get_lines("INFO")
+    ]
+    assert reader.header.get_format_field_info("GT").number == 1
+    assert reader.header.get_format_field_info("FAZ").number == "."
+    records = list(reader)
+    reader.close()
+    os.remove(OUTPUT_VCF)
+    mnv = records[5]
+    assert (mnv.POS, mnv.REF) == (1627262, "GG")
+    assert mnv.INFO["DP"] == [266, 271]
+    assert mnv.call_for_sample["TUMOUR"].data["GT"] == "0|1"
+    assert mnv.call_for_sample["TUMOUR"].data["FGZ"] == [40, 41]
+    assert records[0].INFO["DP"] == [105]
+
+
+@pytest.mark.parametrize("max_len", [2, 50])
+def test_compact_header_fixed_size(max_len):
+    merge_obj = MNVMerge(
+        INPUT_VCF,
+        OUTPUT_VCF,
+        SPOUT,
+        CUTOFF,
+        EXCLUDE,
+        RUN_SCRIPT,
+        ARG_STR,
+        mnv_encoding="compact",
+    )
+    in_header = merge_obj.vcfin.header
+    header = merge_obj.parse_header_add_merge_and_process(in_header.copy(), max_len)
+    merge_obj.vcfin_records.close()
+    assert len(header.lines) == len(in_header.lines) + 1
+
+
+def test_merge_fields_compact():
+    snvs = [
+        vcfpy.Record(
+            "chr1",
+            pos,
+            [],
+            "A",
+            [vcfpy.Substitution("SNV", "C")],
+            None,
+            [],
+            info,
+            ["GT", "AD"],
+            [vcfpy.Call("TUMOUR", {"GT": gt, "AD": ad})],
+        )
+        for (pos, info, gt, ad) in [
+            (1, {"DP": 10, "DS": ["rs1", "rs2"]}, "0/1", [5, 5]),
+            (2, {"DP": 12, "SOMATIC": True}, "1/1", [2, None]),
+        ]
+    ]
+    (info, format, calls) = merge_fields_compact(snvs)
+    assert info == {"DP": [10, 12], "DS": ["rs1|rs2", None], "SOMATIC": True}
+    assert format == ["GT", "AD"]
+    assert calls[0].data == {"GT": None, "AD": ["5|5", "2|."]}
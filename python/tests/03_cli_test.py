@@ -36,6 +36,7 @@ import sys
 import pkg_resources  # part of setuptools
 import pytest
 from casmsmartphase.cli import cli
+from casmsmartphase.cli import generate_arg_string
 from click.testing import CliRunner
 
 INPUT_VCF = "test_data/test_input.vcf.gz"
@@ -44,12 +45,28 @@ VERSION = pkg_resources.require("casmsmartphase")[0].version
 EXP_BASE_HELP = """Usage: cli [OPTIONS] COMMAND [ARGS]...
 
 Options:
-  --version  Show the version and exit.
-  --help     Show this message and exit.
+  --version                       Show the version and exit.
+  --profile DIRECTORY             Directory to write a profile of the command
+                                  to, cProfile statistics (.pstats) of the main
+                                  process by default  [env var:
+                                  CASMSMARTPHASE_PROFILE]
+  --profile-sample SECONDS        With --profile, sample the stacks of every
+                                  thread each SECONDS instead of using cProfile,
+                                  at much lower cost, writing them in the folded
+                                  format of flame graph tools (.folded)  [env
+                                  var: CASMSMARTPHASE_PROFILE_SAMPLE; x>0]
+  --profile-memory / --no-profile-memory
+                                  With --profile, trace memory allocations,
+                                  writing a tracemalloc snapshot at the end of
+                                  each stage  [env var:
+                                  CASMSMARTPHASE_PROFILE_MEMORY]
+  --help                          Show this message and exit.
 
 Commands:
-  generate-bed  Generate a bed file of adjacent SNVs in a VCF for...
-  merge-mnvs    Merge MNVs parsed by smartphase into a CaVEMan SNV and MNV...
+  batch           Merge or phase and merge MNVs for every sample of a...
+  generate-bed    Generate a bed file of adjacent SNVs in a VCF for...
+  merge-mnvs      Merge MNVs parsed by smartphase into a CaVEMan SNV and...
+  phase-pipeline  Generate candidates, phase and merge MNVs in a single run
 """
 
 EXP_GENERATE_BED_HELP = """Usage: cli generate-bed [OPTIONS]
@@ -57,12 +74,49 @@ EXP_GENERATE_BED_HELP = """Usage: cli generate-bed [OPTIONS]
   Generate a bed file of adjacent SNVs in a VCF for smartphase analysis
 
 Options:
-  --version                Show the version and exit.
-  -f, --vcfin FILE         Path to input VCF file  [required]
-  -o, --output output.bed  Path to write output bed file
-  --markhz / --nomarkhz    Mark homozygous adjacent SNVs in the bed file output
-                           (default - don't mark)
-  --help                   Show this message and exit.
+  --version                       Show the version and exit.
+  -f, --vcfin FILE                Path to input VCF file, - for stdin
+                                  [required]
+  -o, --output output.bed         Path to write output bed file, bgzipped and
+                                  indexed if ending .gz, - for stdout. {sample}
+                                  is replaced by the sample name and {shard} by
+                                  the shard number, required to write a bed for
+                                  each of several samples or shards
+  --markhz / --nomarkhz           Mark homozygous adjacent SNVs in the bed file
+                                  output (default - don't mark)
+  --compress-level INTEGER RANGE  zlib compression level of bgzipped output,
+                                  used where the output path ends .gz  [default:
+                                  6; 0<=x<=9]
+  --compress-threads INTEGER RANGE
+                                  Number of threads compressing bgzipped output
+                                  [default: 1; x>=1]
+  --index-format [tbi|csi]        Index written alongside bgzipped output, tbi
+                                  or csi (required for contigs longer than 2^29)
+                                  [default: tbi]
+  --columnar / --no-columnar      Find blocks of adjacent SNVs with NumPy array
+                                  operations over large chunks of records
+  -s, --sample TEXT               Sample to find blocks of adjacent SNVs for.
+                                  May be repeated, all for every sample of the
+                                  VCF. Several samples are scanned in one pass
+                                  over the VCF  [default: TUMOUR]
+  --shards INTEGER RANGE          Split the blocks of adjacent SNVs into this
+                                  many beds, each of a contiguous run of blocks,
+                                  to run smart-phase on each separately
+                                  [default: 1; x>=1]
+  --shard-by [count|span]         Balance the shards by the number of blocks or
+                                  their total span in bases  [default: count]
+  -r, --region chr:start-end      Restrict the run to a region, chr, chr:start
+                                  or chr:start-end (1-based, inclusive). May be
+                                  repeated. Requires a bgzipped, tabix or CSI
+                                  indexed input VCF
+  -R, --regions-file FILE         Restrict the run to the regions of a bed file.
+                                  Requires a bgzipped, tabix or CSI indexed
+                                  input VCF
+  --stats-json FILE               Write per stage timings, throughput, peak
+                                  memory and counts of the run to this JSON file
+  --progress / --no-progress      Report progress and estimated time remaining
+                                  to stderr
+  --help                          Show this message and exit.
 """
 
 EXP_MERGE_MNV_HELP = """Usage: cli merge-mnvs [OPTIONS]
@@ -71,11 +125,16 @@ EXP_MERGE_MNV_HELP = """Usage: cli merge-mnvs [OPTIONS]
 
 Options:
   --version                       Show the version and exit.
-  -f, --vcfin FILE                Path to input VCF file  [required]
-  -o, --output output.vcf         Path to write output vcf file
-  -p, --smart-phased-output sample.phased.output
-                                  The phased output file from Smart-Phase
+  -f, --vcfin FILE                Path to input VCF file, - for stdin
                                   [required]
+  -o, --output output.vcf         Path to write output vcf file, bgzipped and
+                                  indexed if ending .gz, - for stdout
+  -p, --smart-phased-output sample.phased.output
+                                  The phased output file from Smart-Phase, - for
+                                  stdin or a named pipe (read once, so can't be
+                                  used with --streaming). May be repeated, e.g.
+                                  for the output of each shard of generate-bed
+                                  --shards, merged as one phased set  [required]
   -c, --cutoff FLOAT              Exclude any MNVs with a phased score < cutoff
                                   [default: 0.0]
   -x, --exclude INTEGER           Exclude phased MNV if it matches any of the
@@ -83,10 +142,138 @@ Options:
   -b, --bed FILE                  .bed file of regions used to run smartphase.
                                   If homozygous adjacent SNVs are marked in the
                                   file they will be output in the merged VCF as
-                                  an MNV.
+                                  an MNV. May be repeated, e.g. for the beds of
+                                  each shard
+  -t, --threads, --workers INTEGER RANGE
+                                  Number of worker processes merging genomic
+                                  windows in parallel. Requires a bgzipped,
+                                  tabix indexed input VCF [default: 1]  [x>=1]
+  --streaming / --no-streaming    Merge join the smart-phase output and bed file
+                                  against the VCF, holding only nearby MNVs in
+                                  memory. Both must be sorted in the contig
+                                  order of the VCF header. Can't be used with
+                                  --threads
+  --pipelined / --no-pipelined    Read and decompress the input VCF and
+                                  serialise and compress the output on their own
+                                  threads, overlapping the merge. Applies to
+                                  merges in a single process
+  --checkpoint-interval SECONDS   Save a checkpoint of the merge every SECONDS
+                                  beside the output (output.checkpoint), a rerun
+                                  of the same command resumes from it,
+                                  truncating the output to the checkpoint.
+                                  Records are merged in a single process, the
+                                  output and smart-phase output must be files
+                                  [x>=0]
+  --incremental previous.vcf      Previous merge-mnvs output of the input VCF.
+                                  Only the MNVs changed from it are merged
+                                  again, the rest of its records are copied
+                                  through, e.g. after smart-phase is rerun for
+                                  some regions
+  --mnv-encoding [incremental|compact]
+                                  Encoding of the per base values of merged
+                                  MNVs. incremental adds KEY_1..KEY_n INFO and
+                                  FORMAT fields, with header lines for the
+                                  longest MNV. compact lists the values under
+                                  the original keys, with a fixed size header
+                                  [default: incremental]
+  --cache-dir DIRECTORY           Directory caching the MNVs parsed from smart-
+                                  phase output, keyed by the content of the
+                                  phased output and bed file and the cutoff and
+                                  exclude flags, so repeat runs skip parsing
+                                  [env var: CASMSMARTPHASE_CACHE_DIR]
+  --cache-size-mb INTEGER RANGE   Size limit of the cache directory in MB, least
+                                  recently used entries are removed beyond it
+                                  [default: 1024; x>=0]
+  --compress-level INTEGER RANGE  zlib compression level of bgzipped output,
+                                  used where the output path ends .gz  [default:
+                                  6; 0<=x<=9]
+  --compress-threads INTEGER RANGE
+                                  Number of threads compressing bgzipped output
+                                  [default: 1; x>=1]
+  --index-format [tbi|csi]        Index written alongside bgzipped output, tbi
+                                  or csi (required for contigs longer than 2^29)
+                                  [default: tbi]
+  -r, --region chr:start-end      Restrict the run to a region, chr, chr:start
+                                  or chr:start-end (1-based, inclusive). May be
+                                  repeated. Requires a bgzipped, tabix or CSI
+                                  indexed input VCF
+  -R, --regions-file FILE         Restrict the run to the regions of a bed file.
+                                  Requires a bgzipped, tabix or CSI indexed
+                                  input VCF
+  --stats-json FILE               Write per stage timings, throughput, peak
+                                  memory and counts of the run to this JSON file
+  --progress / --no-progress      Report progress and estimated time remaining
+                                  to stderr
+  --help                          Show this message and exit.
+"""
+
+EXP_PHASE_PIPELINE_HELP = """Usage: cli phase-pipeline [OPTIONS]
+
+  Generate candidates, phase and merge MNVs in a single run
+
+Options:
+  --version                       Show the version and exit.
+  -f, --vcfin FILE                Path to input VCF file, also read by the
+                                  phasing command  [required]
+  -o, --output output.vcf         Path to write output vcf file, bgzipped and
+                                  indexed if ending .gz, - for stdout
+  --phase-cmd TEXT                Phasing command to run, e.g. a smart-phase
+                                  command line. {vcf}, {bed} and {output} are
+                                  replaced by the input VCF, the candidate bed
+                                  file and the phased output file to write
+                                  [required]
+  -c, --cutoff FLOAT              Exclude any MNVs with a phased score < cutoff
+                                  [default: 0.0]
+  -x, --exclude INTEGER           Exclude phased MNV if it matches any of the
+                                  exclude flag bits
+  --markhz / --nomarkhz           Mark homozygous adjacent SNVs in the bed file
+                                  output (default - don't mark)
+  -w, --workdir DIRECTORY         Directory to keep the candidate bed and phased
+                                  output in [default: temporary directory,
+                                  removed on completion]
+  --mnv-encoding [incremental|compact]
+                                  Encoding of the per base values of merged
+                                  MNVs. incremental adds KEY_1..KEY_n INFO and
+                                  FORMAT fields, with header lines for the
+                                  longest MNV. compact lists the values under
+                                  the original keys, with a fixed size header
+                                  [default: incremental]
   --help                          Show this message and exit.
 """
 
+EXP_BATCH_HELP = """Usage: cli batch [OPTIONS]
+
+  Merge or phase and merge MNVs for every sample of a manifest in a single
+  process
+
+Options:
+  --version                    Show the version and exit.
+  -m, --manifest FILE          TSV (with a header line) or JSON manifest of
+                               samples, fields sample, vcfin and output and
+                               optionally smart_phased_output, phase_cmd, bed,
+                               cutoff, exclude, markhz, mnv_encoding and
+                               workdir. Samples with a smart_phased_output are
+                               merged as merge-mnvs, others are run as phase-
+                               pipeline  [required]
+  --phase-cmd TEXT             Phasing command for samples without a
+                               smart_phased_output or phase_cmd, as phase-
+                               pipeline --phase-cmd. {sample} is replaced by the
+                               sample name
+  -t, --workers INTEGER RANGE  Number of worker processes running the Python
+                               stages of samples  [default: 1; x>=1]
+  --phase-jobs INTEGER RANGE   Number of phasing commands run at a time,
+                               overlapped with the Python stages [default:
+                               --workers]  [x>=1]
+  -w, --workdir DIRECTORY      Directory to keep the candidate bed and phased
+                               output of each sample in, in a directory per
+                               sample [default: temporary directories, removed
+                               on completion]
+  --report FILE                Path to write the status and stage timings of
+                               each sample, JSON if ending .json, else TSV
+                               [default: batch_report.tsv]
+  --help                       Show this message and exit.
+"""
+
 runner = CliRunner()
 
 
@@ -112,3 +299,30 @@ def test_merge_mnvs():
     response = runner.invoke(cli, ["merge-mnvs", "--help"])
     assert response.output == EXP_MERGE_MNV_HELP
     assert response.exit_code == 0
+
+
+def test_phase_pipeline():
+    response = runner.invoke(cli, ["phase-pipeline", "--help"])
+    assert response.output == EXP_PHASE_PIPELINE_HELP
+    assert response.exit_code == 0
+
+
+def test_batch():
+    response = runner.invoke(cli, ["batch", "--help"])
+    assert response.output == EXP_BATCH_HELP
+    assert response.exit_code == 0
+
+
+@pytest.mark.parametrize(
+    "mnv_encoding,exp_arg_str",
+    [
+        ("incremental", "vcfin=test_input.vcf.gz,cutoff=0.5"),
+        ("compact", "vcfin=test_input.vcf.gz,cutoff=0.5,mnv_encoding=compact"),
+    ],
+)
+def test_generate_arg_string_mnv_encoding(mnv_encoding, exp_arg_str):
+    # The default encoding isn't recorded, as in the headers of earlier versions
+    arg_str = generate_arg_string(
+        vcfin=INPUT_VCF, cutoff=0.5, mnv_encoding=mnv_encoding, threads=4
+    )
+    assert arg_str == exp_arg_str
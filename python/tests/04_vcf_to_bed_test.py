@@ -35,6 +35,7 @@ import os
 import sys
 
 import pytest
+import vcfpy
 from casmsmartphase import vcf_to_bed
 
 TEST_INPUT = "test_data/test_input.vcf.gz"
@@ -80,3 +81,87 @@ def test_vcf_to_bed_run(input, output, markhom, exp_out):
     vcf_to_bed.run_parse(input, output, markhom)
     compare_files(exp_out, output)
     os.remove(output)
+
+
+@pytest.mark.parametrize("input", [TEST_INPUT, TEST_INPUT_HOM])
+def test_scan_sites_matches_vcfpy(input):
+    reader = vcfpy.Reader.from_path(input)
+    exp_blocks = list(vcf_to_bed.iter_candidate_blocks(reader))
+    (header, sites) = vcf_to_bed.scan_sites(input)
+    assert header.samples.names == reader.header.samples.names
+    assert list(vcf_to_bed.iter_blocks(sites)) == exp_blocks
+
+
+def test_iter_blocks():
+    sites = [
+        ("chr1", 10, True),
+        ("chr1", 11, True),
+        ("chr1", 12, False),
+        ("chr1", 13, False),
+        ("chr1", 14, False),
+        ("chr1", 16, True),
+        ("chr2", 17, True),
+        ("chr2", 18, True),
+    ]
+    assert list(vcf_to_bed.iter_blocks(sites)) == [
+        ("chr1", 9, 11, True),
+        ("chr1", 11, 14, False),
+        ("chr2", 16, 18, True),
+    ]
+
+
+def test_iter_sample_blocks_matches_iter_blocks():
+    sites = [
+        ("chr1", 10, (True, False)),
+        ("chr1", 11, (True, False)),
+        ("chr1", 12, (False, False)),
+        ("chr1", 13, (False, True)),
+        ("chr1", 14, (False, True)),
+        ("chr1", 16, (True, True)),
+        ("chr1", 20, (True, False)),
+        ("chr2", 17, (True, True)),
+        ("chr2", 18, (True, True)),
+    ]
+    records = [
+        (
+            contig,
+            pos,
+            [contig, str(pos)]
+            + ["."] * 6
+            + ["GT"]
+            + ["0|1" if het else "1|1" for het in hets],
+        )
+        for (contig, pos, hets) in sites
+    ]
+    blocks = list(vcf_to_bed.iter_sample_blocks(records, [1, 0]))
+    for (index, sample) in ((0, 1), (1, 0)):
+        assert [block for (i, block) in blocks if i == index] == list(
+            vcf_to_bed.iter_blocks(
+                (contig, pos, hets[sample]) for (contig, pos, hets) in sites
+            )
+        )
+
+
+@pytest.mark.parametrize("input", [TEST_INPUT, TEST_INPUT_HOM])
+def test_run_parse_samples_in_one_pass(tmp_path, input):
+    output = str(tmp_path / "{sample}.bed")
+    vcf_to_bed.run_parse(input, output, True, sample=("all",))
+    for sample in ("NORMAL", "TUMOUR"):
+        single = str(tmp_path / f"single.{sample}.bed")
+        vcf_to_bed.run_parse(input, single, True, sample=(sample,))
+        compare_files(single, output.replace("{sample}", sample))
+
+
+@pytest.mark.parametrize(
+    "output,sample,columnar,message",
+    [
+        ("out.bed", ("NORMAL", "TUMOUR"), False, "Output must include"),
+        ("{sample}.bed", ("TUMOUR", "MISSING"), False, "Sample MISSING not found"),
+        ("{sample}.bed", ("all",), True, "--columnar scans a single sample"),
+    ],
+)
+def test_run_parse_samples_invalid(tmp_path, output, sample, columnar, message):
+    with pytest.raises(ValueError, match=message):
+        vcf_to_bed.run_parse(
+            TEST_INPUT, str(tmp_path / output), False, columnar=columnar, sample=sample
+        )
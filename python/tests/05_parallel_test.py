@@ -0,0 +1,138 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the parallel module
+"""
+import gzip
+
+import pysam
+import pytest
+from casmsmartphase import parallel
+from casmsmartphase.MNVMerge import MNVMerge
+
+INPUT_VCF = "test_data/test_input.vcf.gz"
+RUN_SCRIPT = "pytest_parallel"
+ARG_STR = "x=test_Arg_str"
+CUTOFF = 0.0
+EXCLUDE = 2
+# Runs of adjacent SNVs (contig, first position, length)
+SNV_RUNS = [
+    ("chr1", 1000, 1),
+    ("chr1", 2000, 2),
+    ("chr1", 2999, 3),
+    ("chr1", 5000, 4),
+    ("chr2", 100, 2),
+    ("chr2", 40000, 1),
+    ("chrM", 500, 3),
+]
+
+
+def write_test_data(tmp_path):
+    """
+    Write a bgzipped, tabix indexed VCF of SNV_RUNS and a smart-phase output
+    phasing each run as cis
+    """
+    with gzip.open(INPUT_VCF, "rt") as vcf:
+        lines = vcf.readlines()
+    header = [line for line in lines if line.startswith("#")]
+    template = [line for line in lines if not line.startswith("#")][0].split("\t")
+    vcf_path = str(tmp_path / "input.vcf")
+    with open(vcf_path, "w") as out:
+        out.writelines(header)
+        for (contig, start, length) in SNV_RUNS:
+            for pos in range(start, start + length):
+                out.write(
+                    "\t".join([contig, str(pos), f"id{contig}_{pos}"] + template[3:])
+                )
+    pysam.tabix_index(vcf_path, preset="vcf", force=True)
+    spout = str(tmp_path / "sample.phased.output")
+    with open(spout, "w") as out:
+        for (contig, start, length) in SNV_RUNS:
+            for pos in range(start, start + length - 1):
+                out.write(
+                    f"1-{start}-{start + length}\t{contig}-{pos}-G-A\t{contig}-{pos + 1}-G-A\t1\t0.5\n"
+                )
+        out.write("Denovo count: 0\n")
+    return vcf_path + ".gz", spout
+
+
+@pytest.mark.parametrize(
+    "boundary,exp_boundary",
+    [
+        (10, 10),
+        (20, 22),
+        (22, 22),
+        (30, 31),
+        (31, 31),
+    ],
+)
+def test_shift_boundary(boundary, exp_boundary):
+    assert parallel.shift_boundary(boundary, [19, 29], [22, 31]) == exp_boundary
+
+
+def test_plan_windows():
+    windows = parallel.plan_windows(
+        ["chr1", "chr2", "chrX"],
+        {"chr1": 100, "chr2": 50},
+        {"chr1": {49: 52}},
+        3,
+    )
+    assert windows == [
+        ("chr1", 0, 52),
+        ("chr1", 52, None),
+        ("chr2", 0, None),
+        ("chrX", 0, None),
+    ]
+
+
+@pytest.mark.parametrize("windows_per_worker", [1, 8, 100000])
+def test_merge_windows_matches_serial(tmp_path, monkeypatch, windows_per_worker):
+    monkeypatch.setattr(parallel, "WINDOWS_PER_WORKER", windows_per_worker)
+    (vcf_path, spout) = write_test_data(tmp_path)
+    outputs = []
+    for threads in (1, 2):
+        output = str(tmp_path / f"output.{threads}.vcf")
+        merge_obj = MNVMerge(
+            vcf_path,
+            output,
+            spout,
+            CUTOFF,
+            EXCLUDE,
+            RUN_SCRIPT,
+            ARG_STR,
+            threads=threads,
+        )
+        merge_obj.perform_mnv_merge_to_vcf()
+        with open(output, "rb") as out:
+            outputs.append(out.read())
+    assert outputs[0] == outputs[1]
+    # One record per SNV run, each run of adjacent SNVs is merged
+    assert outputs[0].count(b"\nchr") == len(SNV_RUNS)
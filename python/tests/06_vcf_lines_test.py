@@ -0,0 +1,89 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the vcf_lines module
+"""
+import pytest
+import vcfpy
+from casmsmartphase.vcf_lines import gt_is_het
+from casmsmartphase.vcf_lines import iter_zygosity
+from casmsmartphase.vcf_lines import open_vcf_records
+from casmsmartphase.vcf_lines import split_chrom_pos
+
+INPUT_VCF = "test_data/test_input.vcf.gz"
+EXP_RES_VCF = "test_data/test_exp_result.vcf"
+
+
+@pytest.mark.parametrize("vcf,exp_count", [(INPUT_VCF, 8), (EXP_RES_VCF, 7)])
+def test_open_vcf_records(vcf, exp_count):
+    (reader, stream) = open_vcf_records(vcf)
+    lines = list(stream)
+    stream.close()
+    assert reader.header.samples.names == ["NORMAL", "TUMOUR"]
+    assert len(lines) == exp_count
+    assert lines[0].startswith("chr1\t1291220\t")
+    assert reader.parser.parse_line(lines[0]).POS == 1291220
+
+
+@pytest.mark.parametrize(
+    "line,exp_result",
+    [
+        ("chr1\t1291220\tid\tG\tA\n", ("chr1", 1291220)),
+        ("X\t5\t.", ("X", 5)),
+    ],
+)
+def test_split_chrom_pos(line, exp_result):
+    assert split_chrom_pos(line) == exp_result
+
+
+@pytest.mark.parametrize(
+    "gt", ["0/1", "0|1", "1|2", "0/0", "1|1", "2/2", "./1", "./.", ".", "1", "0/1/1"]
+)
+def test_gt_is_het(gt):
+    call = vcfpy.Call("TUMOUR", {"GT": gt})
+    assert gt_is_het(gt) == call.is_het
+
+
+def test_iter_zygosity():
+    lines = [
+        "chr1\t10\t.\tG\tA\t.\t.\t.\tGT:PM\t0|0:0\t0|1:0.5\n",
+        "chr1\t11\t.\tG\tA\t.\t.\t.\tPM:GT\t0:0|0\t1.0:1|1\n",
+        "chr1\t12\t.\tG\tA\t.\t.\t.\tPM:GT\t0:0|0\t0.5:1|0\n",
+        "chr2\t5\t.\tG\tA\t.\t.\t.\tPM\t0\t0.5\n",
+        "chr2\t6\t.\tG\tA\t.\t.\t.\tPM:GT\t0:0|0\t0.5\n",
+    ]
+    assert list(iter_zygosity(lines, 1)) == [
+        ("chr1", 10, True),
+        ("chr1", 11, False),
+        ("chr1", 12, True),
+        ("chr2", 5, False),
+        ("chr2", 6, False),
+    ]
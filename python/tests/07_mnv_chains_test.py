@@ -0,0 +1,130 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the mnv_chains module
+"""
+import time
+
+import pytest
+from casmsmartphase.mnv_chains import ContigMNVs
+from casmsmartphase.mnv_chains import MNVChainBuilder
+from casmsmartphase.MNVMerge import parse_sphase_output
+
+
+@pytest.mark.parametrize(
+    "pairs,blocks,exp_result",
+    [
+        ([], [], ({}, 1)),
+        # In order
+        (
+            [("chr1", 10, 11), ("chr1", 11, 12), ("chr1", 20, 21)],
+            [],
+            ({"chr1": {10: 12, 20: 21}}, 3),
+        ),
+        # Out of order, joining two existing chains
+        (
+            [("chr1", 12, 13), ("chr1", 10, 11), ("chr1", 11, 12)],
+            [],
+            ({"chr1": {10: 13}}, 4),
+        ),
+        # Repeated pairs across smart-phase regions
+        (
+            [
+                ("chr1", 10, 11),
+                ("chr1", 11, 12),
+                ("chr1", 12, 13),
+                ("chr1", 11, 12),
+                ("chr1", 10, 11),
+            ],
+            [],
+            ({"chr1": {10: 13}}, 4),
+        ),
+        # Blocks replace chains with the same start
+        (
+            [("chr1", 10, 11), ("chr2", 5, 6)],
+            [("chr1", 10, 14), ("chr3", 1, 2)],
+            ({"chr1": {10: 14}, "chr2": {5: 6}, "chr3": {1: 2}}, 5),
+        ),
+    ],
+)
+def test_mnv_chain_builder(pairs, blocks, exp_result):
+    builder = MNVChainBuilder()
+    for pair in pairs:
+        builder.add_pair(*pair)
+    for block in blocks:
+        builder.add_block(*block)
+    assert builder.build() == exp_result
+
+
+def test_contig_mnvs():
+    mnvs = ContigMNVs.from_dict({30: 32, 10: 11})
+    assert list(mnvs.starts) == [10, 30]
+    assert list(mnvs.ends) == [11, 32]
+    assert 10 in mnvs
+    assert 11 not in mnvs
+    assert mnvs[30] == 32
+    assert mnvs.get(31) is None
+    assert len(mnvs) == 2
+    assert mnvs == {10: 11, 30: 32}
+    assert mnvs.max_length() == 3
+    assert ContigMNVs.from_dict({}).max_length() == 0
+    with pytest.raises(KeyError):
+        mnvs[5]
+
+
+def time_parse_sphase_output(tmp_path, n_pairs):
+    """
+    Time parsing n_pairs phased pairs, half of them forming separate two base
+    MNVs and half forming a single long chain
+    """
+    spout = tmp_path / f"{n_pairs}.phased.output"
+    with open(spout, "w") as out:
+        for i in range(n_pairs // 2):
+            pos = 10 * i
+            out.write(f"1-1-2\tchr1-{pos}-G-A\tchr1-{pos + 1}-G-A\t1\t0.5\n")
+        for pos in range(n_pairs // 2):
+            out.write(f"1-1-2\tchr2-{pos}-G-A\tchr2-{pos + 1}-G-A\t1\t0.5\n")
+    # Best of several runs, to reduce noise
+    timings = []
+    for _ in range(3):
+        start = time.perf_counter()
+        (mnvs, max_len) = parse_sphase_output(str(spout), 0.0, 2, {})
+        timings.append(time.perf_counter() - start)
+    assert len(mnvs["chr1"]) == n_pairs // 2
+    assert max_len == n_pairs // 2 + 1
+    return min(timings)
+
+
+def test_parse_sphase_output_scales_linearly(tmp_path):
+    small = time_parse_sphase_output(tmp_path, 5000)
+    large = time_parse_sphase_output(tmp_path, 50000)
+    # Linear growth gives a ratio of ~10, quadratic ~100
+    assert large / small < 30
@@ -0,0 +1,157 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the streaming module
+"""
+import pytest
+from casmsmartphase.MNVMerge import MNVMerge
+from casmsmartphase.streaming import check_sorted
+from casmsmartphase.streaming import ContigOrder
+from casmsmartphase.streaming import iter_chains
+from casmsmartphase.streaming import merge_blocks
+from casmsmartphase.streaming import SortedMNVStream
+
+RUN_SCRIPT = "pytest_streaming"
+ARG_STR = "x=test_Arg_str"
+CUTOFF = 0.0
+EXCLUDE = 2
+ORDER = ["chr1", "chr2", "chr3"]
+
+
+def test_check_sorted():
+    intervals = [("chr1", 5, 6), ("chr1", 5, 6), ("chr3", 1, 2)]
+    assert list(check_sorted(intervals, ContigOrder(ORDER), "test")) == intervals
+    with pytest.raises(ValueError, match="test is not sorted.*chr2:1 follows chr3:1"):
+        list(check_sorted([("chr3", 1, 2), ("chr2", 1, 2)], ContigOrder(ORDER), "test"))
+    with pytest.raises(ValueError, match="chr1:4 follows chr1:5"):
+        list(check_sorted([("chr1", 5, 6), ("chr1", 4, 5)], ContigOrder(ORDER), "test"))
+
+
+def test_iter_chains():
+    pairs = [
+        ("chr1", 10, 11),
+        ("chr1", 11, 12),
+        ("chr1", 11, 12),
+        ("chr1", 12, 13),
+        ("chr1", 20, 21),
+        ("chr2", 21, 22),
+    ]
+    assert list(iter_chains(pairs)) == [
+        ("chr1", 10, 13),
+        ("chr1", 20, 21),
+        ("chr2", 21, 22),
+    ]
+
+
+def test_merge_blocks():
+    chains = [("chr1", 10, 11), ("chr1", 20, 21), ("chr3", 1, 2)]
+    blocks = [("chr1", 10, 12), ("chr2", 5, 6)]
+    assert list(merge_blocks(chains, blocks, ContigOrder(ORDER))) == [
+        ("chr1", 10, 12),
+        ("chr1", 20, 21),
+        ("chr2", 5, 6),
+        ("chr3", 1, 2),
+    ]
+
+
+def test_sorted_mnv_stream():
+    mnvs = SortedMNVStream(
+        [("chr1", 10, 11), ("chr2", 5, 7), ("chr3", 1, 2)], ContigOrder(ORDER)
+    )
+    contig_mnvs = mnvs.get("chr1")
+    assert 9 not in contig_mnvs
+    assert 10 in contig_mnvs
+    assert contig_mnvs[10] == 11
+    assert mnvs.get("chr1") is not None
+    assert 12 not in contig_mnvs
+    # No MNVs left on chr1
+    assert mnvs.get("chr1") is None
+    # chr2 MNV is dropped as there were no chr2 records
+    assert mnvs.get("chr3")[1] == 2
+    with pytest.raises(ValueError, match="VCF is not sorted"):
+        mnvs.get("chr2")
+
+
+@pytest.mark.parametrize(
+    "invcf,spout,bed",
+    [
+        ("test_data/test_input.vcf.gz", "test_data/sample.phased.output", None),
+        (
+            "test_data/test_input_trinuc.vcf.gz",
+            "test_data/sample.phased.trinuc.output",
+            None,
+        ),
+        (
+            "test_data/test_input_hethom.vcf.gz",
+            "test_data/sample.phased.output",
+            "test_data/expected_output_hethom.bed",
+        ),
+    ],
+)
+def test_streaming_merge_matches_in_memory(tmp_path, invcf, spout, bed):
+    outputs = []
+    for streaming in (False, True):
+        output = str(tmp_path / f"output.{streaming}.vcf")
+        merge_obj = MNVMerge(
+            invcf,
+            output,
+            spout,
+            CUTOFF,
+            EXCLUDE,
+            RUN_SCRIPT,
+            ARG_STR,
+            bed,
+            streaming=streaming,
+        )
+        merge_obj.perform_mnv_merge_to_vcf()
+        with open(output) as out:
+            outputs.append(out.read())
+    assert outputs[0] == outputs[1]
+
+
+def test_streaming_merge_unsorted(tmp_path):
+    spout = tmp_path / "unsorted.phased.output"
+    spout.write_text(
+        "3-1-2\tchr3-45636146-C-G\tchr3-45636147-A-C\t1\t0.5\n"
+        "1-1-2\tchr1-1627262-G-A\tchr1-1627263-G-A\t1\t0.5\n"
+    )
+    merge_obj = MNVMerge(
+        "test_data/test_input_hethom.vcf.gz",
+        str(tmp_path / "output.vcf"),
+        str(spout),
+        CUTOFF,
+        EXCLUDE,
+        RUN_SCRIPT,
+        ARG_STR,
+        streaming=True,
+    )
+    with pytest.raises(ValueError, match="smart-phase output is not sorted"):
+        merge_obj.perform_mnv_merge_to_vcf()
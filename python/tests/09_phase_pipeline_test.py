@@ -0,0 +1,132 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the phase_pipeline module
+"""
+import sys
+
+import pytest
+from casmsmartphase import phase_pipeline
+from casmsmartphase.MNVMerge import MNVMerge
+
+INPUT_VCF = "test_data/test_input_hethom.vcf.gz"
+BED_INPUT_HOM = "test_data/expected_output_hethom.bed"
+RUN_SCRIPT = "pytest_phase_pipeline"
+ARG_STR = "x=test_Arg_str"
+CUTOFF = 0.0
+EXCLUDE = 2
+# Stands in for smart-phase, phasing every adjacent pair in the
+# heterozygous candidate blocks as cis
+STUB_PHASER = """
+import sys
+(bed, output) = sys.argv[1:]
+with open(bed) as bedin, open(output, "w") as out:
+    for line in bedin:
+        fields = line.rstrip().split("\\t")
+        if len(fields) > 3:
+            continue
+        (contig, start, end) = (fields[0], int(fields[1]), int(fields[2]))
+        for pos in range(start + 1, end):
+            print(
+                f"1-{start}-{end}", f"{contig}-{pos}-N-N", f"{contig}-{pos + 1}-N-N",
+                1, 0.9, sep="\\t", file=out,
+            )
+    print("Denovo count: 0", file=out)
+"""
+
+
+def read_records(vcf):
+    with open(vcf) as vcfin:
+        return [line for line in vcfin if not line.startswith("##vcfProcessLog")]
+
+
+@pytest.mark.parametrize("markhz", [False, True])
+def test_phase_pipeline_run(tmp_path, markhz):
+    stub = tmp_path / "stub_phaser.py"
+    stub.write_text(STUB_PHASER)
+    workdir = tmp_path / "work"
+    output = str(tmp_path / "pipeline.vcf")
+    phase_pipeline.run(
+        INPUT_VCF,
+        output,
+        f"{sys.executable} {stub} {{bed}} {{output}}",
+        CUTOFF,
+        EXCLUDE,
+        markhz,
+        ARG_STR,
+        str(workdir),
+    )
+    # Same as running the merge-mnvs stage on the bed and phased output
+    exp_output = str(tmp_path / "exp.vcf")
+    MNVMerge(
+        INPUT_VCF,
+        exp_output,
+        str(workdir / phase_pipeline.PHASED_NAME),
+        CUTOFF,
+        EXCLUDE,
+        RUN_SCRIPT,
+        ARG_STR,
+        str(workdir / phase_pipeline.BED_NAME) if markhz else None,
+    ).perform_mnv_merge_to_vcf()
+    assert read_records(output) == read_records(exp_output)
+    if markhz:
+        with open(str(workdir / phase_pipeline.BED_NAME)) as bed:
+            with open(BED_INPUT_HOM) as exp_bed:
+                assert bed.read() == exp_bed.read()
+    # Each of the three candidate blocks is merged, the homozygous blocks
+    # by the stub phaser if unmarked, otherwise from the in memory blocks
+    records = [line.split("\t") for line in read_records(output) if line[0] != "#"]
+    assert [record[1] for record in records if ";" in record[2]] == [
+        "1627262",
+        "1866692",
+        "45636146",
+    ]
+
+
+def test_get_hom_blocks():
+    blocks = [("chr1", 10, 12, True), ("chr1", 20, 22, False), ("chr2", 5, 8, False)]
+    assert phase_pipeline.get_hom_blocks(blocks) == {
+        "chr1": [(21, 22, True)],
+        "chr2": [(6, 8, True)],
+    }
+
+
+def test_phase_pipeline_phasing_fails(tmp_path):
+    with pytest.raises(Exception):
+        phase_pipeline.run(
+            INPUT_VCF,
+            str(tmp_path / "pipeline.vcf"),
+            f"{sys.executable} -c 'import sys; sys.exit(1)'",
+            CUTOFF,
+            EXCLUDE,
+            False,
+            ARG_STR,
+        )
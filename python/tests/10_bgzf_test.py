@@ -0,0 +1,174 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the bgzf module
+"""
+import gzip
+import random
+
+import pysam
+import pytest
+from casmsmartphase import bgzf
+from casmsmartphase import vcf_to_bed
+from casmsmartphase.MNVMerge import MNVMerge
+
+INPUT_VCF = "test_data/test_input.vcf.gz"
+INPUT_SPHASE = "test_data/sample.phased.output"
+VCF_HEADER = "##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+CONTIGS = ["chr1", "chr2", "chrX"]
+
+
+def random_records(n_per_contig):
+    """
+    Sorted VCF records with gaps spanning index windows and bins
+    """
+    rng = random.Random(1)
+    records = []
+    for contig in CONTIGS:
+        pos = 0
+        for _ in range(n_per_contig):
+            pos += rng.choice([1, 2, 50, 1000, 20000])
+            ref = "G" * rng.choice([1, 1, 2, 3, 40])
+            records.append((contig, pos, ref))
+    return records
+
+
+@pytest.mark.parametrize(
+    "beg,end,exp_bin",
+    [
+        (0, 1, 4681),
+        (16383, 16385, 585),
+        (0, 1 << 29, 0),
+        ((1 << 29) - 1, 1 << 29, 37448),
+    ],
+)
+def test_reg2bin(beg, end, exp_bin):
+    assert bgzf.reg2bin(beg, end, bgzf.MIN_SHIFT, 5) == exp_bin
+    assert bgzf.bin_first_pos(exp_bin, bgzf.MIN_SHIFT, 5) <= beg
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_bgzf_writer_round_trip(tmp_path, threads):
+    path = str(tmp_path / "out.txt.gz")
+    text = "".join(f"line {i}\n" for i in range(50000))
+    with bgzf.BgzfWriter(path, threads=threads) as out:
+        out.write(text[:7])
+        out.write(text[7:])
+    with gzip.open(path, "rt") as infile:
+        assert infile.read() == text
+    with open(path, "rb") as infile:
+        assert infile.read()[-28:] == bgzf.EOF_BLOCK
+
+
+@pytest.mark.parametrize("index_format", bgzf.INDEX_FORMATS)
+@pytest.mark.parametrize("threads", [1, 3])
+def test_index_matches_records(tmp_path, index_format, threads):
+    path = str(tmp_path / "out.vcf.gz")
+    records = random_records(20000)
+    with bgzf.open_output(path, bgzf.TBX_VCF, 6, threads, index_format) as out:
+        out.write(VCF_HEADER)
+        for (contig, pos, ref) in records:
+            out.write(f"{contig}\t{pos}\t.\t{ref}\tA\t.\tPASS\t.\n")
+    rng = random.Random(2)
+    with pysam.TabixFile(path, index=f"{path}.{index_format}") as tabix:
+        for _ in range(100):
+            contig = rng.choice(CONTIGS)
+            start = rng.randint(0, records[-1][1])
+            end = start + rng.choice([1, 100, 100000, 10000000])
+            exp = [
+                (pos, ref)
+                for (rec_contig, pos, ref) in records
+                if rec_contig == contig and pos - 1 < end and pos - 1 + len(ref) > start
+            ]
+            got = [
+                (int(line.split("\t")[1]), line.split("\t")[3])
+                for line in tabix.fetch(contig, start, end)
+            ]
+            assert got == exp
+
+
+@pytest.mark.parametrize("index_format", bgzf.INDEX_FORMATS)
+def test_index_of_empty_output(tmp_path, index_format):
+    path = str(tmp_path / "out.vcf.gz")
+    with bgzf.open_output(path, bgzf.TBX_VCF, 6, 1, index_format) as out:
+        out.write(VCF_HEADER)
+    with pysam.TabixFile(path, index=f"{path}.{index_format}") as tabix:
+        assert list(tabix.contigs) == []
+        assert list(tabix.header) == VCF_HEADER.splitlines()
+        with pytest.raises(ValueError):
+            tabix.fetch("chr1")
+
+
+def test_index_rejects_large_positions():
+    indexer = bgzf.TabixIndexer(bgzf.TBX_BED, "tbi")
+    with pytest.raises(ValueError, match="too large for a tbi index"):
+        indexer.add_line(f"chr1\t{1 << 29}\t{(1 << 29) + 2}\n", 0, 10)
+    bgzf.TabixIndexer(bgzf.TBX_BED, "csi").add_line(
+        f"chr1\t{1 << 29}\t{(1 << 29) + 2}\n", 0, 10
+    )
+
+
+def test_merge_mnvs_bgzipped_output(tmp_path):
+    outputs = {}
+    for name in ("out.vcf", "out.vcf.gz"):
+        outputs[name] = str(tmp_path / name)
+        merge_obj = MNVMerge(
+            INPUT_VCF,
+            outputs[name],
+            INPUT_SPHASE,
+            0.0,
+            2,
+            "pytest_bgzf",
+            "x=test_Arg_str",
+            compress_threads=2,
+        )
+        merge_obj.perform_mnv_merge_to_vcf()
+    with open(outputs["out.vcf"]) as plain, gzip.open(
+        outputs["out.vcf.gz"], "rt"
+    ) as gz:
+        plain_lines = plain.readlines()
+        assert gz.readlines() == plain_lines
+    records = [line.rstrip("\n") for line in plain_lines if not line.startswith("#")]
+    with pysam.TabixFile(outputs["out.vcf.gz"]) as tabix:
+        fetched = [line for contig in tabix.contigs for line in tabix.fetch(contig)]
+    assert fetched == records
+
+
+def test_generate_bed_bgzipped_output(tmp_path):
+    plain = str(tmp_path / "out.bed")
+    compressed = str(tmp_path / "out.bed.gz")
+    vcf_to_bed.run_parse(INPUT_VCF, plain, True)
+    vcf_to_bed.run_parse(INPUT_VCF, compressed, True, index_format="csi")
+    with open(plain) as bed:
+        lines = [line.rstrip("\n") for line in bed]
+    with pysam.TabixFile(compressed, index=compressed + ".csi") as tabix:
+        fetched = [line for contig in tabix.contigs for line in tabix.fetch(contig)]
+    assert fetched == lines
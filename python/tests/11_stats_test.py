@@ -0,0 +1,118 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the stats module and the statistics of merge-mnvs and generate-bed
+"""
+import io
+import json
+
+from casmsmartphase import merge_mnv_to_vcf
+from casmsmartphase import stats
+from casmsmartphase import vcf_to_bed
+
+TEST_INPUT = "test_data/test_input.vcf.gz"
+SMART_PHASE_OUTPUT = "test_data/sample.phased.output"
+
+
+def test_stage_records_and_time():
+    run_stats = stats.RunStats()
+    with run_stats.stage("parse") as stage:
+        stage.records = 10
+    result = run_stats.to_dict()["stages"]["parse"]
+    assert result["records"] == 10
+    assert result["wall_seconds"] >= 0
+    assert result["peak_rss_kb"]["self"] > 0
+
+
+def test_iter_tracked(monkeypatch):
+    monkeypatch.setattr(stats, "CHECK_EVERY", 3)
+    items = [("chr1", pos) for pos in range(1, 8)]
+    assert stats.iter_tracked(items, lambda item: item) is items
+    stage = stats.Stage("test")
+    out = io.StringIO()
+    progress = stats.Progress({"chr1": 100}, interval=0, stream=out)
+    tracked = stats.iter_tracked(items, lambda item: item, stage, progress)
+    assert list(tracked) == items
+    assert stage.records == 7
+    assert progress.records == 7
+    lines = out.getvalue().splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith("chr1:3 3 records")
+    assert " 6.0% ETA " in lines[1]
+
+
+def test_progress_unknown_contig():
+    progress = stats.Progress({"chr1": 100}, interval=0, stream=io.StringIO())
+    progress.records = 5
+    line = progress.format_line("chrUn", 10, progress.start + 1)
+    assert line == "chrUn:10 5 records (5/s)"
+
+
+def test_merge_stats_json(tmp_path, capsys):
+    stats_json = tmp_path / "stats.json"
+    merge_mnv_to_vcf.run(
+        TEST_INPUT,
+        str(tmp_path / "output.vcf"),
+        SMART_PHASE_OUTPUT,
+        0.0,
+        2,
+        "x=test_Arg_str",
+        stats_json=str(stats_json),
+        progress=True,
+    )
+    captured = capsys.readouterr()
+    # Nothing is printed to stdout, progress goes to stderr
+    assert captured.out == ""
+    assert captured.err.startswith("Done: 8 records")
+    result = json.loads(stats_json.read_text())
+    assert list(result["stages"]) == ["phased_parse", "header", "records", "write"]
+    assert result["stages"]["records"]["records"] == 8
+    assert result["counts"] == {
+        "mnvs_merged": 1,
+        "pairs_accepted": 1,
+        "pairs_filtered": 0,
+        "pairs_skipped": 0,
+        "records_copied": 6,
+    }
+    assert result["mnv_length_histogram"] == {"2": 1}
+
+
+def test_generate_bed_stats_json(tmp_path):
+    stats_json = tmp_path / "stats.json"
+    vcf_to_bed.run_parse(
+        TEST_INPUT, str(tmp_path / "output.bed"), True, stats_json=str(stats_json)
+    )
+    result = json.loads(stats_json.read_text())
+    assert list(result["stages"]) == ["records", "write"]
+    assert result["stages"]["records"]["records"] == 8
+    assert sum(result["mnv_length_histogram"].values()) == sum(
+        result["counts"].values()
+    )
@@ -0,0 +1,114 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the synthetic benchmark data generators and fake smart-phase
+"""
+import filecmp
+import subprocess
+import sys
+
+import synthetic_data
+from casmsmartphase import vcf_to_bed
+from casmsmartphase.MNVMerge import MNVMerge
+
+FAKE_SMART_PHASE = "benchmarks/fake_smart_phase.py"
+N_RECORDS = 3000
+
+
+def test_generate_dataset_is_deterministic(tmp_path):
+    (dir_a, dir_b) = (tmp_path / "a", tmp_path / "b")
+    dir_a.mkdir()
+    dir_b.mkdir()
+    data_a = synthetic_data.generate_dataset(str(dir_a), N_RECORDS, seed=3)
+    data_b = synthetic_data.generate_dataset(str(dir_b), N_RECORDS, seed=3)
+    assert data_a["blocks"] == data_b["blocks"]
+    for key in ("vcf", "smart_phase_output", "bed"):
+        assert filecmp.cmp(data_a[key], data_b[key], shallow=False)
+    assert abs(data_a["records"] - N_RECORDS) <= 5
+
+
+def test_generated_bed_matches_generate_bed(tmp_path):
+    data = synthetic_data.generate_dataset(
+        str(tmp_path), N_RECORDS, adjacent_fraction=0.5, hom_fraction=0.3
+    )
+    output = str(tmp_path / "generated.bed")
+    vcf_to_bed.run_parse(data["vcf_gz"], output, True)
+    assert filecmp.cmp(output, data["bed"], shallow=False)
+    assert any(not is_het for (*_pos, is_het, _trans) in data["blocks"])
+
+
+def test_merge_generated_data(tmp_path):
+    data = synthetic_data.generate_dataset(str(tmp_path), N_RECORDS)
+    output = str(tmp_path / "merged.vcf")
+    MNVMerge(
+        data["vcf"],
+        output,
+        data["smart_phase_output"],
+        0.0,
+        2,
+        "pytest_synthetic",
+        "x=test_Arg_str",
+        data["bed"],
+    ).perform_mnv_merge_to_vcf()
+    with open(output) as merged:
+        alts = [line.split("\t")[4] for line in merged if line[0] != "#"]
+    # Homozygous and cis heterozygous blocks are merged, trans are excluded
+    exp_mnvs = [
+        end - start
+        for (_contig, start, end, is_het, is_trans) in data["blocks"]
+        if not (is_het and is_trans)
+    ]
+    assert [len(alt) for alt in alts if len(alt) > 1] == exp_mnvs
+
+
+def test_fake_smart_phase(tmp_path):
+    data = synthetic_data.generate_dataset(str(tmp_path), N_RECORDS)
+    output = tmp_path / "fake.phased.output"
+    subprocess.run(
+        [
+            sys.executable,
+            FAKE_SMART_PHASE,
+            "-a",
+            data["vcf"],
+            "-g",
+            data["bed"],
+            "-o",
+            str(output),
+        ],
+        check=True,
+    )
+    exp = [
+        line
+        for block in data["blocks"]
+        if block[3]
+        for line in synthetic_data.sphase_lines(block[:4] + (False,))
+    ]
+    assert output.read_text() == "".join(exp) + "Denovo count: 0\n"
@@ -0,0 +1,122 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the columnar module
+"""
+import filecmp
+
+import numpy as np
+import pytest
+from casmsmartphase import columnar
+from casmsmartphase import vcf_to_bed
+from casmsmartphase.stats import RunStats
+from casmsmartphase.vcf_lines import ZygosityReader
+
+
+TEST_INPUT_HOM = "test_data/test_input_hethom.vcf.gz"
+EXP_OUTPUT_HOM = "test_data/expected_output_hethom.bed"
+SITES = [
+    ("chr1", 10, True),
+    ("chr1", 11, True),
+    ("chr1", 12, False),
+    ("chr1", 13, False),
+    ("chr1", 14, False),
+    ("chr1", 16, True),
+    ("chr2", 17, True),
+    ("chr2", 18, True),
+]
+
+
+def to_columns(sites, chunk_size):
+    for start in range(0, len(sites), chunk_size):
+        (contigs, positions, hets) = zip(*sites[start : start + chunk_size])
+        yield (np.array(contigs), np.array(positions), np.array(hets))
+
+
+def test_find_runs():
+    (starts, lengths) = columnar.find_runs(next(to_columns(SITES, len(SITES))))
+    assert starts.tolist() == [0, 2, 5, 6]
+    assert lengths.tolist() == [2, 3, 1, 2]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 100])
+def test_iter_blocks_columnar(chunk_size):
+    run_stats = RunStats()
+    blocks = columnar.iter_blocks_columnar(to_columns(SITES, chunk_size), run_stats)
+    assert list(blocks) == list(vcf_to_bed.iter_blocks(SITES))
+    assert run_stats.counts == {"het_blocks": 2, "hom_blocks": 1}
+    assert run_stats.mnv_lengths == {2: 2, 3: 1}
+
+
+def test_iter_blocks_columnar_empty():
+    assert list(columnar.iter_blocks_columnar([])) == []
+
+
+@pytest.mark.parametrize("chunk_bytes", [100, 10000, columnar.CHUNK_BYTES])
+def test_columnar_matches_iter_blocks(data, chunk_bytes):
+    (_header, sites) = vcf_to_bed.scan_sites(data["vcf"])
+    (_header, records, sample) = vcf_to_bed.open_sample_records(data["vcf"])
+    with records:
+        chunks = columnar.iter_columns(records, sample, chunk_bytes)
+        blocks = list(columnar.iter_blocks_columnar(chunks))
+    assert blocks == list(vcf_to_bed.iter_blocks(sites))
+
+
+@pytest.mark.parametrize(
+    "lines,regular",
+    [
+        (["chr1\t10\t.\tA\tC\t.\t.\t.\tGT:DP\t0/0:5\t0/1:7\n"], True),
+        (["chr1\t10\t.\tA\tC\t.\t.\t.\tGT\t0/0\t1|1\r\n"], True),
+        (["chr10\t12\t.\tA\tC\t.\t.\t.\tGT\t0/0\t./1"], True),
+        (["chr1\t10\t.\tA\tC\t.\t.\t.\tDP:GT\t5:0/0\t7:0/1\n"], False),
+        (["chr1\t+10\t.\tA\tC\t.\t.\t.\tGT\t0/0\t0/1\n"], False),
+        (["chr1\t10\t.\tA\tC\t.\t.\t.\tGT\t0/0\t0/1/2/3/4\n"], False),
+    ],
+)
+def test_parse_record_bytes(lines, regular):
+    lines = [
+        "chr1\t9\t.\tA\tC\t.\t.\t.\tGT\t0/0\t0/1\n",
+        "chr10\t11\t.\tA\tC\t.\t.\t.\tGT\t0/0\t0/1\n",
+    ] + lines
+    zygosity = ZygosityReader(1)
+    columns = columnar.parse_record_bytes("".join(lines).encode(), zygosity)
+    assert (columns is not None) == regular
+    (contigs, positions, hets) = next(columnar.iter_columns(lines, 1))
+    expected = columnar.parse_record_lines(lines, zygosity)
+    assert contigs.tolist() == expected[0].tolist()
+    assert positions.tolist() == expected[1].tolist()
+    assert hets.tolist() == expected[2].tolist()
+
+
+def test_run_parse_columnar(tmp_path):
+    output = str(tmp_path / "columnar.bed")
+    vcf_to_bed.run_parse(TEST_INPUT_HOM, output, True, columnar=True)
+    assert filecmp.cmp(output, EXP_OUTPUT_HOM, shallow=False)
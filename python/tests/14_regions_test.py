@@ -0,0 +1,236 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the regions and sphase_index modules
+"""
+import os
+import shutil
+
+import pytest
+from casmsmartphase import merge_mnv_to_vcf
+from casmsmartphase import regions
+from casmsmartphase import sphase_index
+from casmsmartphase import vcf_to_bed
+from casmsmartphase.cli import cli
+from click.testing import CliRunner
+
+
+CUTOFF = 0.0
+EXCLUDE = 2
+ARG_STR = "x=test_Arg_str"
+REGIONS = ("chr1:20000-60000", "chr2:5000-9000", "chrX")
+
+
+def record_lines(path):
+    with open(path) as out:
+        return [line for line in out if not line.startswith("#")]
+
+
+def in_regions(line, region_list):
+    (contig, pos) = line.split("\t")[:2]
+    return any(
+        contig == region_contig
+        and start < int(pos)
+        and (end is None or int(pos) <= end)
+        for (region_contig, start, end) in region_list
+    )
+
+
+@pytest.mark.parametrize(
+    "region,exp_region",
+    [
+        ("chr1", ("chr1", 0, None)),
+        ("chr1:100", ("chr1", 99, None)),
+        ("chr1:100-", ("chr1", 99, None)),
+        ("chr1:1,000-2,000", ("chr1", 999, 2000)),
+        ("chrUn_gl000220:5-5", ("chrUn_gl000220", 4, 5)),
+    ],
+)
+def test_parse_region(region, exp_region):
+    assert regions.parse_region(region) == exp_region
+
+
+@pytest.mark.parametrize("region", ["chr1:0-10", "chr1:20-10", "chr1:a-b", ""])
+def test_parse_region_invalid(region):
+    with pytest.raises(ValueError):
+        regions.parse_region(region)
+
+
+def test_normalise_regions():
+    normalised = regions.normalise_regions(
+        [
+            ("chr2", 10, 20),
+            ("chr1", 50, 60),
+            ("chr1", 0, 10),
+            ("chr1", 10, 15),
+            ("chr1", 55, None),
+            ("chr1", 70, 80),
+            ("chrUn", 0, 10),
+        ],
+        ["chr1", "chr2"],
+    )
+    assert normalised == [
+        ("chr1", 0, 15),
+        ("chr1", 50, None),
+        ("chr2", 10, 20),
+    ]
+
+
+def test_expand_to_mnvs():
+    mnvs = {"chr1": {10: 12, 20: 23, 40: 41}}
+    expanded = regions.expand_to_mnvs(
+        [("chr1", 10, 21), ("chr1", 40, None), ("chr2", 0, 5)], mnvs
+    )
+    assert expanded == [("chr1", 9, 23), ("chr1", 39, None), ("chr2", 0, 5)]
+
+
+def test_load_regions_requires_index(tmp_path):
+    assert regions.load_regions("test_data/test_input.vcf") is None
+    with pytest.raises(ValueError):
+        regions.load_regions("test_data/test_input.vcf", ("chr1",))
+
+
+@pytest.mark.parametrize("vcfin", ["-", "test_data/test_exp_result.vcf"])
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["generate-bed", "-o", "-", "-r", "chr1"],
+        ["merge-mnvs", "-p", "test_data/sample.phased.output", "-o", "-", "-r", "chr1"],
+    ],
+)
+def test_regions_unindexed_vcf(vcfin, args):
+    with open("test_data/test_exp_result.vcf") as vcf:
+        response = CliRunner().invoke(cli, args + ["-f", vcfin], input=vcf.read())
+    assert response.exit_code == 2
+    assert "indexed VCF" in response.output
+
+
+def test_read_regions_file(tmp_path):
+    bed = tmp_path / "regions.bed"
+    bed.write_text("track name=x\n# comment\nchr1\t10\t20\n\nchr2\t0\t5\n")
+    assert regions.read_regions_file(str(bed)) == [("chr1", 10, 20), ("chr2", 0, 5)]
+    bed.write_text("chr1\t10\n")
+    with pytest.raises(ValueError):
+        regions.read_regions_file(str(bed))
+
+
+def test_sphase_index(data, tmp_path, monkeypatch):
+    monkeypatch.setattr(sphase_index, "SEGMENT_LINES", 50)
+    # A copy, as the file is changed
+    sphaseout = str(tmp_path / "synthetic.phased.output")
+    shutil.copy(data["smart_phase_output"], sphaseout)
+    index_path = sphaseout + sphase_index.INDEX_EXTENSION
+    segments = sphase_index.load_index(sphaseout)
+    assert os.path.exists(index_path)
+    assert sphase_index.load_index(sphaseout) == segments
+    # The segments cover every phased pair line, in file order
+    with open(sphaseout, "rb") as sphase:
+        content = sphase.read()
+    covered = b"".join(
+        content[offset : offset + length] for (*_, offset, length) in segments
+    )
+    assert covered == content[: content.index(b"Denovo count")]
+    # A changed file makes the index stale
+    os.utime(sphaseout, ns=(0, 0))
+    assert (
+        sphase_index.read_index(index_path, sphase_index._source_id(sphaseout)) is None
+    )
+    assert sphase_index.load_index(sphaseout) == segments
+
+
+def test_iter_region_lines(data, monkeypatch):
+    monkeypatch.setattr(sphase_index, "SEGMENT_LINES", 50)
+    sphaseout = data["smart_phase_output"]
+    region_list = [("chr1", 20000, 30000), ("chrX", 0, None)]
+    lines = list(sphase_index.iter_region_lines(sphaseout, region_list))
+    with open(sphaseout) as sphase:
+        all_lines = [line for line in sphase if not line.startswith("Denovo")]
+    expected = [
+        line
+        for line in all_lines
+        if in_regions(line.split("\t")[1].replace("-", "\t", 2), region_list)
+    ]
+    assert set(expected) <= set(lines)
+    assert len(lines) < len(all_lines)
+
+
+def test_merge_regions_match_full_run(data, tmp_path):
+    full = str(tmp_path / "full.vcf")
+    subset = str(tmp_path / "subset.vcf")
+    for (output, region) in ((full, ()), (subset, REGIONS)):
+        merge_mnv_to_vcf.run(
+            data["vcf_gz"],
+            output,
+            data["smart_phase_output"],
+            CUTOFF,
+            EXCLUDE,
+            ARG_STR,
+            data["bed"],
+            region=region,
+        )
+    region_list = [regions.parse_region(region) for region in REGIONS]
+    full_lines = [line for line in record_lines(full) if in_regions(line, region_list)]
+    assert full_lines
+    assert record_lines(subset) == full_lines
+
+
+def test_generate_bed_regions(data, tmp_path):
+    regions_file = tmp_path / "regions.bed"
+    regions_file.write_text("chr1\t20000\t60000\nchr2\t5000\t9000\n")
+    output = str(tmp_path / "subset.bed")
+    vcf_to_bed.run_parse(
+        data["vcf_gz"],
+        output,
+        False,
+        6,
+        1,
+        "tbi",
+        region=("chrX",),
+        regions_file=str(regions_file),
+    )
+    full = str(tmp_path / "full.bed")
+    vcf_to_bed.run_parse(data["vcf_gz"], full, False, 6, 1, "tbi")
+    region_list = [("chr1", 20000, 60000), ("chr2", 5000, 9000), ("chrX", 0, None)]
+    with open(full) as bed:
+        exp_lines = [
+            line
+            for line in bed
+            if any(
+                line.split("\t")[0] == contig
+                and int(line.split("\t")[1]) >= start
+                and (end is None or int(line.split("\t")[2]) <= end)
+                for (contig, start, end) in region_list
+            )
+        ]
+    with open(output) as bed:
+        lines = bed.readlines()
+    assert exp_lines
+    assert set(exp_lines) <= set(lines)
@@ -0,0 +1,148 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of reading and writing through stdin, stdout and named pipes
+"""
+import gzip
+import os
+import threading
+
+import pytest
+from casmsmartphase import stdio
+from casmsmartphase.cli import cli
+from click.testing import CliRunner
+
+INPUT_VCF = "test_data/test_input.vcf.gz"
+SPHASE_OUT = "test_data/sample.phased.output"
+EXP_BED = "test_data/expected_output.bed"
+
+
+def records(text):
+    return [line for line in text.splitlines() if not line.startswith("#")]
+
+
+@pytest.fixture(scope="module")
+def exp_records(tmp_path_factory):
+    """
+    Records of merge-mnvs run on files
+    """
+    output = str(tmp_path_factory.mktemp("stdio") / "output.vcf")
+    response = CliRunner().invoke(
+        cli, ["merge-mnvs", "-f", INPUT_VCF, "-p", SPHASE_OUT, "-o", output]
+    )
+    assert response.exit_code == 0, response.output
+    with open(output) as vcf:
+        return records(vcf.read())
+
+
+@pytest.fixture
+def fifo(tmp_path):
+    path = str(tmp_path / "fifo")
+    os.mkfifo(path)
+    return path
+
+
+def feed_fifo(path, source):
+    """
+    Write source to a named pipe from a thread, as another process would
+    """
+
+    def write():
+        with open(source, "rb") as data, open(path, "wb") as out:
+            out.write(data.read())
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    return thread
+
+
+def test_is_stream(fifo):
+    assert stdio.is_stream("-")
+    assert stdio.is_stream(fifo)
+    assert not stdio.is_stream(SPHASE_OUT)
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_generate_bed_stdin_stdout(compress):
+    with gzip.open(INPUT_VCF, "rb") as vcf:
+        data = vcf.read()
+    if compress:
+        data = gzip.compress(data)
+    response = CliRunner().invoke(
+        cli, ["generate-bed", "-f", "-", "-o", "-"], input=data
+    )
+    assert response.exit_code == 0, response.output
+    with open(EXP_BED) as bed:
+        assert response.output == bed.read()
+
+
+def test_merge_mnvs_stdin_stdout(exp_records):
+    with gzip.open(INPUT_VCF, "rb") as vcf:
+        data = vcf.read()
+    response = CliRunner().invoke(
+        cli, ["merge-mnvs", "-f", "-", "-p", SPHASE_OUT, "-o", "-"], input=data
+    )
+    assert response.exit_code == 0, response.output
+    assert records(response.output) == exp_records
+
+
+def test_merge_mnvs_sphase_stdin(exp_records):
+    with open(SPHASE_OUT, "rb") as sphase:
+        data = sphase.read()
+    response = CliRunner().invoke(
+        cli, ["merge-mnvs", "-f", INPUT_VCF, "-p", "-", "-o", "-"], input=data
+    )
+    assert response.exit_code == 0, response.output
+    assert records(response.output) == exp_records
+
+
+@pytest.mark.parametrize("region", [[], ["-r", "chr1"]])
+def test_merge_mnvs_sphase_fifo(exp_records, fifo, region):
+    thread = feed_fifo(fifo, SPHASE_OUT)
+    response = CliRunner().invoke(
+        cli, ["merge-mnvs", "-f", INPUT_VCF, "-p", fifo, "-o", "-"] + region
+    )
+    thread.join()
+    assert response.exit_code == 0, response.output
+    assert records(response.output) == exp_records
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["merge-mnvs", "-f", "-", "-p", "-"],
+        ["merge-mnvs", "-f", INPUT_VCF, "-p", "-", "--streaming"],
+        ["phase-pipeline", "-f", "-", "--phase-cmd", "true"],
+    ],
+)
+def test_stdin_invalid(args):
+    response = CliRunner().invoke(cli, args, input="")
+    assert response.exit_code == 2
@@ -0,0 +1,237 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the batch module
+"""
+import csv
+import json
+import sys
+
+import pytest
+from casmsmartphase import batch
+from casmsmartphase import phase_pipeline
+from casmsmartphase.cli import cli
+from casmsmartphase.MNVMerge import MNVMerge
+from click.testing import CliRunner
+
+INPUT_VCF = "test_data/test_input.vcf.gz"
+HETHOM_VCF = "test_data/test_input_hethom.vcf.gz"
+TRINUC_VCF = "test_data/test_input_trinuc.vcf.gz"
+SPOUT = "test_data/sample.phased.output"
+SPOUT_TRINUC = "test_data/sample.phased.trinuc.output"
+CUTOFF = 0.0
+EXCLUDE = 2
+# Stands in for smart-phase, phasing every adjacent pair in the
+# heterozygous candidate blocks as cis
+STUB_PHASER = """
+import sys
+(bed, output) = sys.argv[1:]
+with open(bed) as bedin, open(output, "w") as out:
+    for line in bedin:
+        fields = line.rstrip().split("\\t")
+        if len(fields) > 3:
+            continue
+        (contig, start, end) = (fields[0], int(fields[1]), int(fields[2]))
+        for pos in range(start + 1, end):
+            print(
+                f"1-{start}-{end}", f"{contig}-{pos}-N-N", f"{contig}-{pos + 1}-N-N",
+                1, 0.9, sep="\\t", file=out,
+            )
+    print("Denovo count: 0", file=out)
+"""
+
+
+def write_tsv(path, rows):
+    fields = list(dict.fromkeys(key for row in rows for key in row))
+    with open(path, "w") as out:
+        writer = csv.DictWriter(out, fields, delimiter="\t", lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def read_records(vcf):
+    with open(vcf) as vcfin:
+        return [line for line in vcfin if not line.startswith("#")]
+
+
+@pytest.mark.parametrize("extension", [".tsv", ".json"])
+def test_read_manifest(tmp_path, extension):
+    rows = [
+        {
+            "sample": "a",
+            "vcfin": INPUT_VCF,
+            "output": "a.vcf",
+            "smart_phased_output": SPOUT,
+            "cutoff": "0.5",
+        },
+        {"sample": "b", "vcfin": HETHOM_VCF, "output": "b.vcf", "markhz": "true"},
+    ]
+    manifest = str(tmp_path / f"manifest{extension}")
+    if extension == ".json":
+        with open(manifest, "w") as out:
+            json.dump(rows, out)
+    else:
+        write_tsv(manifest, rows)
+    jobs = batch.read_manifest(manifest, "phaser {bed}", str(tmp_path))
+    assert jobs == [
+        {
+            "sample": "a",
+            "kind": "merge",
+            "params": {
+                "vcfin": INPUT_VCF,
+                "output": "a.vcf",
+                "smart_phased_output": SPOUT,
+                "cutoff": 0.5,
+                "exclude": 2,
+                "bed": None,
+                "mnv_encoding": "incremental",
+            },
+        },
+        {
+            "sample": "b",
+            "kind": "pipeline",
+            "params": {
+                "vcfin": HETHOM_VCF,
+                "output": "b.vcf",
+                "phase_cmd": "phaser {bed}",
+                "cutoff": 0.0,
+                "exclude": 2,
+                "markhz": True,
+                "mnv_encoding": "incremental",
+                "workdir": str(tmp_path / "b"),
+            },
+        },
+    ]
+
+
+@pytest.mark.parametrize(
+    "rows",
+    [
+        [{"sample": "a", "vcfin": INPUT_VCF, "output": "a.vcf", "threads": "2"}],
+        [{"sample": "a", "vcfin": INPUT_VCF, "smart_phased_output": SPOUT}],
+        [{"sample": "a", "vcfin": INPUT_VCF, "output": "a.vcf"}],
+        [
+            {"sample": "a", "vcfin": INPUT_VCF, "output": "a.vcf", "phase_cmd": "x"},
+            {"sample": "a", "vcfin": INPUT_VCF, "output": "b.vcf", "phase_cmd": "x"},
+        ],
+    ],
+)
+def test_read_manifest_invalid(tmp_path, rows):
+    manifest = str(tmp_path / "manifest.tsv")
+    write_tsv(manifest, rows)
+    with pytest.raises(ValueError):
+        batch.read_manifest(manifest)
+
+
+def test_batch_cli(tmp_path):
+    stub = tmp_path / "stub_phaser.py"
+    stub.write_text(STUB_PHASER)
+    rows = [
+        {
+            "sample": "merge",
+            "vcfin": INPUT_VCF,
+            "output": str(tmp_path / "merge.vcf"),
+            "smart_phased_output": SPOUT,
+        },
+        {
+            "sample": "trinuc",
+            "vcfin": TRINUC_VCF,
+            "output": str(tmp_path / "trinuc.vcf"),
+            "smart_phased_output": SPOUT_TRINUC,
+            "mnv_encoding": "compact",
+        },
+        {
+            "sample": "pipeline",
+            "vcfin": HETHOM_VCF,
+            "output": str(tmp_path / "pipeline.vcf"),
+            "markhz": "true",
+        },
+        {
+            "sample": "failed",
+            "vcfin": INPUT_VCF,
+            "output": str(tmp_path / "failed.vcf"),
+            "smart_phased_output": str(tmp_path / "missing.output"),
+        },
+    ]
+    manifest = str(tmp_path / "manifest.tsv")
+    write_tsv(manifest, rows)
+    report = str(tmp_path / "report.json")
+    response = CliRunner().invoke(
+        cli,
+        [
+            "batch",
+            "-m",
+            manifest,
+            "-t",
+            "2",
+            "--phase-cmd",
+            f"{sys.executable} {stub} {{bed}} {{output}}",
+            "--report",
+            report,
+        ],
+    )
+    assert response.exit_code == 1
+    assert "1 of 4 samples failed" in response.output
+    with open(report) as reportin:
+        results = {result["sample"]: result for result in json.load(reportin)}
+    assert [results[row["sample"]]["status"] for row in rows] == [
+        "ok",
+        "ok",
+        "ok",
+        "failed",
+    ]
+    assert results["failed"]["error"]
+    assert results["pipeline"]["phasing_seconds"] > 0
+    assert results["merge"]["phasing_seconds"] is None
+    # Each sample matches a run on its own
+    expected = tmp_path / "expected.vcf"
+    for row in rows[:2]:
+        MNVMerge(
+            row["vcfin"],
+            str(expected),
+            row["smart_phased_output"],
+            CUTOFF,
+            EXCLUDE,
+            "pytest_batch",
+            "",
+            mnv_encoding=row.get("mnv_encoding", "incremental"),
+        ).perform_mnv_merge_to_vcf()
+        assert read_records(row["output"]) == read_records(expected)
+    phase_pipeline.run(
+        HETHOM_VCF,
+        str(expected),
+        f"{sys.executable} {stub} {{bed}} {{output}}",
+        CUTOFF,
+        EXCLUDE,
+        True,
+        "",
+    )
+    assert read_records(rows[2]["output"]) == read_records(expected)
@@ -0,0 +1,145 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the mnv_cache module
+"""
+import os
+import shutil
+from collections import Counter
+
+from casmsmartphase import mnv_cache
+from casmsmartphase.MNVMerge import MNVMerge
+from casmsmartphase.MNVMerge import parse_homs_bed_to_dict
+from casmsmartphase.MNVMerge import parse_sphase_output
+
+INPUT_VCF = "test_data/test_input_hethom.vcf.gz"
+SPOUT = "test_data/sample.phased.output"
+BED_INPUT_HOM = "test_data/expected_output_hethom.bed"
+RUN_SCRIPT = "pytest_mnv_cache"
+ARG_STR = "x=test_Arg_str"
+CUTOFF = 0.0
+EXCLUDE = 2
+
+
+def merge(tmp_path, cache_dir, spout=SPOUT, cutoff=CUTOFF):
+    output = str(tmp_path / "output.vcf")
+    merge_obj = MNVMerge(
+        INPUT_VCF,
+        output,
+        spout,
+        cutoff,
+        EXCLUDE,
+        RUN_SCRIPT,
+        ARG_STR,
+        BED_INPUT_HOM,
+        cache_dir=cache_dir,
+    )
+    merge_obj.perform_mnv_merge_to_vcf()
+    with open(output) as vcf:
+        records = [line for line in vcf if not line.startswith("#")]
+    return merge_obj.stats, records
+
+
+def test_entry_round_trip(tmp_path):
+    counts = Counter(pairs_accepted=3, pairs_filtered=0)
+    (mnvs, max_len) = parse_sphase_output(
+        SPOUT, CUTOFF, EXCLUDE, parse_homs_bed_to_dict(BED_INPUT_HOM), counts
+    )
+    path = str(tmp_path / "entry.mnvcache")
+    mnv_cache.write_entry(path, mnvs, max_len, counts)
+    assert mnv_cache.read_entry(path) == (mnvs, max_len, counts)
+    # Only the entry is left behind
+    assert os.listdir(tmp_path) == ["entry.mnvcache"]
+
+
+def test_cache_key(tmp_path):
+    key = mnv_cache.cache_key(SPOUT, CUTOFF, EXCLUDE, BED_INPUT_HOM)
+    copy = str(tmp_path / "copy.output")
+    shutil.copy(SPOUT, copy)
+    # Keyed by content, not path
+    assert mnv_cache.cache_key(copy, CUTOFF, EXCLUDE, BED_INPUT_HOM) == key
+    assert mnv_cache.cache_key(SPOUT, 0.5, EXCLUDE, BED_INPUT_HOM) != key
+    assert mnv_cache.cache_key(SPOUT, CUTOFF, 0, BED_INPUT_HOM) != key
+    assert mnv_cache.cache_key(SPOUT, CUTOFF, EXCLUDE) != key
+    hom_blocks = parse_homs_bed_to_dict(BED_INPUT_HOM)
+    assert mnv_cache.cache_key(
+        SPOUT, CUTOFF, EXCLUDE, hom_blocks=hom_blocks
+    ) == mnv_cache.cache_key(SPOUT, CUTOFF, EXCLUDE, hom_blocks=dict(hom_blocks))
+    with open(copy, "a") as out:
+        out.write("\n")
+    assert mnv_cache.cache_key(copy, CUTOFF, EXCLUDE, BED_INPUT_HOM) != key
+
+
+def test_cache_hit_matches_parse(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    (stats, records) = merge(tmp_path, cache_dir)
+    assert stats.counts["cache_misses"] == 1
+    assert "phased_parse" in stats.stages
+    (cached_stats, cached_records) = merge(tmp_path, cache_dir)
+    assert cached_stats.counts["cache_hits"] == 1
+    assert "phased_parse" not in cached_stats.stages
+    assert "bed_parse" not in cached_stats.stages
+    assert cached_records == records
+    del stats.counts["cache_misses"]
+    del cached_stats.counts["cache_hits"]
+    assert cached_stats.counts == stats.counts
+    # A different cutoff is a new entry
+    (cutoff_stats, _records) = merge(tmp_path, cache_dir, cutoff=0.95)
+    assert cutoff_stats.counts["cache_misses"] == 1
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_unreadable_entry_ignored(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    (_stats, records) = merge(tmp_path, cache_dir)
+    (entry,) = os.listdir(cache_dir)
+    with open(os.path.join(cache_dir, entry), "r+b") as data:
+        data.truncate(data.seek(0, os.SEEK_END) - 8)
+    (stats, cached_records) = merge(tmp_path, cache_dir)
+    assert stats.counts["cache_misses"] == 1
+    assert cached_records == records
+
+
+def test_evict_least_recently_used(tmp_path):
+    (mnvs, max_len) = parse_sphase_output(SPOUT, CUTOFF, EXCLUDE, None)
+    cache_dir = str(tmp_path / "cache")
+    mnv_cache.write_entry(str(tmp_path / "entry"), mnvs, max_len, Counter())
+    size = os.path.getsize(tmp_path / "entry")
+    cache = mnv_cache.MNVCache(cache_dir, size * 3)
+    for (mtime, key) in enumerate(["a", "b", "c"]):
+        cache.put(key, mnvs, max_len, Counter())
+        os.utime(cache.path(key), ns=(mtime, mtime))
+    # Reading b makes a the least recently used
+    assert cache.get("b") is not None
+    cache.put("d", mnvs, max_len, Counter())
+    assert sorted(
+        name[: -len(mnv_cache.CACHE_EXTENSION)] for name in os.listdir(cache_dir)
+    ) == ["b", "c", "d"]
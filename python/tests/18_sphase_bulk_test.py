@@ -0,0 +1,162 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the sphase_bulk module
+"""
+from collections import Counter
+
+import pytest
+from casmsmartphase import sphase_bulk
+from casmsmartphase.MNVMerge import parse_phased_lines
+from casmsmartphase.MNVMerge import parse_sphase_output
+
+
+SPOUT = "test_data/sample.phased.output"
+SPOUT_EXCEPT = "test_data/sample.phased.except.output"
+SPOUT_TRINUC = "test_data/sample.phased.trinuc.output"
+SPOUT_TRIPLET = "test_data/test_phase_triplet.out"
+CUTOFF = 0.0
+EXCLUDE = 2
+PAIR = "1-100-102\tchr1-101-G-A\tchr1-102-G-A\t1\t0.5\n"
+
+
+def line_pairs(path, cutoff, exclude_flags):
+    counts = Counter()
+    with open(path) as lines:
+        pairs = list(parse_phased_lines(lines, cutoff, exclude_flags, counts))
+    return pairs, counts
+
+
+def bulk_pairs(path, cutoff, exclude_flags, workers=1):
+    counts = Counter()
+    columns = sphase_bulk.parse_pair_file(
+        path, cutoff, exclude_flags, parse_phased_lines, counts, workers
+    )
+    return list(sphase_bulk.iter_pairs(columns)), counts
+
+
+@pytest.mark.parametrize(
+    "data, exp_offset",
+    [
+        (b"a\nb\n", 4),
+        (b"Denovo count: 0\n", 0),
+        (b"a\nDenovo count: 0\nb\n", 2),
+        (b"a Denovo count\n", 15),
+    ],
+)
+def test_find_trailer(data, exp_offset):
+    assert sphase_bulk.find_trailer(data) == exp_offset
+
+
+@pytest.mark.parametrize("n_ranges", [1, 2, 3, 10])
+def test_split_ranges(n_ranges):
+    data = b"aaaa\nbb\nc\ndddddd\n"
+    ranges = sphase_bulk.split_ranges(data, len(data), n_ranges)
+    assert b"".join(data[start:end] for (start, end) in ranges) == data
+    assert all(data[end - 1 : end] == b"\n" for (_start, end) in ranges)
+    assert len(ranges) <= n_ranges
+
+
+@pytest.mark.parametrize(
+    "lines",
+    [
+        # Not whitespace separated fields of a phased pair
+        "1-100-102 chr1-101-G-A\n",
+        " " + PAIR,
+        PAIR + "\n",
+        PAIR.replace("\t1\t", "\t1.0\t"),
+        PAIR.replace("-G-A", "-GA"),
+        PAIR.replace("1-100-102", "1-100"),
+        PAIR.replace("\t0.5", "\t0.5\xc2\xa0"),
+    ],
+)
+def test_parse_pair_bytes_irregular(lines):
+    counts = Counter()
+    assert sphase_bulk.parse_pair_bytes(lines.encode(), CUTOFF, EXCLUDE, counts) is None
+    assert not counts
+
+
+@pytest.mark.parametrize(
+    "spout",
+    [SPOUT, SPOUT_EXCEPT, SPOUT_TRINUC, SPOUT_TRIPLET],
+)
+@pytest.mark.parametrize("cutoff, exclude_flags", [(0.0, 2), (0.2, 1), (0.0, 0)])
+def test_parse_pair_file_matches_lines(spout, cutoff, exclude_flags):
+    assert bulk_pairs(spout, cutoff, exclude_flags) == line_pairs(
+        spout, cutoff, exclude_flags
+    )
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+@pytest.mark.parametrize("cutoff, exclude_flags", [(0.0, 2), (0.5, 0)])
+def test_parse_pair_file_ranges(monkeypatch, data, workers, cutoff, exclude_flags):
+    spout = data["smart_phase_output"]
+    monkeypatch.setattr(sphase_bulk, "CHUNK_BYTES", 5000)
+    (pairs, counts) = bulk_pairs(spout, cutoff, exclude_flags, workers)
+    assert (pairs, counts) == line_pairs(spout, cutoff, exclude_flags)
+    assert counts["pairs_accepted"] > 0
+
+
+def test_parse_pair_file_irregular_range(tmp_path, monkeypatch):
+    # Only the range with the line of two fields is parsed line by line
+    spout = tmp_path / "mixed.phased.output"
+    lines = (
+        [PAIR] * 50 + ["1-100-102   chr1-101-G-A\n"] + [PAIR.replace("\t", " ")] * 50
+    )
+    spout.write_text("".join(lines) + "Denovo count: 0\nCis count: 1\n")
+    monkeypatch.setattr(sphase_bulk, "CHUNK_BYTES", 1000)
+    (pairs, counts) = bulk_pairs(str(spout), CUTOFF, EXCLUDE)
+    assert pairs == [("chr1", 101, 102)] * 100
+    assert counts == Counter(pairs_accepted=100, pairs_skipped=1)
+
+
+def test_parse_pair_file_empty(tmp_path):
+    spout = tmp_path / "empty.phased.output"
+    spout.write_text("")
+    assert bulk_pairs(str(spout), CUTOFF, EXCLUDE) == ([], Counter())
+
+
+def test_parse_pair_file_err(tmp_path):
+    spout = tmp_path / "bad.phased.output"
+    spout.write_text(PAIR + PAIR.replace("\t1\t", "\tx\t"))
+    with pytest.raises(ValueError) as err:
+        bulk_pairs(str(spout), CUTOFF, EXCLUDE)
+    with pytest.raises(ValueError) as exp_err:
+        line_pairs(str(spout), CUTOFF, EXCLUDE)
+    assert str(err.value) == str(exp_err.value)
+
+
+def test_parse_sphase_output_workers(monkeypatch, data):
+    spout = data["smart_phase_output"]
+    monkeypatch.setattr(sphase_bulk, "CHUNK_BYTES", 5000)
+    assert parse_sphase_output(
+        spout, CUTOFF, EXCLUDE, {}, workers=2
+    ) == parse_sphase_output(spout, CUTOFF, EXCLUDE, {})
@@ -0,0 +1,139 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the threaded module
+"""
+import gzip
+import io
+import threading
+
+import pytest
+import vcfpy
+from casmsmartphase import threaded
+from casmsmartphase.MNVMerge import MNVMerge
+
+INPUT_VCF = "test_data/test_input_hethom.vcf.gz"
+SPOUT = "test_data/sample.phased.output"
+BED_INPUT_HOM = "test_data/expected_output_hethom.bed"
+RUN_SCRIPT = "pytest_threaded"
+ARG_STR = "x=test_Arg_str"
+CUTOFF = 0.0
+EXCLUDE = 2
+LINES = [f"line {i}\n" for i in range(1000)]
+
+
+class FailingStream(io.StringIO):
+    def write(self, text):
+        raise OSError("disk full")
+
+
+@pytest.mark.parametrize(
+    "lines",
+    [io.StringIO("".join(LINES)), iter(LINES), LINES],
+    ids=["stream", "iterator", "list"],
+)
+def test_read_ahead(monkeypatch, lines):
+    monkeypatch.setattr(threaded, "READ_CHARS", 100)
+    monkeypatch.setattr(threaded, "READ_LINES", 7)
+    assert list(threaded.read_ahead(lines, depth=2)) == LINES
+
+
+def test_read_ahead_error():
+    def lines():
+        yield LINES[0]
+        raise OSError("truncated input")
+
+    with pytest.raises(OSError, match="truncated input"):
+        list(threaded.read_ahead(lines()))
+
+
+def test_read_ahead_stopped(monkeypatch):
+    monkeypatch.setattr(threaded, "READ_LINES", 1)
+    lines = threaded.read_ahead(iter(LINES), depth=1)
+    assert next(lines) == LINES[0]
+    lines.close()
+    assert not any(thread.name == "read_ahead" for thread in threading.enumerate())
+
+
+def test_threaded_writer(monkeypatch):
+    monkeypatch.setattr(threaded, "WRITE_BATCH", 3)
+    reader = vcfpy.Reader.from_path(INPUT_VCF)
+    records = list(reader)
+    expected = io.StringIO()
+    out = io.StringIO()
+    out.close = lambda: None
+    for (stream, writer) in (
+        (expected, vcfpy.Writer.from_stream(expected, reader.header)),
+        (out, threaded.ThreadedWriter(vcfpy.Writer.from_stream(out, reader.header))),
+    ):
+        for (i, record) in enumerate(records):
+            if i % 2:
+                writer.write_record(record)
+            else:
+                writer.stream.write(f"line {i}\n")
+    writer.close()
+    assert out.getvalue() == expected.getvalue()
+
+
+def test_threaded_writer_error(monkeypatch):
+    monkeypatch.setattr(threaded, "WRITE_BATCH", 1)
+    header = vcfpy.Reader.from_path(INPUT_VCF).header
+    writer = vcfpy.Writer.from_stream(io.StringIO(), header)
+    writer.stream = FailingStream()
+    threaded_writer = threaded.ThreadedWriter(writer)
+    with pytest.raises(OSError, match="disk full"):
+        for line in LINES:
+            threaded_writer.write(line)
+        threaded_writer.close()
+
+
+@pytest.mark.parametrize("output", ["output.vcf", "output.vcf.gz"])
+def test_pipelined_matches_serial(tmp_path, output):
+    outputs = []
+    for pipelined in (False, True):
+        out_dir = tmp_path / str(pipelined)
+        out_dir.mkdir()
+        out_path = str(out_dir / output)
+        MNVMerge(
+            INPUT_VCF,
+            out_path,
+            SPOUT,
+            CUTOFF,
+            EXCLUDE,
+            RUN_SCRIPT,
+            ARG_STR,
+            BED_INPUT_HOM,
+            pipelined=pipelined,
+        ).perform_mnv_merge_to_vcf()
+        opener = gzip.open if output.endswith(".gz") else open
+        with opener(out_path, "rt") as out:
+            outputs.append(out.read())
+    assert outputs[0] == outputs[1]
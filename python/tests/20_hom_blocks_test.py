@@ -0,0 +1,127 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the hom_blocks module
+"""
+import gzip
+
+import pysam
+import pytest
+from casmsmartphase import hom_blocks
+from casmsmartphase.mnv_cache import hom_blocks_digest
+from casmsmartphase.mnv_chains import MNVChainBuilder
+from casmsmartphase.MNVMerge import parse_homs_bed_to_dict
+
+HETHOM_BED = "test_data/expected_output_hethom.bed"
+BED_LINES = (
+    "chr2\t199\t201\t\thom\n"
+    "chr1\t1000\t1003\t\thom\n"
+    "chr1\t499\t501\n"
+    "\n"
+    "chr1\t99\t101\t\thom\n"
+    "chr1\t1000\t1003\t\thom\n"
+)
+
+
+def as_lists(blocks):
+    return {
+        contig: list(contig_blocks.items())
+        for (contig, contig_blocks) in blocks.items()
+    }
+
+
+def test_parse_hom_bytes():
+    blocks = hom_blocks.parse_hom_bytes(BED_LINES.encode())
+    assert list(blocks) == ["chr2", "chr1"]
+    # Sorted, the repeated block kept once and the het block skipped
+    assert as_lists(blocks) == {
+        "chr2": [(200, 201)],
+        "chr1": [(100, 101), (1001, 1003)],
+    }
+
+
+def test_load_matches_legacy_dict():
+    blocks = hom_blocks.load_hom_blocks(HETHOM_BED)
+    assert as_lists(blocks) == as_lists(
+        hom_blocks.as_hom_blocks(parse_homs_bed_to_dict(HETHOM_BED))
+    )
+    assert as_lists(blocks) == {
+        "chr1": [(1866692, 1866693)],
+        "chr3": [(45636146, 45636147)],
+    }
+    assert hom_blocks_digest(blocks) == hom_blocks_digest(
+        parse_homs_bed_to_dict(HETHOM_BED)
+    )
+
+
+def test_load_gz_and_regions(tmp_path):
+    bed = str(tmp_path / "blocks.bed")
+    with open(HETHOM_BED) as lines, open(bed, "w") as out:
+        out.write(lines.read())
+    with gzip.open(bed + ".plain.gz", "wt") as out:
+        out.write(open(bed).read())
+    assert as_lists(hom_blocks.load_hom_blocks(bed + ".plain.gz")) == as_lists(
+        hom_blocks.load_hom_blocks(bed)
+    )
+    pysam.tabix_index(bed, preset="bed", force=True)
+    assert as_lists(hom_blocks.load_hom_blocks(bed + ".gz", [("chr3", 0, None)])) == {
+        "chr3": [(45636146, 45636147)]
+    }
+    # Contigs not in the index have no blocks
+    assert hom_blocks.load_hom_blocks(bed + ".gz", [("chr9", 0, None)]) == {}
+
+
+@pytest.mark.parametrize(
+    "lines,message",
+    [
+        ("chr1\t99\t100\t\thom\n", "chr1:100-100 is not of adjacent SNVs"),
+        (
+            "chr1\t99\t102\t\thom\nchr1\t100\t103\t\thom\n",
+            "chr1:100-102 and chr1:101-103 overlap",
+        ),
+        ("chr1\t99\t101\t\thom\nchr1\t99\n", "Invalid bed line"),
+    ],
+)
+def test_parse_hom_bytes_invalid(lines, message):
+    with pytest.raises(ValueError, match=message):
+        hom_blocks.parse_hom_bytes(lines.encode())
+
+
+def test_build_with_blocks():
+    builder = MNVChainBuilder()
+    builder.add_pair("chr1", 10, 11)
+    builder.add_pair("chr1", 100, 101)
+    blocks = hom_blocks.as_hom_blocks(
+        {"chr1": [(100, 102, True)], "chr2": [(5, 6, True)]}
+    )
+    (mnvs, max_length) = builder.build(blocks)
+    assert as_lists(mnvs) == {"chr1": [(10, 11), (100, 102)], "chr2": [(5, 6)]}
+    assert max_length == 3
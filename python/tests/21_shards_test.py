@@ -0,0 +1,162 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the shards module, and of scattering smart-phase across the shards
+of a bed and merging their phased output as one
+"""
+import fake_smart_phase
+import pytest
+from casmsmartphase import shards
+from casmsmartphase import vcf_to_bed
+from casmsmartphase.mnv_cache import cache_key
+from casmsmartphase.MNVMerge import MNVMerge
+
+RUN_SCRIPT = "pytest_shards"
+ARG_STR = "x=test_Arg_str"
+CUTOFF = 0.0
+EXCLUDE = 2
+N_SHARDS = 3
+
+
+def read_lines(path):
+    with open(path) as lines:
+        return lines.readlines()
+
+
+@pytest.mark.parametrize(
+    "weights,n_shards,exp_shards",
+    [
+        ([1] * 10, 3, [0, 0, 0, 1, 1, 1, 1, 2, 2, 2]),
+        ([10, 1, 1, 1, 1], 2, [0, 1, 1, 1, 1]),
+        ([2, 2], 4, [1, 3]),
+        ([5], 1, [0]),
+    ],
+)
+def test_assign_shards(weights, n_shards, exp_shards):
+    assert shards.assign_shards(weights, n_shards) == exp_shards
+
+
+def test_shard_blocks():
+    blocks = [
+        (0, ("chr1", 9, 11, True)),
+        (1, ("chr1", 19, 21, True)),
+        (0, ("chr1", 29, 31, False)),
+        (0, ("chr2", 9, 19, True)),
+    ]
+    assert list(shards.shard_blocks(blocks, 2, 2)) == [
+        (0, ("chr1", 9, 11, True)),
+        (1, ("chr1", 29, 31, False)),
+        (1, ("chr2", 9, 19, True)),
+        (3, ("chr1", 19, 21, True)),
+    ]
+    assert [index for (index, _block) in shards.shard_blocks(blocks, 2, 2, "span")] == [
+        0,
+        0,
+        1,
+        3,
+    ]
+
+
+@pytest.mark.parametrize("shard_by", shards.SHARD_BY)
+@pytest.mark.parametrize("n_shards", [2, N_SHARDS, 10000])
+def test_run_parse_shards(tmp_path, data, shard_by, n_shards):
+    output = str(tmp_path / "shard.{shard}.bed")
+    vcf_to_bed.run_parse(
+        data["vcf_gz"], output, True, shards=n_shards, shard_by=shard_by
+    )
+    shard_lines = [
+        read_lines(output.replace("{shard}", str(shard)))
+        for shard in range(1, n_shards + 1)
+    ]
+    # Shards are contiguous runs of the blocks of the whole bed
+    assert sum(shard_lines, []) == read_lines(data["bed"])
+    if n_shards == N_SHARDS and shard_by == "count":
+        sizes = list(map(len, shard_lines))
+        assert max(sizes) - min(sizes) <= 1
+
+
+@pytest.mark.parametrize(
+    "output,names,n_shards,message",
+    [
+        ("out.bed", ["TUMOUR"], 2, "Output must include {shard}"),
+        ("{shard}.bed", ["NORMAL", "TUMOUR"], 2, "Output must include {sample}"),
+        (None, ["TUMOUR"], 2, "Output must include {shard}"),
+    ],
+)
+def test_bed_output_paths_invalid(output, names, n_shards, message):
+    with pytest.raises(ValueError, match=message):
+        vcf_to_bed.bed_output_paths(output, names, n_shards)
+
+
+def test_bed_output_paths():
+    assert vcf_to_bed.bed_output_paths("{sample}.{shard}.bed", ["N", "T"], 2) == [
+        "N.1.bed",
+        "N.2.bed",
+        "T.1.bed",
+        "T.2.bed",
+    ]
+
+
+def phase(bed, output):
+    fake_smart_phase.main(["-g", bed, "-o", output])
+    return output
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_merge_sharded_output(tmp_path, data, streaming):
+    beds = str(tmp_path / "shard.{shard}.bed")
+    vcf_to_bed.run_parse(data["vcf_gz"], beds, True, shards=N_SHARDS)
+    beds = [beds.replace("{shard}", str(shard)) for shard in range(1, N_SHARDS + 1)]
+    spouts = [phase(bed, bed + ".phased.output") for bed in beds]
+    whole = phase(data["bed"], str(tmp_path / "whole.phased.output"))
+    outputs = []
+    for (spout, bed) in ((whole, data["bed"]), (spouts, beds)):
+        output = str(tmp_path / f"output.{len(outputs)}.vcf")
+        MNVMerge(
+            data["vcf"],
+            output,
+            spout,
+            CUTOFF,
+            EXCLUDE,
+            RUN_SCRIPT,
+            ARG_STR,
+            bed,
+            streaming=streaming,
+        ).perform_mnv_merge_to_vcf()
+        outputs.append(read_lines(output))
+    assert outputs[0] == outputs[1]
+    # The cache key doesn't depend on the order of the shards
+    assert cache_key(spouts, CUTOFF, EXCLUDE, beds) == cache_key(
+        spouts[::-1], CUTOFF, EXCLUDE, beds[::-1]
+    )
+    assert cache_key(spouts, CUTOFF, EXCLUDE, beds) != cache_key(
+        whole, CUTOFF, EXCLUDE, data["bed"]
+    )
@@ -0,0 +1,123 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the profiling module
+"""
+import pstats
+import sys
+import time
+import tracemalloc
+
+from casmsmartphase import profiling
+from casmsmartphase import stats
+from casmsmartphase.cli import cli
+from click.testing import CliRunner
+
+INPUT_VCF = "test_data/test_input.vcf.gz"
+SPHASE_OUT = "test_data/sample.phased.output"
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_fold_stack():
+    stack = profiling.fold_stack("MainThread", sys._getframe())
+    assert stack.startswith("MainThread;")
+    assert ";test_fold_stack (22_profiling_test.py:" in stack
+    assert stack.count(";") > 1
+
+
+def test_stack_sampler(tmp_path):
+    sampler = profiling.StackSampler(0.001)
+    sampler.start()
+    busy(0.2)
+    sampler.stop()
+    assert any(";busy (" in stack for stack in sampler.counts)
+    path = str(tmp_path / "out.folded")
+    sampler.write(path)
+    with open(path) as lines:
+        counts = [int(line.rsplit(" ", 1)[1]) for line in lines]
+    assert sum(counts) == sum(sampler.counts.values())
+    assert counts == sorted(counts, reverse=True)
+
+
+def test_profile_merge(tmp_path):
+    outdir = tmp_path / "profile"
+    response = CliRunner().invoke(
+        cli,
+        [
+            "--profile",
+            str(outdir),
+            "--profile-memory",
+            "merge-mnvs",
+            "-f",
+            INPUT_VCF,
+            "-p",
+            SPHASE_OUT,
+            "-o",
+            str(tmp_path / "out.vcf"),
+        ],
+    )
+    assert response.exit_code == 0, response.output
+    profile = list(outdir.glob("merge-mnvs.*.pstats"))
+    assert len(profile) == 1
+    functions = {name for (_file, _line, name) in pstats.Stats(str(profile[0])).stats}
+    assert "merge_snv_to_mnv" in functions
+    snapshots = sorted(path.name for path in outdir.glob("*.tracemalloc"))
+    # A snapshot at the end of each stage and of the run
+    assert [name.split(".")[-2] for name in snapshots] == [
+        "phased_parse",
+        "header",
+        "records",
+        "write",
+        "end",
+    ]
+    tracemalloc.Snapshot.load(str(outdir / snapshots[-1]))
+    assert not tracemalloc.is_tracing()
+    assert stats.STAGE_HOOKS == []
+
+
+def test_profile_sample_from_env(tmp_path):
+    outdir = tmp_path / "profile"
+    response = CliRunner().invoke(
+        cli,
+        ["generate-bed", "-f", INPUT_VCF, "-o", str(tmp_path / "out.bed")],
+        env={
+            "CASMSMARTPHASE_PROFILE": str(outdir),
+            "CASMSMARTPHASE_PROFILE_SAMPLE": "0.001",
+        },
+    )
+    assert response.exit_code == 0, response.output
+    assert len(list(outdir.glob("generate-bed.*.folded"))) == 1
+    assert not list(outdir.glob("*.pstats"))
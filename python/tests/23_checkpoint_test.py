@@ -0,0 +1,160 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the checkpoint module, resuming merges stopped part way
+"""
+import gzip
+import json
+import os
+
+import pysam
+import pytest
+from casmsmartphase import checkpoint
+from casmsmartphase.MNVMerge import MNVMerge
+
+
+RUN_SCRIPT = "pytest_checkpoint"
+ARG_STR = "x=test_Arg_str"
+CUTOFF = 0.0
+EXCLUDE = 2
+# Stop the first run after merging this many MNVs
+STOP_AFTER = 60
+
+
+class Stopped(Exception):
+    pass
+
+
+def merge(data, output, arg_str=ARG_STR, interval=0):
+    merge_obj = MNVMerge(
+        data["vcf"],
+        output,
+        data["smart_phase_output"],
+        CUTOFF,
+        EXCLUDE,
+        RUN_SCRIPT,
+        arg_str,
+        data["bed"],
+        checkpoint_interval=interval,
+    )
+    merge_obj.perform_mnv_merge_to_vcf()
+    return merge_obj
+
+
+def stop_merge(data, output, monkeypatch):
+    """
+    Run a merge stopped after STOP_AFTER MNVs, as if the process was killed
+    """
+    merge_snv_to_mnv = MNVMerge.merge_snv_to_mnv
+    merged = []
+
+    def stopping_merge(self, snvs):
+        if len(merged) == STOP_AFTER:
+            raise Stopped()
+        merged.append(snvs)
+        return merge_snv_to_mnv(self, snvs)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(MNVMerge, "merge_snv_to_mnv", stopping_merge)
+        with pytest.raises(Stopped):
+            merge(data, output)
+
+
+def read_output(path):
+    with (gzip.open(path, "rt") if path.endswith(".gz") else open(path)) as text:
+        return text.read()
+
+
+@pytest.mark.parametrize("ext", [".vcf", ".vcf.gz"])
+def test_resume(tmp_path, data, monkeypatch, ext):
+    monkeypatch.setattr(checkpoint, "CHECK_EVERY", 100)
+    expected = str(tmp_path / f"expected{ext}")
+    exp_stats = merge(data, expected, interval=None).stats
+    output = str(tmp_path / f"output{ext}")
+    stop_merge(data, output, monkeypatch)
+    with open(output + checkpoint.CHECKPOINT_EXTENSION) as saved:
+        assert json.load(saved)["lines"] > 0
+    assert os.path.exists(output + checkpoint.MNVS_EXTENSION)
+
+    def no_parse(self):
+        raise AssertionError("MNVs parsed when resuming")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(MNVMerge, "load_mnvs", no_parse)
+        stats = merge(data, output).stats
+    assert read_output(output) == read_output(expected)
+    del stats.counts["checkpoints"]
+    assert stats.counts == exp_stats.counts
+    assert stats.mnv_lengths == exp_stats.mnv_lengths
+    assert not os.path.exists(output + checkpoint.CHECKPOINT_EXTENSION)
+    assert not os.path.exists(output + checkpoint.MNVS_EXTENSION)
+    if ext == ".vcf.gz":
+        with pysam.TabixFile(output) as resumed, pysam.TabixFile(expected) as exp:
+            assert resumed.contigs == exp.contigs
+            for contig in exp.contigs:
+                assert list(resumed.fetch(contig, 5000, 50000)) == list(
+                    exp.fetch(contig, 5000, 50000)
+                )
+
+
+def test_resume_other_run(tmp_path, data, monkeypatch):
+    monkeypatch.setattr(checkpoint, "CHECK_EVERY", 100)
+    expected = str(tmp_path / "expected.vcf")
+    merge(data, expected, "x=other", interval=None)
+    output = str(tmp_path / "output.vcf")
+    stop_merge(data, output, monkeypatch)
+    # A checkpoint of other arguments is ignored and the merge starts again
+    merge(data, output, "x=other")
+    assert read_output(output) == read_output(expected)
+
+
+def test_skip_lines():
+    lines = ["chr1\t10\t.\n", "chr1\t12\t.\n", "chr2\t5\t.\n"]
+    assert list(checkpoint.skip_lines(iter(lines), 2, ["chr1", 12])) == lines[2:]
+    assert list(checkpoint.skip_lines(iter(lines), 0, None)) == lines
+    with pytest.raises(ValueError, match="Input VCF differs"):
+        checkpoint.skip_lines(iter(lines), 2, ["chr1", 11])
+    with pytest.raises(ValueError, match="Input VCF differs"):
+        checkpoint.skip_lines(iter(lines[:1]), 2, ["chr1", 12])
+
+
+def test_checkpoint_stdout(data):
+    with pytest.raises(ValueError, match="Checkpoints need the output"):
+        MNVMerge(
+            data["vcf"],
+            "-",
+            data["smart_phase_output"],
+            CUTOFF,
+            EXCLUDE,
+            RUN_SCRIPT,
+            ARG_STR,
+            checkpoint_interval=60,
+        )
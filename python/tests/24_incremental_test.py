@@ -0,0 +1,238 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the incremental module, re-merging the MNVs changed from a
+previous merged output
+"""
+import gzip
+
+import pysam
+import pytest
+import synthetic_data
+from casmsmartphase import incremental
+from casmsmartphase.mnv_chains import ContigMNVs
+from casmsmartphase.MNVMerge import MNVMerge
+
+RUN_SCRIPT = "pytest_incremental"
+ARG_STR = "x=test_Arg_str"
+CUTOFF = 0.0
+EXCLUDE = 2
+
+
+def write_spout(path, blocks, keep):
+    with open(path, "w") as out:
+        for (idx, block) in enumerate(blocks):
+            if keep(idx, block):
+                out.writelines(synthetic_data.sphase_lines(block))
+        out.write("Denovo count: 0\n")
+    return path
+
+
+def merge(
+    vcf, output, spout, previous=None, mnv_encoding="incremental", arg_str=ARG_STR
+):
+    merge_obj = MNVMerge(
+        vcf,
+        output,
+        spout,
+        CUTOFF,
+        EXCLUDE,
+        RUN_SCRIPT,
+        arg_str,
+        previous=previous,
+        mnv_encoding=mnv_encoding,
+    )
+    merge_obj.perform_mnv_merge_to_vcf()
+    return merge_obj
+
+
+def read_output(path):
+    with (gzip.open(path, "rt") if path.endswith(".gz") else open(path)) as text:
+        lines = text.readlines()
+    header = [line for line in lines if line.startswith("#")]
+    return header, lines[len(header) :]
+
+
+def test_changed_spans():
+    old = {
+        "chr1": ContigMNVs.from_dict({10: 11, 20: 22, 30: 31}),
+        "chr2": ContigMNVs.from_dict({5: 6}),
+    }
+    new = {
+        "chr1": ContigMNVs.from_dict({10: 11, 21: 23, 30: 32}),
+        "chr2": ContigMNVs.from_dict({5: 6}),
+        "chr3": ContigMNVs.from_dict({1: 2}),
+    }
+    assert incremental.changed_spans(old, new, ["chr1", "chr2"]) == {
+        "chr1": ([20, 30], [23, 32]),
+    }
+
+
+def test_merge_previous():
+    lines = [
+        f"{contig}\t{pos}\t.\n"
+        for (contig, pos) in [
+            ("chr1", 1),
+            ("chr1", 5),
+            ("chr1", 6),
+            ("chr1", 9),
+            ("chr2", 3),
+        ]
+    ]
+    written = []
+    copied = incremental.merge_previous(
+        lines,
+        {"chr1": ([5, 7, 20], [6, 8, 21])},
+        written.extend,
+        lambda contig, idx: written.append((contig, idx)),
+    )
+    assert copied == 3
+    assert written == [
+        lines[0],
+        ("chr1", 0),
+        ("chr1", 1),
+        lines[3],
+        ("chr1", 2),
+        lines[4],
+    ]
+
+
+@pytest.mark.parametrize("vcf_key", ["vcf", "vcf_gz"])
+@pytest.mark.parametrize("ext", [".vcf", ".vcf.gz"])
+def test_incremental_merge(tmp_path, data, vcf_key, ext):
+    blocks = data["blocks"]
+    old_spout = write_spout(
+        str(tmp_path / "old.phased.output"), blocks, lambda idx, _b: idx % 7
+    )
+    new_spout = write_spout(
+        str(tmp_path / "new.phased.output"), blocks, lambda idx, _b: idx % 5
+    )
+    previous = str(tmp_path / f"previous{ext}")
+    merge(data[vcf_key], previous, old_spout)
+    expected = str(tmp_path / f"expected{ext}")
+    merge(data[vcf_key], expected, new_spout)
+    output = str(tmp_path / f"output{ext}")
+    stats = merge(data[vcf_key], output, new_spout, previous).stats
+    (header, records) = read_output(output)
+    assert header == read_output(expected)[0]
+    assert records == read_output(expected)[1]
+    assert stats.counts["spans_merged"] > 0
+    assert stats.counts["records_reused"] > len(records) // 2
+    if ext == ".vcf.gz":
+        with pysam.TabixFile(output) as tabix:
+            assert len(list(tabix.fetch("chr2"))) == sum(
+                record.startswith("chr2\t") for record in records
+            )
+
+
+def test_incremental_merge_header(tmp_path, data):
+    blocks = data["blocks"]
+    old_spout = write_spout(
+        str(tmp_path / "old.phased.output"),
+        blocks,
+        lambda _idx, block: block[2] - block[1] < 3,
+    )
+    new_spout = write_spout(
+        str(tmp_path / "new.phased.output"), blocks, lambda _idx, _b: True
+    )
+    previous = str(tmp_path / "previous.vcf")
+    merge(data["vcf"], previous, old_spout)
+    expected = str(tmp_path / "expected.vcf")
+    merge(data["vcf"], expected, new_spout)
+    output = str(tmp_path / "output.vcf")
+    merge(data["vcf"], output, new_spout, previous)
+    # MNVs of 3 SNVs are added, so the header is written as in a full merge
+    assert read_output(output) == read_output(expected)
+    assert read_output(output)[0] != read_output(previous)[0]
+
+
+def test_incremental_merge_process_line(tmp_path, data):
+    blocks = data["blocks"]
+    old_spout = write_spout(
+        str(tmp_path / "old.phased.output"), blocks, lambda idx, _b: idx % 7
+    )
+    new_spout = write_spout(
+        str(tmp_path / "new.phased.output"), blocks, lambda idx, _b: idx % 5
+    )
+    previous = str(tmp_path / "previous.vcf")
+    merge(data["vcf"], previous, old_spout, arg_str="x=previous_Arg_str")
+    expected = str(tmp_path / "expected.vcf")
+    merge(data["vcf"], expected, new_spout)
+    output = str(tmp_path / "output.vcf")
+    merge(data["vcf"], output, new_spout, previous)
+    process_lines = [
+        line for line in read_output(output)[0] if line.startswith("##vcfProcessLog")
+    ]
+    # The process line added is of this run, not the run of the previous output
+    assert ARG_STR in process_lines[-1]
+    assert not any("previous_Arg_str" in line for line in process_lines)
+    assert read_output(output) == read_output(expected)
+
+
+@pytest.mark.parametrize(
+    "previous_encoding,mnv_encoding",
+    [("compact", "incremental"), ("incremental", "compact")],
+)
+def test_incremental_other_encoding(
+    tmp_path, data, caplog, previous_encoding, mnv_encoding
+):
+    blocks = data["blocks"]
+    old_spout = write_spout(
+        str(tmp_path / "old.phased.output"), blocks, lambda idx, _b: idx % 7
+    )
+    new_spout = write_spout(
+        str(tmp_path / "new.phased.output"), blocks, lambda idx, _b: idx % 5
+    )
+    previous = str(tmp_path / "previous.vcf")
+    merge(data["vcf"], previous, old_spout, mnv_encoding=previous_encoding)
+    assert incremental.PreviousOutput(previous).mnv_encoding == previous_encoding
+    expected = str(tmp_path / "expected.vcf")
+    merge(data["vcf"], expected, new_spout, mnv_encoding=mnv_encoding)
+    output = str(tmp_path / "output.vcf")
+    stats = merge(data["vcf"], output, new_spout, previous, mnv_encoding).stats
+    # Records of another encoding aren't copied, the merge is done in full
+    assert read_output(output) == read_output(expected)
+    assert "records_reused" not in stats.counts
+    assert f"{previous_encoding} MNV encoding, not {mnv_encoding}" in caplog.text
+
+
+def test_incremental_same_output(data):
+    with pytest.raises(ValueError, match="Output must differ"):
+        MNVMerge(
+            data["vcf"],
+            "out.vcf",
+            data["smart_phase_output"],
+            CUTOFF,
+            EXCLUDE,
+            RUN_SCRIPT,
+            ARG_STR,
+            previous="./out.vcf",
+        )
@@ -0,0 +1,141 @@
+# LICENSE
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of CASM-Smart-Phase.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+"""
+Tests of the api module, merging MNVs in memory
+"""
+import asyncio
+import io
+
+import pytest
+import vcfpy
+from casmsmartphase import api
+from casmsmartphase.hom_blocks import load_hom_blocks
+from casmsmartphase.MNVMerge import MNVMerge
+from casmsmartphase.MNVMerge import parse_phased_lines
+
+
+RUN_SCRIPT = "pytest_api"
+ARG_STR = "x=test_Arg_str"
+CUTOFF = 0.0
+EXCLUDE = 2
+
+
+def read_pairs(data):
+    with open(data["smart_phase_output"]) as lines:
+        return list(parse_phased_lines(lines, CUTOFF, EXCLUDE))
+
+
+def serialise(header, records):
+    buffer = io.StringIO()
+    writer = vcfpy.Writer.from_stream(buffer, header)
+    for record in records:
+        writer.write_record(record)
+    return buffer.getvalue().splitlines(keepends=True)
+
+
+def parse(lines):
+    """
+    Records of VCF lines, serialised as vcfpy does
+    """
+    reader = vcfpy.Reader.from_stream(io.StringIO("".join(lines)))
+    return serialise(reader.header, reader)
+
+
+def merged_file(data, tmp_path, mnv_encoding):
+    output = str(tmp_path / f"{mnv_encoding}.vcf")
+    MNVMerge(
+        data["vcf"],
+        output,
+        data["smart_phase_output"],
+        CUTOFF,
+        EXCLUDE,
+        RUN_SCRIPT,
+        ARG_STR,
+        data["bed"],
+        mnv_encoding=mnv_encoding,
+    ).perform_mnv_merge_to_vcf()
+    with open(output) as lines:
+        # All but the process line of the merge
+        return [line for line in lines if RUN_SCRIPT not in line]
+
+
+@pytest.mark.parametrize("mnv_encoding", ["incremental", "compact"])
+def test_merge_records(data, tmp_path, mnv_encoding):
+    merge = api.StreamingMerge(
+        read_pairs(data), load_hom_blocks([data["bed"]]), mnv_encoding
+    )
+    with vcfpy.Reader.from_path(data["vcf"]) as reader:
+        lines = serialise(merge.header(reader.header), merge.merge(reader))
+    # Lines not merged are copied verbatim to the file, not serialised
+    assert parse(lines) == parse(merged_file(data, tmp_path, mnv_encoding))
+
+
+@pytest.mark.parametrize("batch", [1, 7, 100000])
+@pytest.mark.parametrize("source", ["async", "sync"])
+def test_amerge_records(data, monkeypatch, batch, source):
+    monkeypatch.setattr(api, "ASYNC_BATCH", batch)
+    pairs = read_pairs(data)
+    hom_blocks = load_hom_blocks([data["bed"]])
+    with vcfpy.Reader.from_path(data["vcf"]) as reader:
+        header = api.StreamingMerge(pairs, hom_blocks).header(reader.header)
+        records = list(reader)
+    expected = serialise(header, api.merge_records(records, pairs, hom_blocks))
+
+    async def produce():
+        for record in records:
+            await asyncio.sleep(0)
+            yield record
+
+    async def consume():
+        source_records = produce() if source == "async" else records
+        return [
+            record
+            async for record in api.amerge_records(source_records, pairs, hom_blocks)
+        ]
+
+    assert serialise(header, asyncio.run(consume())) == expected
+
+
+def test_merge_warnings(data):
+    with vcfpy.Reader.from_path(data["vcf"]) as reader:
+        records = list(reader)
+    for record in records:
+        record.QUAL = 30
+    merge = api.StreamingMerge(read_pairs(data))
+    merged = list(merge.merge(records))
+    n_mnvs = sum(len(record.REF) > 1 for record in merged)
+    assert n_mnvs > 0
+    assert merge.merge_warnings == {"qual": n_mnvs}
+
+
+def test_unknown_encoding():
+    with pytest.raises(ValueError, match="Unknown MNV encoding"):
+        api.StreamingMerge([], mnv_encoding="other")